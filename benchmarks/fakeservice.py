@@ -0,0 +1,510 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import SocketServer
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from collections import defaultdict
+
+from tattle.model import get_endpoint
+from tattle.network import JIRA_HOST_SUFFIX
+from tattle.ratelimit import RATE_LIMIT_LIMIT
+from tattle.ratelimit import RATE_LIMIT_REMAINING
+from tattle.ratelimit import RATE_LIMIT_RESET
+from tattle.ratelimit import RETRY_AFTER
+
+# requests are redirected to the fake service along with the host they
+# were sent to, which tells the GitHub requests from the JIRA requests
+FORWARDED_HOST = 'X-Forwarded-Host'
+# the path of the service's own request counters
+STATS_PATH = '/_stats'
+
+GITHUB = 'github'
+JIRA = 'jira'
+
+DEFAULT_PER_PAGE = 30
+MAX_PER_PAGE = 100
+ISSUE_PREFIX = 'CFY'
+ISSUE_STATUSES = ['Open', 'In Progress', 'Resolved', 'Closed']
+# every repo was last pushed at this time, so repeated runs find the
+# organization unchanged
+PUSHED_AT = '2016-01-01T00:00:00Z'
+
+FIXED = 'fixed'
+EXPONENTIAL = 'exponential'
+LOGNORMAL = 'lognormal'
+LATENCY_DISTRIBUTIONS = (FIXED, EXPONENTIAL, LOGNORMAL)
+# the spread of the lognormal latency distribution
+LOGNORMAL_SIGMA = 0.5
+
+RATE_LIMIT_MESSAGE = 'API rate limit exceeded'
+SECONDARY_RATE_LIMIT_MESSAGE = ('You have exceeded a secondary rate limit. '
+                                'Please wait a few minutes before you try '
+                                'again.')
+
+REPO_NAME_REGEX = re.compile(r'^repo-(\d+)$')
+JQL_KEY_REGEX = re.compile(r'"([^"]+)"')
+
+
+class SyntheticOrg(object):
+    """ A GitHub organization, and the JIRA issues its branches refer to.
+
+    The organization is generated from `seed`, so every run of a benchmark
+    sees the same repos, branches, commits and issues.
+
+    Every repo has a master branch, and `branches_per_repo - 1` more
+    branches. About `issue_ratio` of those are named after one of
+    `num_of_issues` JIRA issues, such as `CFY-123-feature-4`.
+    """
+
+    def __init__(self, name, num_of_repos, branches_per_repo, num_of_issues,
+                 issue_ratio, num_of_committers, seed=0):
+        self.name = name
+        self.num_of_repos = num_of_repos
+        self.branches_per_repo = branches_per_repo
+        self.num_of_issues = num_of_issues
+        self.issue_ratio = issue_ratio
+        self.num_of_committers = num_of_committers
+        self.seed = seed
+        self._branches = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def repo_name(index):
+        return 'repo-{0:05d}'.format(index)
+
+    def repo_index(self, name):
+        """Return the index of the repo named `name`, or None if the
+        organization has no such repo.
+        """
+        match = REPO_NAME_REGEX.match(name)
+        if match is None or int(match.group(1)) >= self.num_of_repos:
+            return None
+        return int(match.group(1))
+
+    def branch_names(self, index):
+        with self._lock:
+            names = self._branches.get(index)
+        if names is not None:
+            return names
+        rnd = random.Random(self.seed * 1000003 + index)
+        names = ['master']
+        for number in range(1, self.branches_per_repo):
+            if self.num_of_issues and rnd.random() < self.issue_ratio:
+                names.append('{0}-{1}-feature-{2}'.format(
+                        ISSUE_PREFIX, rnd.randint(1, self.num_of_issues),
+                        number))
+            else:
+                names.append('feature-{0}'.format(number))
+        with self._lock:
+            self._branches[index] = names
+        return names
+
+    def sha(self, repo_name, branch_name):
+        return hashlib.sha1('{0}/{1}/{2}'.format(
+                self.name, repo_name, branch_name)).hexdigest()
+
+    def committer_email(self, sha):
+        return 'developer{0}@example.com'.format(
+                int(sha[:8], 16) % self.num_of_committers)
+
+    def issue(self, key):
+        """Return the json issue of `key`, or None if there is no such
+        issue.
+        """
+        prefix, _, number = key.partition('-')
+        if prefix != ISSUE_PREFIX or not number.isdigit() or \
+                not 1 <= int(number) <= self.num_of_issues:
+            return None
+        status = ISSUE_STATUSES[int(number) % len(ISSUE_STATUSES)]
+        return {'key': key, 'fields': {'status': {'name': status}}}
+
+
+class LatencyProfile(object):
+    """ Draws the latency of every response of the fake service.
+
+    Latencies follow `distribution` around `median` seconds, except for
+    `slow_ratio` of the responses, which take `slow_latency` seconds.
+    """
+
+    def __init__(self, median=0, distribution=FIXED, slow_ratio=0,
+                 slow_latency=0, seed=0):
+        self.median = median
+        self.distribution = distribution
+        self.slow_ratio = slow_ratio
+        self.slow_latency = slow_latency
+        self._random = random.Random(seed)
+
+    def sample(self):
+        if self.slow_ratio and self._random.random() < self.slow_ratio:
+            return self.slow_latency
+        if not self.median or self.distribution == FIXED:
+            return self.median
+        if self.distribution == EXPONENTIAL:
+            # the median of an exponential distribution is ln(2) / rate
+            return self._random.expovariate(math.log(2) / self.median)
+        return self.median * math.exp(self._random.gauss(0, LOGNORMAL_SIGMA))
+
+
+class RateLimit(object):
+    """ GitHub's rate limits, as enforced by the fake service.
+
+    Every user may send `limit` requests per `window` seconds, and no more
+    than `max_concurrent` requests may be in flight at the same time.
+    Conditional requests that are answered with `304 Not Modified` are
+    free, like they are on GitHub. A limit of 0 disables it.
+    """
+
+    def __init__(self, limit=0, window=60, max_concurrent=0,
+                 retry_after=1):
+        self.limit = limit
+        self.window = window
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self._budgets = {}
+        self._lock = threading.Lock()
+
+    def remaining(self, user):
+        """Return the remaining budget of `user`, and its reset time.
+        """
+        with self._lock:
+            return self._budget(user)
+
+    def consume(self, user):
+        with self._lock:
+            remaining, reset = self._budget(user)
+            self._budgets[user] = max(0, remaining - 1), reset
+
+    def _budget(self, user):
+        now = time.time()
+        budget = self._budgets.get(user)
+        if budget is None or budget[1] <= now:
+            budget = self._budgets[user] = (self.limit,
+                                            int(now + self.window))
+        return budget
+
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    """ Answers the GitHub REST & GraphQL, and the JIRA requests of tattle.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.headers.get(FORWARDED_HOST) is None:
+            if self.path == STATS_PATH:
+                self.send_json(200, self.server.snapshot())
+            else:
+                self.send_json(404, {'message': 'Not Found'})
+            return
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def handle_request(self):
+        host = self.headers.get(FORWARDED_HOST, '')
+        backend = JIRA if host.endswith(JIRA_HOST_SUFFIX) else GITHUB
+        url = urlparse.urlparse(self.path)
+        segments = url.path.strip('/').split('/')
+        query = urlparse.parse_qs(url.query)
+        body = None
+        if self.command == 'POST':
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        endpoint = get_endpoint('https://{0}{1}'.format(host, url.path))
+        in_flight = self.server.enter()
+        try:
+            time.sleep(self.server.latency.sample())
+            if backend == GITHUB:
+                status, headers, result = self.handle_github(
+                        host, url.path, segments, query, body, in_flight)
+            else:
+                status, headers, result = self.handle_jira(
+                        endpoint, segments, query)
+        finally:
+            self.server.leave()
+        self.server.record(backend, endpoint, status)
+        self.send_json(status, result, headers)
+
+    def handle_github(self, host, path, segments, query, body, in_flight):
+        rate_limit = self.server.rate_limit
+        user = self.get_user()
+        if rate_limit.max_concurrent and \
+                in_flight > rate_limit.max_concurrent:
+            return (403, {RETRY_AFTER: str(rate_limit.retry_after)},
+                    {'message': SECONDARY_RATE_LIMIT_MESSAGE})
+        headers = {}
+        if rate_limit.limit:
+            remaining, reset = rate_limit.remaining(user)
+            headers = {RATE_LIMIT_LIMIT: str(rate_limit.limit),
+                       RATE_LIMIT_REMAINING: str(remaining),
+                       RATE_LIMIT_RESET: str(reset)}
+            if remaining <= 0:
+                return 403, headers, {'message': RATE_LIMIT_MESSAGE}
+
+        if self.command == 'POST':
+            status, result = self.server.graphql(json.loads(body))
+        else:
+            status, result, links = self.server.rest(segments, query)
+            if links:
+                headers['Link'] = format_links(host, path, links)
+            if status == 200 and self.server.etags:
+                etag = '"{0}"'.format(hashlib.sha1(
+                        json.dumps(result, sort_keys=True)).hexdigest())
+                headers['ETag'] = etag
+                if self.headers.get('If-None-Match') == etag:
+                    status, result = 304, None
+
+        if rate_limit.limit and status != 304:
+            rate_limit.consume(user)
+            remaining, _ = rate_limit.remaining(user)
+            headers[RATE_LIMIT_REMAINING] = str(remaining)
+        return status, headers, result
+
+    def handle_jira(self, endpoint, segments, query):
+        org = self.server.org
+        if endpoint == 'search':
+            keys = JQL_KEY_REGEX.findall(query.get('jql', [''])[0])
+            issues = [issue for issue in (org.issue(key) for key in keys)
+                      if issue is not None]
+            # like JIRA, results beyond a page are left for later requests
+            start_at = int(query.get('startAt', ['0'])[0])
+            max_results = min(int(query.get('maxResults', ['50'])[0]),
+                              self.server.max_per_page)
+            return 200, {}, {'startAt': start_at,
+                             'maxResults': max_results,
+                             'total': len(issues),
+                             'issues': issues[start_at:
+                                              start_at + max_results]}
+        if endpoint == 'issue' and len(segments) > 4:
+            issue = org.issue(segments[4])
+            if issue is not None:
+                return 200, {}, issue
+        return 404, {}, {'errorMessages': ['Issue Does Not Exist']}
+
+    def get_user(self):
+        authorization = self.headers.get('Authorization', '')
+        if not authorization.startswith('Basic '):
+            return None
+        return base64.b64decode(authorization[len('Basic '):]).split(':')[0]
+
+    def send_json(self, status, result, headers=None):
+        body = '' if result is None else json.dumps(result)
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeService(SocketServer.ThreadingMixIn, HTTPServer):
+    """ A local stand-in for the GitHub and JIRA APIs, serving `org`.
+
+    :param etags: whether GitHub responses carry ETags, and answer
+                  conditional requests with `304 Not Modified`
+    :param max_per_page: the largest page size that is honored
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, org, latency=None, rate_limit=None,
+                 etags=True, max_per_page=MAX_PER_PAGE):
+        HTTPServer.__init__(self, address, FakeServiceHandler)
+        self.org = org
+        self.latency = latency or LatencyProfile()
+        self.rate_limit = rate_limit or RateLimit()
+        self.etags = etags
+        self.max_per_page = max_per_page
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            return self.in_flight
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def record(self, backend, endpoint, status):
+        with self._lock:
+            self.requests['{0}.{1}.{2}'.format(backend, endpoint,
+                                               status)] += 1
+
+    def snapshot(self):
+        """Return the number of requests so far, by endpoint and status,
+        and the peak number of requests in flight since the last snapshot.
+        """
+        with self._lock:
+            stats = {'requests': dict(self.requests),
+                     'peak_in_flight': self.peak_in_flight}
+            self.peak_in_flight = self.in_flight
+            return stats
+
+    def paginate(self, items, query):
+        """Return a page of `items`, along with the page numbers of the
+        next and the last pages, if there are any.
+        """
+        page = int(query.get('page', ['1'])[0])
+        per_page = min(int(query.get('per_page', [DEFAULT_PER_PAGE])[0]),
+                       self.max_per_page)
+        last = max(1, int(math.ceil(len(items) / float(per_page))))
+        links = {}
+        if page < last:
+            links = {'next': (page + 1, per_page), 'last': (last, per_page)}
+        return items[(page - 1) * per_page:page * per_page], links
+
+    def rest(self, segments, query):
+        """Return the status code, the json body and the pagination links
+        of a GitHub REST request.
+        """
+        org = self.org
+        not_found = 404, {'message': 'Not Found'}, None
+        if segments[0] == 'orgs':
+            if len(segments) < 2 or segments[1] != org.name:
+                return not_found
+            if len(segments) == 2:
+                return 200, {'login': org.name,
+                             'public_repos': org.num_of_repos,
+                             'total_private_repos': 0}, None
+            if segments[2:] == ['repos']:
+                indices, links = self.paginate(range(org.num_of_repos),
+                                               query)
+                return 200, [self.json_repo(index)
+                             for index in indices], links
+            return not_found
+
+        if segments[0] != 'repos' or len(segments) < 4 or \
+                segments[1] != org.name:
+            return not_found
+        repo_name = segments[2]
+        index = org.repo_index(repo_name)
+        if index is None:
+            return not_found
+        if segments[3] == 'branches':
+            names = org.branch_names(index)
+            if len(segments) == 4:
+                names, links = self.paginate(names, query)
+                return 200, [self.json_branch(repo_name, name)
+                             for name in names], links
+            name = '/'.join(segments[4:])
+            if name not in names:
+                return not_found
+            sha = org.sha(repo_name, name)
+            return 200, {'name': name,
+                         'commit': self.json_commit(repo_name, sha)}, None
+        if segments[3] == 'commits' and len(segments) == 5:
+            return 200, self.json_commit(repo_name, segments[4]), None
+        if segments[3:5] == ['git', 'commits'] and len(segments) == 6:
+            sha = segments[5]
+            return 200, {'sha': sha,
+                         'author': {
+                             'email': self.org.committer_email(sha)}}, None
+        return not_found
+
+    def json_repo(self, index):
+        return {'name': self.org.repo_name(index),
+                'owner': {'login': self.org.name},
+                'pushed_at': PUSHED_AT,
+                'updated_at': PUSHED_AT}
+
+    def json_branch(self, repo_name, name):
+        sha = self.org.sha(repo_name, name)
+        return {'name': name,
+                'commit': {'sha': sha,
+                           'url': 'https://api.github.com/repos/{0}/{1}/'
+                                  'commits/{2}'.format(self.org.name,
+                                                       repo_name, sha)}}
+
+    def json_commit(self, repo_name, sha):
+        return {'sha': sha,
+                'commit': {'author': {
+                    'email': self.org.committer_email(sha)}}}
+
+    def json_refs(self, repo_name, cursor, first):
+        names = self.org.branch_names(self.org.repo_index(repo_name))
+        offset = int(cursor or 0)
+        nodes = []
+        for name in names[offset:offset + first]:
+            sha = self.org.sha(repo_name, name)
+            nodes.append({'name': name,
+                          'target': {'oid': sha,
+                                     'author': {
+                                         'email': self.org.committer_email(
+                                                 sha)}}})
+        return {'pageInfo': {'hasNextPage': offset + first < len(names),
+                             'endCursor': str(offset + first)},
+                'nodes': nodes}
+
+    def graphql(self, request):
+        """Return the status code and the json body of a GraphQL request.
+
+        Only the two queries that tattle sends are understood: the listing
+        of the organization's repositories, and the listing of the refs
+        of a single repository.
+        """
+        org = self.org
+        variables = request.get('variables') or {}
+        first = min(int(re.search(r'first: (\d+)',
+                                  request['query']).group(1)),
+                    self.max_per_page)
+        if variables.get('org') != org.name:
+            return 200, {'data': None, 'errors': [
+                {'message': 'Could not resolve to an Organization'}]}
+        offset = int(variables.get('cursor') or 0)
+        if 'organization(' in request['query']:
+            indices = range(offset, min(offset + first, org.num_of_repos))
+            nodes = [dict(self.json_repo(index),
+                          refs=self.json_refs(org.repo_name(index), None,
+                                              first))
+                     for index in indices]
+            repositories = {
+                'pageInfo': {'hasNextPage': offset + first < org.num_of_repos,
+                             'endCursor': str(offset + first)},
+                'nodes': nodes}
+            return 200, {'data': {'organization': {
+                'repositories': repositories}}}
+        if org.repo_index(variables.get('repo', '')) is None:
+            return 200, {'data': None, 'errors': [
+                {'message': 'Could not resolve to a Repository'}]}
+        refs = self.json_refs(variables['repo'], variables.get('cursor'),
+                              first)
+        return 200, {'data': {'repository': {'refs': refs}}}
+
+
+def format_links(host, path, links):
+    return ', '.join(
+            '<https://{0}{1}?page={2}&per_page={3}>; rel="{4}"'.format(
+                    host, path, page, per_page, rel)
+            for rel, (page, per_page) in sorted(links.items()))
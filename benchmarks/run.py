@@ -0,0 +1,331 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""Run tattle end to end against a local fake of GitHub and JIRA.
+
+    python -m benchmarks.run --repos 10000 --latency-ms 50 [tattle args]
+
+Arguments that the benchmark doesn't know are passed on to tattle, so
+`--hedge-requests` or `--max-retries 5` are benchmarked as well.
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urlparse
+
+import requests
+import yaml
+from requests.adapters import HTTPAdapter
+
+from benchmarks.fakeservice import FORWARDED_HOST
+from benchmarks.fakeservice import FIXED
+from benchmarks.fakeservice import LATENCY_DISTRIBUTIONS
+from benchmarks.fakeservice import MAX_PER_PAGE
+from benchmarks.fakeservice import STATS_PATH
+from benchmarks.fakeservice import FakeService
+from benchmarks.fakeservice import LatencyProfile
+from benchmarks.fakeservice import RateLimit
+from benchmarks.fakeservice import SyntheticOrg
+from tattle import engine
+from tattle import metrics
+from tattle import network
+from tattle.model import FETCH_MODES
+from tattle.model import REST_FETCH_MODE
+
+ORG_NAME = 'bench-org'
+JIRA_TEAM_NAME = 'bench'
+GITHUB_USER = 'bench'
+# the number of seconds between two samples of the number of threads
+THREAD_SAMPLING_INTERVAL = 0.01
+
+
+class RedirectAdapter(HTTPAdapter):
+    """ Sends every request to the fake service instead of its host.
+
+    The host the request was meant for is sent along in a header, so the
+    fake service knows which API the request is for. Everything else about
+    the request, including tattle's connection pooling, is left intact.
+    """
+
+    def __init__(self, address, **kwargs):
+        HTTPAdapter.__init__(self, **kwargs)
+        self.address = address
+
+    def send(self, request, **kwargs):
+        url = urlparse.urlparse(request.url)
+        request.headers[FORWARDED_HOST] = url.netloc
+        request.url = urlparse.urlunparse(
+                ('http', '{0}:{1}'.format(*self.address)) + url[2:])
+        return HTTPAdapter.send(self, request, **kwargs)
+
+
+def redirect_sessions(address):
+    """Make tattle's sessions send all of their requests to `address`.
+    """
+    create_session = network.create_session
+
+    def create_redirected_session(pool_size):
+        session = create_session(pool_size)
+        adapter = RedirectAdapter(address, pool_connections=1,
+                                  pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    network.close_sessions()
+    network.create_session = create_redirected_session
+
+
+class ThreadMonitor(object):
+    """ Samples the number of threads of the process until it is stopped.
+    """
+
+    def __init__(self):
+        self.peak = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample)
+        self._thread.daemon = True
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self._stopped.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stopped.is_set():
+            # the monitor's own thread is not counted
+            self.peak = max(self.peak, threading.active_count() - 1)
+            self._stopped.wait(THREAD_SAMPLING_INTERVAL)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+            description='Benchmark tattle against a local fake of GitHub '
+                        'and JIRA. Unknown arguments are passed on to '
+                        'tattle.')
+    parser.add_argument('--repos', type=int, default=200,
+                        help='the number of repos of the organization')
+    parser.add_argument('--branches', type=int, default=10,
+                        help='the number of branches of every repo')
+    parser.add_argument('--issues', type=int, default=1000,
+                        help='the number of JIRA issues')
+    parser.add_argument('--issue-ratio', type=float, default=0.5,
+                        help='the fraction of the branches that are named '
+                             'after an issue')
+    parser.add_argument('--committers', type=int, default=50,
+                        help='the number of distinct committer emails')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='the seed the organization is generated from')
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='the median latency of a response')
+    parser.add_argument('--latency-distribution', default=FIXED,
+                        choices=LATENCY_DISTRIBUTIONS,
+                        help='the distribution of the latencies')
+    parser.add_argument('--slow-ratio', type=float, default=0,
+                        help='the fraction of the responses that are slow')
+    parser.add_argument('--slow-latency-ms', type=float, default=0,
+                        help='the latency of the slow responses')
+    parser.add_argument('--max-per-page', type=int, default=MAX_PER_PAGE,
+                        help='the largest page size that is honored')
+    parser.add_argument('--no-etags', action='store_true',
+                        help="don't send ETags, or answer conditional "
+                             "requests")
+    parser.add_argument('--rate-limit', type=int, default=0,
+                        help='the number of GitHub requests allowed per '
+                             'user per rate limit window. 0 disables it')
+    parser.add_argument('--rate-limit-window', type=int, default=60,
+                        help='the length of a rate limit window, in '
+                             'seconds')
+    parser.add_argument('--max-concurrent', type=int, default=0,
+                        help='the number of concurrent GitHub requests '
+                             'above which a secondary rate limit is hit. '
+                             '0 disables it')
+    parser.add_argument('--retry-after', type=int, default=1,
+                        help='the Retry-After of secondary rate limits')
+    parser.add_argument('--tokens', type=int, default=0,
+                        help='the number of GitHub tokens to spread the '
+                             'requests over. 0 uses a username & password')
+    parser.add_argument('--fetch-mode', default=REST_FETCH_MODE,
+                        choices=FETCH_MODES,
+                        help="the fetch mode of tattle's query")
+    parser.add_argument('--thread-limit', type=int,
+                        help="the thread limit of tattle's query")
+    parser.add_argument('--runs', type=int, default=1,
+                        help='the number of times tattle is run. later '
+                             'runs reuse the caches of the earlier ones')
+    parser.add_argument('--output',
+                        help='a file the results are appended to')
+    return parser.parse_known_args()
+
+
+def write_config(work_dir, args):
+    """Write the config.yaml file of the benchmarked query.
+
+    The query lists every branch, keeps the ones named after an issue, and
+    looks up their issues and committers.
+    """
+    config = {
+        'query_config': {
+            'data_type': 'branch',
+            'github_org': ORG_NAME,
+            'output_path': os.path.join(work_dir, 'report.json'),
+            'cache_path': os.path.join(work_dir, 'cache.db'),
+            'index_path': os.path.join(work_dir, 'index.db'),
+            'fetch_mode': args.fetch_mode,
+        },
+        'filters': [
+            {'type': 'name',
+             'precedence': 1,
+             'regular_expressions': ['CFY']},
+            {'type': 'issue',
+             'precedence': 2,
+             'jira_team_name': JIRA_TEAM_NAME,
+             'jira_statuses': ['Closed', 'Resolved'],
+             'transform': {'base': r'CFY-\d+'}},
+        ],
+    }
+    if args.thread_limit:
+        config['query_config']['thread_limit'] = args.thread_limit
+    config_path = os.path.join(work_dir, 'config.yaml')
+    with open(config_path, 'w') as config_file:
+        yaml.safe_dump(config, config_file, default_flow_style=False)
+    return config_path
+
+
+def start_service(args):
+    """Start the fake service in a process of its own, so that its memory
+    and threads are not counted as tattle's.
+    """
+    org = SyntheticOrg(ORG_NAME, args.repos, args.branches, args.issues,
+                       args.issue_ratio, args.committers, seed=args.seed)
+    latency = LatencyProfile(args.latency_ms / 1000.0,
+                             args.latency_distribution,
+                             args.slow_ratio,
+                             args.slow_latency_ms / 1000.0,
+                             seed=args.seed)
+    rate_limit = RateLimit(args.rate_limit, args.rate_limit_window,
+                           args.max_concurrent, args.retry_after)
+    service = FakeService(('127.0.0.1', 0), org, latency, rate_limit,
+                          etags=not args.no_etags,
+                          max_per_page=args.max_per_page)
+    process = multiprocessing.Process(target=service.serve_forever)
+    process.daemon = True
+    process.start()
+    address = service.server_address
+    # the process serves on its own copy of the socket
+    service.server_close()
+    return process, address
+
+
+def get_stats(address):
+    return requests.get('http://{0}:{1}{2}'.format(address[0], address[1],
+                                                    STATS_PATH)).json()
+
+
+def set_credentials(args):
+    # tattle prompts for credentials unless they are set
+    if args.tokens:
+        os.environ['GITHUB_TOKENS'] = ','.join(
+                'token-{0}'.format(i) for i in range(args.tokens))
+    else:
+        os.environ['GITHUB_USER'] = GITHUB_USER
+        os.environ['GITHUB_PASS'] = GITHUB_USER
+
+
+def run_tattle(config_path, tattle_args):
+    """Run tattle's main in this process, and return the error it failed
+    with, if any.
+    """
+    sys.argv = ['tattle', '--config-path', config_path] + tattle_args
+    try:
+        engine.main()
+    except SystemExit as e:
+        if e.code:
+            return str(e.code)
+    return None
+
+
+def count_requests(before, after):
+    counts = {}
+    for name, value in after['requests'].items():
+        count = value - before['requests'].get(name, 0)
+        if count:
+            counts[name] = count
+    return counts
+
+
+def format_result(number, wall_time, counts, peak_in_flight, peak_threads,
+                  error):
+    # ru_maxrss is in kilobytes on linux, and is the peak of the process
+    # so far, rather than of the run
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    lines = ['run {0}:'.format(number),
+             '  wall time: {0:.2f} seconds'.format(wall_time),
+             '  requests: {0}'.format(sum(counts.values()))]
+    lines.extend('    {0}: {1}'.format(name, count)
+                 for name, count in sorted(counts.items()))
+    lines.extend([
+        '  peak requests in flight: {0}'.format(peak_in_flight),
+        '  peak threads: {0}'.format(peak_threads),
+        '  peak RSS: {0:.1f} MB'.format(peak_rss)])
+    if error:
+        lines.append('  failed: {0}'.format(error))
+    return '\n'.join(lines)
+
+
+def main():
+    args, tattle_args = parse_arguments()
+    process, address = start_service(args)
+    redirect_sessions(address)
+    set_credentials(args)
+    work_dir = tempfile.mkdtemp(prefix='tattle-benchmark-')
+    results = []
+    try:
+        config_path = write_config(work_dir, args)
+        for number in range(1, args.runs + 1):
+            metrics.reset()
+            # the peak in flight is counted from the last snapshot on
+            before = get_stats(address)
+            with ThreadMonitor() as monitor:
+                start = time.time()
+                error = run_tattle(config_path, tattle_args)
+                wall_time = time.time() - start
+            after = get_stats(address)
+            results.append(format_result(
+                    number, wall_time, count_requests(before, after),
+                    after['peak_in_flight'], monitor.peak, error))
+    finally:
+        process.terminate()
+        shutil.rmtree(work_dir)
+
+    summary = '\n'.join(results)
+    print summary
+    if args.output:
+        with open(args.output, 'a') as output:
+            output.write(summary + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import json
+import threading
+import unittest
+
+import requests
+
+from benchmarks.fakeservice import FakeService
+from benchmarks.fakeservice import RateLimit
+from benchmarks.fakeservice import SyntheticOrg
+from benchmarks.run import RedirectAdapter
+from tattle import graphql
+from tattle import model
+
+ORG = 'bench-org'
+
+
+class FakeServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        org = SyntheticOrg(ORG, num_of_repos=3, branches_per_repo=150,
+                           num_of_issues=10, issue_ratio=0.5,
+                           num_of_committers=5)
+        self.service = FakeService(('127.0.0.1', 0), org,
+                                   rate_limit=RateLimit(limit=3))
+        self.addCleanup(self.service.server_close)
+        thread = threading.Thread(target=self.service.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.service.shutdown)
+        self.session = requests.Session()
+        self.session.mount('https://', RedirectAdapter(
+                self.service.server_address))
+        self.session.auth = ('bench', 'bench')
+
+    def get(self, url, **kwargs):
+        return self.session.get(model.GITHUB_API_URL + url, **kwargs)
+
+    def test_pagination_and_etags(self):
+        response = self.get('repos/{0}/repo-00001/branches'
+                            '?page=1&per_page=100'.format(ORG))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 100)
+        self.assertEqual(model.get_num_of_pages(response), 2)
+        self.assertEqual(response.headers['X-RateLimit-Remaining'], '2')
+
+        response = self.get(
+                'repos/{0}/repo-00001/branches?page=1&per_page=100'
+                .format(ORG),
+                headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+        # conditional requests don't count against the rate limit
+        self.assertEqual(response.headers['X-RateLimit-Remaining'], '2')
+        self.assertEqual(self.get('repos/{0}/repo-00009/branches'
+                                  .format(ORG)).status_code, 404)
+
+    def test_rate_limit(self):
+        for _ in range(3):
+            self.assertEqual(self.get('orgs/' + ORG).status_code, 200)
+        response = self.get('orgs/' + ORG)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.headers['X-RateLimit-Remaining'], '0')
+        self.assertEqual(self.service.snapshot()['requests'],
+                         {'github.orgs.200': 3, 'github.orgs.403': 1})
+
+    def test_git_commit(self):
+        response = self.get('repos/{0}/repo-00001/git/commits/abc'
+                            .format(ORG))
+        self.assertEqual(response.json()['sha'], 'abc')
+        self.assertIn('@', response.json()['author']['email'])
+        self.assertEqual(self.service.snapshot()['requests'],
+                         {'github.commits.200': 1})
+
+    def test_peak_in_flight_is_reset_by_snapshots(self):
+        self.get('orgs/' + ORG)
+        self.assertEqual(self.service.snapshot()['peak_in_flight'], 1)
+        self.assertEqual(self.service.snapshot()['peak_in_flight'], 0)
+
+    def test_graphql(self):
+        response = self.session.post(graphql.GITHUB_GRAPHQL_URL, json.dumps(
+                {'query': graphql.ORG_REPOSITORIES_QUERY,
+                 'variables': {'org': ORG, 'cursor': None}}))
+        repositories = response.json()['data']['organization'][
+            'repositories']
+        self.assertEqual([node['name'] for node in repositories['nodes']],
+                         ['repo-00000', 'repo-00001', 'repo-00002'])
+        refs = repositories['nodes'][0]['refs']
+        self.assertEqual(len(refs['nodes']), 100)
+        self.assertTrue(refs['pageInfo']['hasNextPage'])
+
+    def test_jira(self):
+        response = self.session.get(
+                'https://bench.atlassian.net/rest/api/2/search',
+                params={'jql': 'key in ("CFY-1", "CFY-11")'})
+        self.assertEqual(response.json()['issues'],
+                         [{'key': 'CFY-1',
+                           'fields': {'status': {'name': 'In Progress'}}}])
@@ -0,0 +1,189 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_ENTRIES = 100000
+# the number of writes that are buffered before they are committed to disk
+COMMIT_INTERVAL = 100
+
+# the databases opened by this process, by absolute path
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+class _Database(object):
+    """ An sqlite connection, shared by all of the caches of a process that
+    are stored in the same file.
+
+    sqlite allows a single writer per file, so caches with connections
+    of their own would wait on one another's uncommitted writes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.references = 0
+        self.pending_writes = 0
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'namespace TEXT NOT NULL, '
+                'key TEXT NOT NULL, '
+                'value TEXT NOT NULL, '
+                'stored_at REAL NOT NULL, '
+                'accessed_at REAL NOT NULL, '
+                'PRIMARY KEY (namespace, key))')
+        self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS entries_accessed_at '
+                'ON entries (namespace, accessed_at)')
+        self.connection.commit()
+
+    @classmethod
+    def open(cls, path):
+        with _databases_lock:
+            database = _databases.get(os.path.abspath(path))
+            if database is None:
+                database = _databases[os.path.abspath(path)] = cls(path)
+            database.references += 1
+            return database
+
+    def close(self):
+        with _databases_lock:
+            self.references -= 1
+            if self.references:
+                return
+            del _databases[os.path.abspath(self.path)]
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+class PersistentCache(object):
+    """ A size-bounded key/value store, persisted in an sqlite database.
+
+    Values are stored as json. When the number of entries exceeds
+    `max_entries`, the least recently used entries are evicted. If `ttl`
+    is set, entries that were stored more than `ttl` seconds ago are
+    treated as missing.
+    Several caches can share the same database file, as long as each of
+    them uses a different `namespace`.
+    """
+
+    def __init__(self, path, namespace, max_entries=DEFAULT_MAX_ENTRIES,
+                 ttl=None):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        cache_dir = os.path.dirname(path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self._last_access = 0
+        self._database = _Database.open(path)
+        self._lock = self._database.lock
+        self._connection = self._database.connection
+        with self._lock:
+            self._size = self._connection.execute(
+                    'SELECT COUNT(*) FROM entries WHERE namespace = ?',
+                    (namespace,)).fetchone()[0]
+
+    def __len__(self):
+        return self._size
+
+    def get(self, key):
+        """Return the value stored under `key`, or None if there is none.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                    'SELECT value, stored_at FROM entries '
+                    'WHERE namespace = ? AND key = ?',
+                    (self.namespace, key)).fetchone()
+            if row is None or self._expired(row[1]):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._connection.execute(
+                    'UPDATE entries SET accessed_at = ? '
+                    'WHERE namespace = ? AND key = ?',
+                    (self._now(), self.namespace, key))
+            self._written()
+            return json.loads(row[0])
+
+    def set(self, key, value):
+        with self._lock:
+            now = self._now()
+            exists = self._connection.execute(
+                    'SELECT 1 FROM entries WHERE namespace = ? AND key = ?',
+                    (self.namespace, key)).fetchone()
+            self._connection.execute(
+                    'INSERT OR REPLACE INTO entries '
+                    '(namespace, key, value, stored_at, accessed_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (self.namespace, key, json.dumps(value), now, now))
+            if not exists:
+                self._size += 1
+                self._evict()
+            self._written()
+
+    def delete(self, key):
+        with self._lock:
+            cursor = self._connection.execute(
+                    'DELETE FROM entries WHERE namespace = ? AND key = ?',
+                    (self.namespace, key))
+            self._size -= cursor.rowcount
+            self._written()
+
+    def flush(self):
+        with self._lock:
+            self._connection.commit()
+            self._database.pending_writes = 0
+
+    def close(self):
+        self._database.close()
+
+    def _now(self):
+        # access times are kept strictly increasing, so that the eviction
+        # order is well defined even for entries touched in the same tick.
+        self._last_access = max(time.time(), self._last_access + 1e-6)
+        return self._last_access
+
+    def _expired(self, stored_at):
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def _evict(self):
+        excess = self._size - self.max_entries
+        if excess <= 0:
+            return
+        self._connection.execute(
+                'DELETE FROM entries WHERE namespace = ? AND key IN ('
+                'SELECT key FROM entries WHERE namespace = ? '
+                'ORDER BY accessed_at LIMIT ?)',
+                (self.namespace, self.namespace, excess))
+        self._size -= excess
+
+    def _written(self):
+        self._database.pending_writes += 1
+        if self._database.pending_writes >= COMMIT_INTERVAL:
+            self._connection.commit()
+            self._database.pending_writes = 0
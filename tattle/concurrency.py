@@ -0,0 +1,145 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import threading
+
+from tattle import metrics
+
+# the limit never drops below this number of requests in flight
+MIN_CONCURRENCY = 1
+# the fraction of the limit that is kept when the backend is congested
+DECREASE_FACTOR = 0.5
+# the backend is considered congested once the recent latency of its
+# requests is this many times their long-term latency
+LATENCY_TOLERANCE = 2.0
+# the weights of a new latency in the recent and the long-term latency
+RECENT_LATENCY_WEIGHT = 0.2
+BASELINE_LATENCY_WEIGHT = 0.02
+# the number of requests needed before latency is taken into account
+MIN_LATENCY_SAMPLES = 20
+# the number of seconds by which the recent latency must also exceed the
+# long-term latency, so the jitter of fast responses is not congestion
+MIN_LATENCY_INCREASE = 0.05
+
+
+class AdaptiveLimit(object):
+    """ Caps the number of requests in flight to a backend, and adapts the
+    cap to how well the backend copes with it.
+
+    The limit grows by one request after a full limit's worth of requests
+    succeed, and is halved when a request is rejected, fails, or when the
+    recent requests are much slower than usual (additive increase,
+    multiplicative decrease).
+
+    Requests that were sent before the limit was last decreased cannot
+    decrease it again: they were sent under the old limit, and their
+    failures are already accounted for.
+    """
+
+    def __init__(self, name, initial, maximum, minimum=MIN_CONCURRENCY):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = max(minimum, min(initial, self.maximum))
+        self.peak = self.limit
+        self.in_flight = 0
+        self._generation = 0
+        self._successes = 0
+        self._samples = 0
+        self._recent_latency = None
+        self._baseline_latency = None
+        self._condition = threading.Condition()
+        self._report()
+
+    def set_maximum(self, maximum):
+        """Change the highest limit, keeping what was learned below it.
+        """
+        with self._condition:
+            self.maximum = max(self.minimum, maximum)
+            self.limit = min(self.limit, self.maximum)
+            self._report()
+
+    def acquire(self):
+        """Wait until the limit allows another request.
+
+        :return: a ticket, to be passed to `release` with the outcome of
+                 the request
+        """
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+            return self._generation
+
+    def release(self, ticket, latency=None, congested=False):
+        """Record the outcome of a request, and adapt the limit to it.
+
+        :param ticket: the ticket returned by `acquire`
+        :param latency: the number of seconds the request took, if it got
+                        a response
+        :param congested: whether the backend rejected the request, or
+                          failed to answer it
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if latency is not None and not congested:
+                congested = self._record_latency(latency)
+            if congested:
+                if ticket == self._generation:
+                    self._decrease()
+            else:
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self._increase()
+            self._condition.notify_all()
+
+    def _record_latency(self, latency):
+        self._samples += 1
+        if self._recent_latency is None:
+            self._recent_latency = self._baseline_latency = latency
+            return False
+        self._recent_latency += (
+                RECENT_LATENCY_WEIGHT * (latency - self._recent_latency))
+        self._baseline_latency += (
+                BASELINE_LATENCY_WEIGHT * (latency - self._baseline_latency))
+        return (self._samples >= MIN_LATENCY_SAMPLES and
+                self._recent_latency >
+                LATENCY_TOLERANCE * self._baseline_latency and
+                self._recent_latency - self._baseline_latency >
+                MIN_LATENCY_INCREASE)
+
+    def _increase(self):
+        self._successes = 0
+        if self.limit < self.maximum:
+            self.limit += 1
+            self.peak = max(self.peak, self.limit)
+            self._report()
+
+    def _decrease(self):
+        self._successes = 0
+        if self.limit == self.minimum:
+            return
+        self._generation += 1
+        self.limit = max(self.minimum, int(self.limit * DECREASE_FACTOR))
+        # the latency that caused the decrease is not held against the
+        # new limit
+        self._recent_latency = self._baseline_latency
+        metrics.increment('concurrency.{0}.decreases'.format(self.name))
+        self._report()
+
+    def _report(self):
+        metrics.set_value('concurrency.{0}'.format(self.name), self.limit)
+        metrics.set_value('concurrency.{0}.peak'.format(self.name),
+                          self.peak)
@@ -0,0 +1,135 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import threading
+import time
+
+from tattle import metrics
+from tattle.ratelimit import DEFAULT_RETRY_AFTER
+from tattle.ratelimit import RATE_LIMIT_REMAINING
+from tattle.ratelimit import RATE_LIMIT_RESET
+from tattle.ratelimit import RETRY_AFTER
+from tattle.ratelimit import RateLimitScheduler
+
+# GitHub accepts an OAuth token as the username of basic authentication,
+# along with this password
+TOKEN_PASSWORD = 'x-oauth-basic'
+
+_pools = {}
+_lock = threading.Lock()
+
+
+class TokenState(object):
+    """ The rate limit budget of a single token, as last reported by GitHub.
+    """
+
+    def __init__(self):
+        self.remaining = None
+        self.reset = None
+
+    def is_exhausted(self, now):
+        return (self.remaining is not None and self.remaining <= 0 and
+                self.reset is not None and self.reset > now)
+
+
+class CredentialPool(object):
+    """ Spreads GitHub requests over several tokens.
+
+    Every request is sent on the token with the most remaining budget.
+    Tokens whose budget is exhausted are taken out of rotation until
+    their budget is reset. Tokens whose budget is not known yet are tried
+    first.
+
+    A pool is used as the `auth` of requests, and is resolved into one of
+    its tokens by every request it is used for.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tuple(tokens)
+        self._states = dict((token, TokenState()) for token in self.tokens)
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        # requests that are sent with the pool share their response cache
+        # entries, whichever token they are sent on
+        return iter(self.tokens)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def acquire(self):
+        """Return the credentials of the token with the most headroom.
+
+        If the budgets of all of the tokens are exhausted, the token whose
+        budget is reset first is returned.
+        """
+        with self._lock:
+            now = time.time()
+            available = [token for token in self.tokens
+                         if not self._states[token].is_exhausted(now)]
+            if available:
+                token = max(available, key=self._headroom)
+                state = self._states[token]
+                if state.remaining is not None:
+                    # responses report the actual budget; until they
+                    # arrive, every request is assumed to consume one
+                    state.remaining -= 1
+            else:
+                metrics.increment('credentials.exhausted')
+                token = min(self.tokens,
+                            key=lambda t: self._states[t].reset)
+        metrics.increment('credentials.requests')
+        return token, TOKEN_PASSWORD
+
+    def _headroom(self, token):
+        remaining = self._states[token].remaining
+        return float('inf') if remaining is None else remaining
+
+    def update(self, credentials, response):
+        """Record the rate limit headers of a response to a request that
+        was sent with `credentials`.
+        """
+        headers = response.headers
+        with self._lock:
+            state = self._states[credentials[0]]
+            if headers.get(RATE_LIMIT_REMAINING) is not None:
+                state.remaining = int(headers[RATE_LIMIT_REMAINING])
+            if headers.get(RATE_LIMIT_RESET) is not None:
+                state.reset = float(headers[RATE_LIMIT_RESET])
+            if RateLimitScheduler.is_rate_limited(response):
+                # the token sits out until its budget is reset
+                state.remaining = 0
+                if headers.get(RETRY_AFTER) is not None:
+                    state.reset = time.time() + float(headers[RETRY_AFTER])
+                elif not state.reset or state.reset <= time.time():
+                    state.reset = time.time() + DEFAULT_RETRY_AFTER
+
+    def remaining(self, token):
+        with self._lock:
+            return self._states[token].remaining
+
+
+def get_credential_pool(tokens):
+    """Return the credential pool of `tokens`.
+
+    The pool is shared by all of the queries that use the same tokens, so
+    its budgets are tracked across queries.
+    """
+    tokens = tuple(tokens)
+    with _lock:
+        pool = _pools.get(tokens)
+        if pool is None:
+            pool = _pools[tokens] = CredentialPool(tokens)
+        return pool
@@ -0,0 +1,226 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import json
+import logging
+import os
+import SocketServer
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+
+from tattle import executor
+from tattle import metrics
+from tattle import network
+from tattle.model import Filter
+from tattle.model import Query
+from tattle.model import QueryConfig
+from tattle.report import serialize
+from tattle.singleflight import SingleFlight
+
+QUERY_PATH = '/query'
+METRICS_PATH = '/metrics'
+
+# the number of seconds for which a listing of an organization's branches
+# is reused by the queries against it
+DEFAULT_LISTING_TTL = 5 * 60
+DEFAULT_DAEMON_HOST = '127.0.0.1'
+
+logger = logging.getLogger('model.daemon')
+
+
+class QueryService(object):
+    """ Runs queries against warm state.
+
+    The service keeps its connection pools, caches and executor across
+    queries, along with the latest listing of every organization's
+    branches. A listing is reused by all of the queries against its
+    organization until it is `listing_ttl` seconds old, and queries that
+    find it stale share a single refresh.
+
+    Only the query config and filters of a query are taken from its
+    request. The threads, caches, fetch mode and retries of the queries
+    are those of the service.
+    """
+
+    def __init__(self,
+                 thread_limit,
+                 cache_path=QueryConfig.DEFAULT_CACHE_PATH,
+                 cache_size=QueryConfig.DEFAULT_CACHE_SIZE,
+                 fetch_mode=QueryConfig.DEFAULT_FETCH_MODE,
+                 listing_ttl=DEFAULT_LISTING_TTL,
+                 request_timeout=QueryConfig.DEFAULT_REQUEST_TIMEOUT,
+                 max_retries=QueryConfig.DEFAULT_MAX_RETRIES,
+                 hedge_requests=False):
+        self.thread_limit = thread_limit
+        self.cache_path = cache_path
+        self.cache_size = cache_size
+        self.fetch_mode = fetch_mode
+        self.listing_ttl = listing_ttl
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.hedge_requests = hedge_requests
+        # listings by organization name, along with their listing time
+        self._listings = {}
+        self._lock = threading.Lock()
+        self.refreshes = SingleFlight()
+        # concurrent queries share their commit lookups. the lookups are
+        # not memoized, since the daemon runs for good: the emails of
+        # commits are kept in the size-bounded commit cache instead.
+        self.commit_lookups = SingleFlight()
+
+    def start(self):
+        network.configure_sessions(self.thread_limit)
+        network.configure_cache(self.cache_path, self.cache_size)
+        network.configure_retries(self.request_timeout, self.max_retries)
+        network.configure_hedging(self.hedge_requests)
+        executor.configure_executor(self.thread_limit)
+
+    def stop(self):
+        executor.shutdown_executor()
+        network.close_cache()
+
+    def create_query(self, yaml_contents):
+        """Create a Query from the contents of a config.yaml file.
+        """
+        qc = QueryConfig.from_yaml(yaml_contents['query_config'])
+        qc.thread_limit = self.thread_limit
+        qc.cache_path = self.cache_path
+        qc.cache_size = self.cache_size
+        qc.fetch_mode = self.fetch_mode
+        qc.request_timeout = self.request_timeout
+        qc.max_retries = self.max_retries
+        qc.hedge_requests = self.hedge_requests
+        filters = [Filter.from_yaml(yaml_filter)
+                   for yaml_filter in yaml_contents.get('filters', [])]
+
+        query = Query.from_config(qc)
+        query.attach_filters(filters)
+        query.commit_lookups = self.commit_lookups
+        return query
+
+    def run_query(self, query):
+        """Run `query`, as created by `create_query`, and return its
+        resulting branches.
+        """
+        if query.config.offline:
+            query.query()
+        else:
+            query.query_listing(self.get_listing(query))
+            network.flush_cache()
+        metrics.increment('daemon.queries')
+        return query.result
+
+    def get_listing(self, query):
+        org_name = query.config.github_org.name
+        listing = self._fresh_listing(org_name)
+        if listing is None:
+            listing = self.refreshes.do(org_name, self.refresh_listing, query)
+        return listing
+
+    def refresh_listing(self, query):
+        org_name = query.config.github_org.name
+        # the listing may have been refreshed by a query that finished
+        # just before this one started its refresh
+        listing = self._fresh_listing(org_name)
+        if listing is not None:
+            return listing
+
+        logger.info('listing the branches of the {0} organization...'
+                    .format(org_name))
+        listing = query.list_org_branches()
+        with self._lock:
+            self._listings[org_name] = (time.time(), listing)
+        metrics.increment('daemon.listings')
+        return listing
+
+    def _fresh_listing(self, org_name):
+        with self._lock:
+            listed_at, listing = self._listings.get(org_name, (None, None))
+        if listed_at is None or time.time() - listed_at > self.listing_ttl:
+            return None
+        metrics.increment('daemon.listing_hits')
+        return listing
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """ Answers POST /query requests, whose body is the json form of a
+    config.yaml file, with the json list of the query's branches.
+    """
+
+    def do_POST(self):
+        if self.path != QUERY_PATH:
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            yaml_contents = json.loads(body)
+            query = self.server.service.create_query(yaml_contents)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.send_error(400, str(e))
+            return
+        try:
+            result = self.server.service.run_query(query)
+        except Exception as e:
+            logger.exception('query failed')
+            self.send_error(500, str(e))
+            return
+        self.send_json('[{0}]'.format(', '.join(serialize(branch)
+                                                for branch in result)))
+
+    def do_GET(self):
+        if self.path != METRICS_PATH:
+            self.send_error(404)
+            return
+        self.send_json(json.dumps(metrics.snapshot()))
+
+    def send_json(self, body):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # requests over a unix socket have no client address
+        return str(self.client_address or 'unix')
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class QueryServer(SocketServer.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service, address):
+        HTTPServer.__init__(self, address, QueryHandler)
+        self.service = service
+
+
+class UnixQueryServer(SocketServer.ThreadingMixIn,
+                      SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, service, path):
+        if os.path.exists(path):
+            os.remove(path)
+        SocketServer.UnixStreamServer.__init__(self, path, QueryHandler)
+        self.service = service
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
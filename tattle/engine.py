@@ -20,12 +20,23 @@ import yaml
 import sys
 import getpass
 
+from tattle import daemon
+from tattle import metrics
+from tattle import webhooks
+from tattle.index import BranchIndex
+from tattle.model import FETCH_MODES
+from tattle.model import JiraSearchError
 from tattle.model import QueryConfig
 from tattle.model import Query
+from tattle.model import QueryBatch
 from tattle.model import Filter
+from tattle.network import RetriesExhaustedError
+from tattle.report import OUTPUT_FORMATS
 
 GITHUB_USER = 'GITHUB_USER'
 GITHUB_PASS = 'GITHUB_PASS'
+GITHUB_TOKENS = 'GITHUB_TOKENS'
+WEBHOOK_SECRET = 'TATTLE_WEBHOOK_SECRET'
 CONFIG_PATH_COMMAND_NAME = '--config-path'
 CONFIG_PATH_HELP_TEXT = 'a path to a YAML configuration file'
 ORG_NAME_COMMAND_NAME = '--org'
@@ -44,10 +55,73 @@ OUTPUT_PATH_COMMAND_NAME = '--output-path'
 OUTPUT_PATH_HELP_TEXT = 'the path of tattle\'s output file, a report.json ' \
                         'file. If not specified, /tmp/Tattle/report.json ' \
                         'will be used.'
+CACHE_PATH_COMMAND_NAME = '--cache-path'
+CACHE_PATH_HELP_TEXT = 'the path of tattle\'s GitHub response cache. If ' \
+                       'not specified, /tmp/tattle/cache.db will be used.'
+OUTPUT_FORMAT_COMMAND_NAME = '--output-format'
+OUTPUT_FORMAT_HELP_TEXT = 'the format of the report, either `json` (a ' \
+                          'single sorted list, written once the query is ' \
+                          'complete) or `ndjson` (one branch per line, ' \
+                          'written as soon as the branch is ready). If ' \
+                          'the output path ends with .gz, the report is ' \
+                          'gzip compressed.'
+FETCH_MODE_COMMAND_NAME = '--fetch-mode'
+FETCH_MODE_HELP_TEXT = 'the GitHub API used by tattle, either `rest` or ' \
+                       '`graphql`. If not specified, `rest` will be used.'
+EXPLAIN_COMMAND_NAME = '--explain'
+EXPLAIN_HELP_TEXT = 'print the query plan and its estimated number of ' \
+                    'requests instead of running the query. The ' \
+                    'branches are still listed in order to make the ' \
+                    'estimate.'
+REFRESH_ISSUES_COMMAND_NAME = '--refresh-issues'
+REFRESH_ISSUES_HELP_TEXT = 'look up the status of every JIRA issue, even ' \
+                           'if it is found in the issue cache.'
+FULL_REFRESH_COMMAND_NAME = '--full-refresh'
+FULL_REFRESH_HELP_TEXT = 'list the branches of every repo, instead of ' \
+                         'reusing the branches listed by the previous ' \
+                         'query for repos that were not pushed to since.'
+INDEX_PATH_COMMAND_NAME = '--index-path'
+INDEX_PATH_HELP_TEXT = 'the path of tattle\'s branch index. If not ' \
+                       'specified, /tmp/tattle/index.db will be used.'
+REFRESH_INDEX_COMMAND_NAME = '--refresh-index'
+REFRESH_INDEX_HELP_TEXT = 'crawl the organization into the branch index ' \
+                          'instead of running the query.'
+OFFLINE_COMMAND_NAME = '--offline'
+OFFLINE_HELP_TEXT = 'run the query against the branch index, without ' \
+                    'sending any requests to GitHub or JIRA.'
+INGEST_SPOOL_COMMAND_NAME = '--ingest-spool'
+INGEST_SPOOL_HELP_TEXT = 'apply the GitHub webhook events spooled in this ' \
+                         'directory to the branch index instead of ' \
+                         'running the query.'
+WEBHOOK_PORT_COMMAND_NAME = '--webhook-port'
+WEBHOOK_PORT_HELP_TEXT = 'listen for GitHub webhook events on this port, ' \
+                         'and apply them to the branch index, instead of ' \
+                         'running the query.'
+DAEMON_PORT_COMMAND_NAME = '--daemon-port'
+DAEMON_PORT_HELP_TEXT = 'run tattle as a daemon, which answers queries ' \
+                        'POSTed to http://127.0.0.1:<PORT>/query.'
+DAEMON_SOCKET_COMMAND_NAME = '--daemon-socket'
+DAEMON_SOCKET_HELP_TEXT = 'run tattle as a daemon, which answers queries ' \
+                          'POSTed to /query over this unix socket.'
+LISTING_TTL_COMMAND_NAME = '--listing-ttl'
+LISTING_TTL_HELP_TEXT = 'the number of seconds for which a daemon reuses ' \
+                        'the branches it listed. If not specified, 300 ' \
+                        'seconds will be used.'
+REQUEST_TIMEOUT_COMMAND_NAME = '--request-timeout'
+REQUEST_TIMEOUT_HELP_TEXT = 'the number of seconds to wait for a ' \
+                            'connection, or for the next byte of a ' \
+                            'response. If not specified, 30 seconds will ' \
+                            'be used.'
+MAX_RETRIES_COMMAND_NAME = '--max-retries'
+MAX_RETRIES_HELP_TEXT = 'the number of times a request that timed out or ' \
+                        'failed with a server error is sent again. If not ' \
+                        'specified, 3 retries will be used.'
+HEDGE_REQUESTS_COMMAND_NAME = '--hedge-requests'
+HEDGE_REQUESTS_HELP_TEXT = 'send slow requests a second time, and use ' \
+                           'whichever response arrives first.'
 THREAD_LIMIT_COMMAND_NAME = '--thread-limit'
-THREAD_LIMIT_HELP_TEXT = 'maximum number of threads used by tattle. Unless ' \
-                         'specified, tattle will use all available ' \
-                         'resources in order to perform as fast as it can.'
+THREAD_LIMIT_HELP_TEXT = 'maximum number of threads used by tattle. If ' \
+                         'not specified, 64 threads will be used.'
 
 ARGUMENT_PARSER_DESCRIPTION = 'Perform simple queries on your GitHub branches'
 USE_PASSWORD_PROMPT = 'Running tattle without a github username & password ' \
@@ -83,6 +157,8 @@ def query_yes_no(question):
 def enforce_github_env_variables():
     """Checks and enforces Github credentials' environment variables.
     """
+    if os.environ.get(GITHUB_TOKENS):
+        return
     try:
         github_user = os.environ[GITHUB_USER]
         github_pass = os.environ[GITHUB_PASS]
@@ -125,6 +201,63 @@ def parse_arguments():
                         '-o',
                         metavar='<OUTPUT-PATH>',
                         help=OUTPUT_PATH_HELP_TEXT)
+    parser.add_argument(CACHE_PATH_COMMAND_NAME,
+                        metavar='<CACHE-PATH>',
+                        help=CACHE_PATH_HELP_TEXT)
+    parser.add_argument(OUTPUT_FORMAT_COMMAND_NAME,
+                        choices=OUTPUT_FORMATS,
+                        help=OUTPUT_FORMAT_HELP_TEXT)
+    parser.add_argument(FETCH_MODE_COMMAND_NAME,
+                        choices=FETCH_MODES,
+                        help=FETCH_MODE_HELP_TEXT)
+    parser.add_argument(EXPLAIN_COMMAND_NAME,
+                        action='store_true',
+                        help=EXPLAIN_HELP_TEXT)
+    parser.add_argument(REFRESH_ISSUES_COMMAND_NAME,
+                        action='store_true',
+                        help=REFRESH_ISSUES_HELP_TEXT)
+    parser.add_argument(FULL_REFRESH_COMMAND_NAME,
+                        action='store_true',
+                        help=FULL_REFRESH_HELP_TEXT)
+    parser.add_argument(INDEX_PATH_COMMAND_NAME,
+                        metavar='<INDEX-PATH>',
+                        help=INDEX_PATH_HELP_TEXT)
+    parser.add_argument(REFRESH_INDEX_COMMAND_NAME,
+                        action='store_true',
+                        help=REFRESH_INDEX_HELP_TEXT)
+    parser.add_argument(OFFLINE_COMMAND_NAME,
+                        action='store_true',
+                        help=OFFLINE_HELP_TEXT)
+    parser.add_argument(INGEST_SPOOL_COMMAND_NAME,
+                        metavar='<SPOOL-DIR>',
+                        help=INGEST_SPOOL_HELP_TEXT)
+    parser.add_argument(WEBHOOK_PORT_COMMAND_NAME,
+                        metavar='<PORT>',
+                        type=int,
+                        help=WEBHOOK_PORT_HELP_TEXT)
+    parser.add_argument(DAEMON_PORT_COMMAND_NAME,
+                        metavar='<PORT>',
+                        type=int,
+                        help=DAEMON_PORT_HELP_TEXT)
+    parser.add_argument(DAEMON_SOCKET_COMMAND_NAME,
+                        metavar='<SOCKET-PATH>',
+                        help=DAEMON_SOCKET_HELP_TEXT)
+    parser.add_argument(LISTING_TTL_COMMAND_NAME,
+                        metavar='<SECONDS>',
+                        type=int,
+                        default=daemon.DEFAULT_LISTING_TTL,
+                        help=LISTING_TTL_HELP_TEXT)
+    parser.add_argument(REQUEST_TIMEOUT_COMMAND_NAME,
+                        metavar='<SECONDS>',
+                        type=float,
+                        help=REQUEST_TIMEOUT_HELP_TEXT)
+    parser.add_argument(MAX_RETRIES_COMMAND_NAME,
+                        metavar='<RETRIES>',
+                        type=int,
+                        help=MAX_RETRIES_HELP_TEXT)
+    parser.add_argument(HEDGE_REQUESTS_COMMAND_NAME,
+                        action='store_true',
+                        help=HEDGE_REQUESTS_HELP_TEXT)
     parser.add_argument(THREAD_LIMIT_COMMAND_NAME,
                         '-t',
                         metavar='<THREAD-LIMIT>',
@@ -170,6 +303,13 @@ def print_performance(start, end):
     print 'total time: {} seconds'.format(total_time)
 
 
+def print_metrics():
+    """ Prints the metrics gathered during the query, such as cache hits.
+    """
+    for name, value in sorted(metrics.snapshot().items()):
+        print '{0}: {1}'.format(name, value)
+
+
 def get_query_from_yaml(config_path):
     """Creates a Query object from a yaml file found in config_path.
 
@@ -179,6 +319,18 @@ def get_query_from_yaml(config_path):
     :param config_path: Path to the configuration yaml file.
     :return: A Query object along with the filters in the file, if found.
     """
+    return get_queries_from_yaml(config_path)[0]
+
+
+def get_queries_from_yaml(config_path):
+    """Creates the Query objects of a yaml file found in config_path.
+
+    A yaml file may hold a list of queries under `queries`, each with its
+    own filters and `query_config`. The `query_config` of a query
+    overrides the fields of the file's top level `query_config`.
+    :param config_path: Path to the configuration yaml file.
+    :return: A list of Query objects, along with their filters.
+    """
     try:
         with open(config_path) as config_file:
             yaml_contents = yaml.load(config_file)
@@ -187,9 +339,21 @@ def get_query_from_yaml(config_path):
         sys.exit('The config.yaml path you provided, `{0}`, does not '
                  'lead to an existing file.'.format(config_path))
 
-    yaml_config = yaml_contents['query_config']
-    yaml_filters = yaml_contents['filters']
+    yaml_config = yaml_contents.get('query_config') or {}
+    yaml_queries = yaml_contents.get('queries')
+    if yaml_queries is None:
+        return [create_query(yaml_config, yaml_contents['filters'])]
 
+    queries = []
+    for yaml_query in yaml_queries:
+        query_config = dict(yaml_config)
+        query_config.update(yaml_query.get('query_config') or {})
+        queries.append(create_query(query_config,
+                                    yaml_query.get('filters') or []))
+    return queries
+
+
+def create_query(yaml_config, yaml_filters):
     qc = QueryConfig.from_yaml(yaml_config)
     filters = [Filter.from_yaml(yaml_filter) for yaml_filter in yaml_filters]
 
@@ -216,25 +380,123 @@ def get_query_from_args(args):
     return query
 
 
+def ingest_webhooks(args, index_path):
+    """Apply GitHub webhook events to the branch index at `index_path`.
+
+    Spooled events are applied first, and then, if a webhook port is
+    given, events are received over HTTP until tattle is interrupted.
+    """
+    with BranchIndex(index_path) as index:
+        if args.ingest_spool:
+            applied = webhooks.ingest_spool(index, args.ingest_spool)
+            print 'ingested {0} webhook events'.format(applied)
+        if args.webhook_port:
+            server = webhooks.WebhookServer(
+                    index,
+                    (webhooks.DEFAULT_WEBHOOK_HOST, args.webhook_port),
+                    secret=os.environ.get(WEBHOOK_SECRET))
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+
+
+def serve(args, config):
+    """Answer queries until tattle is interrupted.
+
+    The daemon's threads, caches and fetch mode are those of `config`.
+    """
+    service = daemon.QueryService(config.thread_limit,
+                                  cache_path=config.cache_path,
+                                  cache_size=config.cache_size,
+                                  fetch_mode=config.fetch_mode,
+                                  listing_ttl=args.listing_ttl,
+                                  request_timeout=config.request_timeout,
+                                  max_retries=config.max_retries,
+                                  hedge_requests=config.hedge_requests)
+    if args.daemon_socket:
+        server = daemon.UnixQueryServer(service, args.daemon_socket)
+    else:
+        server = daemon.QueryServer(
+                service, (daemon.DEFAULT_DAEMON_HOST, args.daemon_port))
+    service.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
 def main():
     # Save the start time
     start = time.time()
     args = parse_arguments()
-    # Make sure the Github environment variables are set
-    enforce_github_env_variables()
 
     if args.config_path:
-        # Get the Query from yaml if a config_path argument is given
-        query = get_query_from_yaml(args.config_path)
+        # Get the Queries from yaml if a config_path argument is given
+        queries = get_queries_from_yaml(args.config_path)
     else:
         # Get the Query from the CLI arguments if no config_path is argument
         # is found
-        query = get_query_from_args(args)
+        queries = [get_query_from_args(args)]
+    query = queries[0]
+
+    for q in queries:
+        if args.refresh_issues:
+            q.config.refresh_issues = True
+        if args.full_refresh:
+            q.config.full_refresh = True
+        if args.index_path:
+            q.config.index_path = args.index_path
+        if args.offline:
+            q.config.offline = True
+        if args.request_timeout:
+            q.config.request_timeout = args.request_timeout
+        if args.max_retries is not None:
+            q.config.max_retries = args.max_retries
+        if args.hedge_requests:
+            q.config.hedge_requests = True
+
+    if args.ingest_spool or args.webhook_port:
+        ingest_webhooks(args, query.config.index_path)
+        return
 
-    query.query()
-    query.output()
+    # Make sure the Github environment variables are set
+    enforce_github_env_variables()
+
+    if args.daemon_port or args.daemon_socket:
+        serve(args, query.config)
+        return
+
+    if args.explain:
+        for q in queries:
+            print q.explain()
+        return
+
+    if args.refresh_index:
+        for q in queries:
+            q.refresh_index()
+        print_performance(start, time.time())
+        print_metrics()
+        return
+
+    try:
+        if len(queries) > 1:
+            # the queries share a single listing of the organization's
+            # branches
+            QueryBatch(queries).run()
+        else:
+            query.run()
+    except (RetriesExhaustedError, JiraSearchError) as e:
+        sys.exit('tattle failed to complete the query, and its report was '
+                 'not written: {0}'.format(e))
     # Print how long was the whole operation
     print_performance(start, time.time())
+    print_metrics()
 
 
 if __name__ == '__main__':
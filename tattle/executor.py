@@ -0,0 +1,163 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import threading
+from multiprocessing.dummy import Pool as ThreadPool
+
+# the number of worker threads used by a query, unless a thread limit is
+# configured. the number of requests in flight is not tied to it: it is
+# adapted by the network module to how well GitHub and JIRA cope.
+DEFAULT_THREAD_LIMIT = 64
+
+_executor = None
+_fetch_executor = None
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class Executor(object):
+    """ A bounded pool of worker threads, shared by all the stages of a
+    query.
+
+    The threads are started on first use, and are stopped by `shutdown`.
+    An executor that was shut down starts new threads if it is used again.
+
+    A `map` called from one of the executor's own worker threads runs in
+    that thread, instead of waiting for other workers to become free:
+    with a bounded number of threads, a worker that waits for other
+    workers may wait forever. Requests that a worker fans out, such as the
+    pages of a listing, are sent on the separate fetch executor instead.
+    """
+
+    def __init__(self, num_of_threads=DEFAULT_THREAD_LIMIT):
+        self.num_of_threads = max(1, num_of_threads)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        self.shutdown(wait=exc_type is None)
+
+    def in_worker(self):
+        """Return True if called from one of the executor's workers.
+        """
+        return getattr(_local, 'executor', None) is self
+
+    def map(self, function, items):
+        """Apply `function` to every item, and return the results in order.
+        """
+        items = list(items)
+        if len(items) <= 1 or self.in_worker():
+            return [function(item) for item in items]
+        return self._get_pool().map(self._call, [(function, (item,))
+                                                 for item in items])
+
+    def apply_async(self, function, args=()):
+        """Run `function(*args)` on one of the workers.
+        """
+        return self._get_pool().apply_async(self._call, ((function, args),))
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads.
+
+        :param wait: whether to wait for the tasks that were already
+                     submitted, rather than discard them.
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        if wait:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.num_of_threads)
+            return self._pool
+
+    def _call(self, task):
+        function, args = task
+        _local.executor = self
+        try:
+            return function(*args)
+        finally:
+            _local.executor = None
+
+
+def configure_executor(thread_limit):
+    """Set the number of threads of the shared executor, and of the fetch
+    executor.
+
+    An executor is replaced if it has a different number of threads.
+    """
+    global _executor, _fetch_executor
+
+    num_of_threads = thread_limit or DEFAULT_THREAD_LIMIT
+    with _lock:
+        _fetch_executor = _resize(_fetch_executor, num_of_threads)
+        _executor = _resize(_executor, num_of_threads)
+        return _executor
+
+
+def get_executor():
+    """Return the shared executor, creating a default one if needed.
+    """
+    global _executor
+
+    with _lock:
+        if _executor is None:
+            _executor = Executor()
+        return _executor
+
+
+def get_fetch_executor():
+    """Return the fetch executor, creating a default one if needed.
+
+    The fetch executor sends the requests that the shared executor's
+    workers fan out, so they are sent in parallel even though the workers
+    themselves are busy. The functions it runs must not fan out any
+    further, so its workers never wait for each other.
+    """
+    global _fetch_executor
+
+    with _lock:
+        if _fetch_executor is None:
+            _fetch_executor = Executor()
+        return _fetch_executor
+
+
+def shutdown_executor(wait=True):
+    global _executor, _fetch_executor
+
+    with _lock:
+        executors = [_executor, _fetch_executor]
+        _executor = _fetch_executor = None
+    for executor in executors:
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def _resize(executor, num_of_threads):
+    if executor is not None:
+        if executor.num_of_threads == num_of_threads:
+            return executor
+        executor.shutdown()
+    return Executor(num_of_threads)
@@ -0,0 +1,119 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import json
+
+from tattle import network
+
+GITHUB_GRAPHQL_URL = 'https://api.github.com/graphql'
+
+# GitHub's GraphQL API returns at most 100 nodes per connection
+NODES_PER_PAGE = 100
+
+REF_FIELDS = '''
+    pageInfo { hasNextPage endCursor }
+    nodes {
+      name
+      target { ... on Commit { oid author { email } } }
+    }
+'''
+
+ORG_REPOSITORIES_QUERY = '''
+query ($org: String!, $cursor: String) {
+  organization(login: $org) {
+    repositories(first: %(per_page)d, after: $cursor) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        name
+        owner { login }
+        refs(refPrefix: "refs/heads/", first: %(per_page)d) { %(refs)s }
+      }
+    }
+  }
+}
+''' % {'per_page': NODES_PER_PAGE, 'refs': REF_FIELDS}
+
+REPOSITORY_REFS_QUERY = '''
+query ($org: String!, $repo: String!, $cursor: String) {
+  repository(owner: $org, name: $repo) {
+    refs(refPrefix: "refs/heads/", first: %(per_page)d, after: $cursor) {
+      %(refs)s
+    }
+  }
+}
+''' % {'per_page': NODES_PER_PAGE, 'refs': REF_FIELDS}
+
+
+class GraphQLError(Exception):
+    pass
+
+
+def run_query(query, variables, auth=None):
+    """Run a GraphQL query against the GitHub API and return its data.
+
+    :raises GraphQLError: if GitHub could not answer the query.
+    """
+    response = network.post(GITHUB_GRAPHQL_URL,
+                            json.dumps({'query': query,
+                                        'variables': variables}),
+                            auth=auth)
+    if not 300 > response.status_code >= 200:
+        raise GraphQLError('GitHub answered the GraphQL query with status '
+                           'code {0}'.format(response.status_code))
+    result = json.loads(response.text)
+    if result.get('errors'):
+        raise GraphQLError('; '.join(error.get('message', '')
+                                     for error in result['errors']))
+    return result['data']
+
+
+def get_org_repositories(org_name, auth=None):
+    """Yield the json repositories of `org_name`, one page at a time.
+
+    Every repository comes with the first page of its branches; those
+    are listed in full by `get_repository_refs`.
+    """
+    cursor = None
+    while True:
+        data = run_query(ORG_REPOSITORIES_QUERY,
+                         {'org': org_name, 'cursor': cursor},
+                         auth=auth)
+        repositories = data['organization']['repositories']
+        yield repositories['nodes']
+        page_info = repositories['pageInfo']
+        if not page_info['hasNextPage']:
+            return
+        cursor = page_info['endCursor']
+
+
+def get_repository_refs(json_repository, auth=None):
+    """Return all of the json branches of a json repository.
+
+    Only repositories with more branches than fit a single page cost
+    additional queries.
+    """
+    refs = json_repository['refs']
+    nodes = list(refs['nodes'])
+    page_info = refs['pageInfo']
+    while page_info['hasNextPage']:
+        data = run_query(REPOSITORY_REFS_QUERY,
+                         {'org': json_repository['owner']['login'],
+                          'repo': json_repository['name'],
+                          'cursor': page_info['endCursor']},
+                         auth=auth)
+        refs = data['repository']['refs']
+        nodes.extend(refs['nodes'])
+        page_info = refs['pageInfo']
+    return nodes
@@ -0,0 +1,131 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import sys
+import threading
+from collections import deque
+from Queue import Empty
+from Queue import Queue
+
+from tattle import metrics
+
+# a request is hedged once it is slower than this percentile of the
+# recent requests to its backend
+DEFAULT_HEDGE_PERCENTILE = 95
+# the number of recent latencies the percentile is computed over, and the
+# number of latencies needed before any request is hedged
+LATENCY_WINDOW = 500
+MIN_LATENCY_SAMPLES = 50
+# the maximum number of hedges, as a fraction of the number of requests
+DEFAULT_MAX_HEDGE_RATIO = 0.05
+
+
+class LatencyTracker(object):
+    """ Keeps the latencies of the recent requests of every backend.
+    """
+
+    def __init__(self, percentile=DEFAULT_HEDGE_PERCENTILE,
+                 window=LATENCY_WINDOW, min_samples=MIN_LATENCY_SAMPLES):
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, backend, latency):
+        with self._lock:
+            latencies = self._latencies.get(backend)
+            if latencies is None:
+                latencies = self._latencies[backend] = deque(
+                        maxlen=self.window)
+            latencies.append(latency)
+
+    def threshold(self, backend):
+        """Return the latency above which requests to `backend` are hedged,
+        or None if too few requests were made to tell.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies.get(backend, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        index = int(len(latencies) * self.percentile / 100.0)
+        return latencies[min(index, len(latencies) - 1)]
+
+
+class HedgeBudget(object):
+    """ Caps the number of hedges to a fraction of the number of requests.
+
+    The budget is shared by all of the backends, so hedging never costs
+    more than `max_ratio` of the requests made, and of the rate limit.
+    """
+
+    def __init__(self, max_ratio=DEFAULT_MAX_HEDGE_RATIO):
+        self.max_ratio = max_ratio
+        self.requests = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def try_hedge(self):
+        """Reserve a hedge, and return whether the budget allowed it.
+        """
+        with self._lock:
+            if self.hedges + 1 > self.requests * self.max_ratio:
+                return False
+            self.hedges += 1
+            return True
+
+
+def hedged_call(function, threshold, budget, executor, hedge=None):
+    """Return the result of `function()`, calling `hedge()` as well if the
+    first call takes longer than `threshold` seconds.
+
+    Both calls run on `executor`, and the result of the one that finishes
+    first is returned. If the first call to finish fails, the result of
+    the other one is waited for.
+
+    :param hedge: the function of the second call, `function` by default
+    """
+    results = Queue()
+
+    functions = [function, hedge or function]
+
+    def attempt(number):
+        try:
+            results.put((number, functions[number](), None))
+        except Exception:
+            results.put((number, None, sys.exc_info()))
+
+    executor.apply_async(attempt, (0,))
+    attempts = 1
+    try:
+        number, result, exc_info = results.get(timeout=threshold)
+    except Empty:
+        if budget.try_hedge():
+            metrics.increment('hedging.hedges')
+            executor.apply_async(attempt, (1,))
+            attempts += 1
+        number, result, exc_info = results.get()
+
+    if exc_info is not None and attempts > 1:
+        number, result, exc_info = results.get()
+    if number == 1 and exc_info is None:
+        metrics.increment('hedging.wins')
+    if exc_info is not None:
+        raise exc_info[0], exc_info[1], exc_info[2]
+    return result
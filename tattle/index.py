@@ -0,0 +1,281 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import os
+import sqlite3
+import threading
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS repos (
+    org TEXT NOT NULL,
+    name TEXT NOT NULL,
+    pushed_at TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (org, name));
+
+CREATE TABLE IF NOT EXISTS branches (
+    org TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    name TEXT NOT NULL,
+    sha TEXT,
+    committer_email TEXT,
+    PRIMARY KEY (org, repo, name));
+CREATE INDEX IF NOT EXISTS branches_name ON branches (name);
+CREATE INDEX IF NOT EXISTS branches_committer_email
+    ON branches (committer_email);
+
+CREATE TABLE IF NOT EXISTS issues (
+    team TEXT NOT NULL,
+    key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (team, key));
+CREATE INDEX IF NOT EXISTS issues_status ON issues (team, status);
+'''
+
+BRANCH_COLUMNS = ('org', 'repo', 'name', 'sha', 'committer_email')
+
+
+class NameCondition(object):
+    """ Keeps the branches whose name satisfies `matches`.
+    """
+
+    def __init__(self, matches):
+        self.matches = matches
+
+
+class IssueCondition(object):
+    """ Keeps the branches whose JIRA issue has one of `statuses`.
+
+    The key of a branch's issue is `generate_key(branch_name)`, and its
+    status is looked up among the indexed issues of `jira_team_name`.
+    """
+
+    def __init__(self, jira_team_name, generate_key, statuses):
+        self.jira_team_name = jira_team_name
+        self.generate_key = generate_key
+        self.statuses = list(statuses)
+
+
+class BranchIndex(object):
+    """ A local index of the repos, branches and JIRA issues of GitHub
+    organizations, stored in an sqlite database.
+
+    The index is filled by crawling GitHub and JIRA, and is queried
+    offline. Branches are indexed by name, repo and committer, and issues
+    by status.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        index_dir = os.path.dirname(path)
+        if index_dir and not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def update_repo(self, org_name, repo_name, stamp, branches):
+        """Replace the indexed branches of a repo.
+
+        The committer emails of branches whose head commit didn't change
+        are kept.
+
+        :param stamp: the repo's push and update times
+        :param branches: (name, sha) pairs
+        """
+        with self._lock:
+            emails = dict(
+                    ((name, sha), email) for name, sha, email in
+                    self._connection.execute(
+                            'SELECT name, sha, committer_email '
+                            'FROM branches WHERE org = ? AND repo = ?',
+                            (org_name, repo_name)))
+            self._connection.execute(
+                    'DELETE FROM branches WHERE org = ? AND repo = ?',
+                    (org_name, repo_name))
+            self._connection.executemany(
+                    'INSERT INTO branches '
+                    '(org, repo, name, sha, committer_email) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(org_name, repo_name, name, sha,
+                      emails.get((name, sha)))
+                     for name, sha in branches])
+            self._connection.execute(
+                    'INSERT OR REPLACE INTO repos '
+                    '(org, name, pushed_at, updated_at) '
+                    'VALUES (?, ?, ?, ?)',
+                    (org_name, repo_name, stamp[0], stamp[1]))
+
+    def update_branch(self, org_name, repo_name, branch_name, sha,
+                      committer_email=None):
+        """Add a branch to the index, or move its head to `sha`.
+
+        The committer email of a branch whose head commit didn't change is
+        kept, unless `committer_email` is given. A branch whose head is
+        not known (`sha` is None) keeps its indexed head.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                    'SELECT sha, committer_email FROM branches '
+                    'WHERE org = ? AND repo = ? AND name = ?',
+                    (org_name, repo_name, branch_name)).fetchone()
+            if row is not None:
+                if sha is None:
+                    sha = row[0]
+                if committer_email is None and sha == row[0]:
+                    committer_email = row[1]
+            self._connection.execute(
+                    'INSERT OR REPLACE INTO branches '
+                    '(org, repo, name, sha, committer_email) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (org_name, repo_name, branch_name, sha,
+                     committer_email))
+            # the repo's stamp is left alone, since it is only known to
+            # the crawler
+            self._connection.execute(
+                    'INSERT OR IGNORE INTO repos (org, name) VALUES (?, ?)',
+                    (org_name, repo_name))
+
+    def remove_branch(self, org_name, repo_name, branch_name):
+        with self._lock:
+            self._connection.execute(
+                    'DELETE FROM branches '
+                    'WHERE org = ? AND repo = ? AND name = ?',
+                    (org_name, repo_name, branch_name))
+
+    def update_committer_email(self, org_name, repo_name, branch_name,
+                               email):
+        with self._lock:
+            self._connection.execute(
+                    'UPDATE branches SET committer_email = ? '
+                    'WHERE org = ? AND repo = ? AND name = ?',
+                    (email, org_name, repo_name, branch_name))
+
+    def update_issues(self, jira_team_name, issues):
+        """Index the statuses of JIRA issues.
+
+        :param issues: (key, status) pairs
+        """
+        with self._lock:
+            self._connection.executemany(
+                    'INSERT OR REPLACE INTO issues (team, key, status) '
+                    'VALUES (?, ?, ?)',
+                    [(jira_team_name, key, status)
+                     for key, status in issues])
+
+    def remove_missing_repos(self, org_name, repo_names):
+        """Remove the repos of `org_name` that are not in `repo_names`.
+        """
+        repo_names = set(repo_names)
+        with self._lock:
+            missing = [(org_name, name) for (name,) in
+                       self._connection.execute(
+                               'SELECT name FROM repos WHERE org = ?',
+                               (org_name,))
+                       if name not in repo_names]
+            self._connection.executemany(
+                    'DELETE FROM branches WHERE org = ? AND repo = ?',
+                    missing)
+            self._connection.executemany(
+                    'DELETE FROM repos WHERE org = ? AND name = ?',
+                    missing)
+
+    def get_repo_names(self, org_name):
+        with self._lock:
+            return [name for (name,) in self._connection.execute(
+                    'SELECT name FROM repos WHERE org = ? ORDER BY name',
+                    (org_name,))]
+
+    def find_branches(self, org_name, conditions=(), repo_name=None,
+                      committer_email=None, branch_name=None):
+        """Return the indexed branches of `org_name` that satisfy all of
+        `conditions`, sorted by name and repo.
+
+        :param conditions: NameCondition and IssueCondition objects
+        :param repo_name: if given, only the branches of this repo
+        :param committer_email: if given, only the branches whose head
+                                commit was authored by this email
+        :param branch_name: if given, only the branches of this name
+        :return: a dict per branch, with the BRANCH_COLUMNS, along with the
+                 key and status of the issue of the last issue condition.
+        :rtype: list
+        """
+        columns = ['b.{0}'.format(column) for column in BRANCH_COLUMNS]
+        joins = []
+        clauses = ['b.org = ?']
+        params = [org_name]
+        for column, value in [('repo', repo_name),
+                              ('committer_email', committer_email),
+                              ('name', branch_name)]:
+            if value is not None:
+                clauses.append('b.{0} = ?'.format(column))
+                params.append(value)
+
+        functions = {}
+        join_params = []
+        issue_alias = None
+        for number, condition in enumerate(conditions):
+            function_name = 'condition_{0}'.format(number)
+            if isinstance(condition, NameCondition):
+                functions[function_name] = condition.matches
+                clauses.append('{0}(b.name)'.format(function_name))
+            else:
+                functions[function_name] = condition.generate_key
+                issue_alias = 'i{0}'.format(number)
+                joins.append('JOIN issues {0} ON {0}.team = ? AND '
+                             '{0}.key = {1}(b.name)'
+                             .format(issue_alias, function_name))
+                join_params.append(condition.jira_team_name)
+                clauses.append('{0}.status IN ({1})'.format(
+                        issue_alias,
+                        ', '.join('?' * len(condition.statuses))))
+                params.extend(condition.statuses)
+
+        if issue_alias is None:
+            columns.extend(['NULL', 'NULL'])
+        else:
+            columns.extend(['{0}.key'.format(issue_alias),
+                            '{0}.status'.format(issue_alias)])
+        sql = 'SELECT {0} FROM branches b {1} WHERE {2} ' \
+              'ORDER BY b.name, b.repo'.format(', '.join(columns),
+                                               ' '.join(joins),
+                                               ' AND '.join(clauses))
+
+        with self._lock:
+            for function_name, function in functions.items():
+                self._connection.create_function(function_name, 1, function)
+            rows = self._connection.execute(sql,
+                                            join_params + params).fetchall()
+        return [dict(zip(BRANCH_COLUMNS + ('issue_key', 'issue_status'),
+                         row))
+                for row in rows]
+
+    def commit(self):
+        with self._lock:
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
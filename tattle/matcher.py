@@ -0,0 +1,188 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import re
+from collections import deque
+
+REGEX_METACHARACTERS = frozenset('.^$*+?{}[]\\|()')
+# patterns that can't be safely merged into a single alternation:
+# backreferences and conditional groups refer to group numbers that shift
+# once the patterns are merged, group names may not repeat in a single
+# pattern, and inline flags apply to the whole merged pattern.
+UNMERGEABLE_PATTERN = re.compile(
+        r'\\[1-9]|\(\?P[=<]|\(\?\(|\(\?[iLmsux]+\)')
+# the number of capturing groups a single merged pattern may have. python
+# 2.7's re module supports up to 100 groups per pattern.
+MAX_MERGED_GROUPS = 99
+# below this number of literals, plain substring checks are faster than
+# walking the automaton
+MIN_AUTOMATON_KEYWORDS = 8
+
+
+def is_literal(pattern):
+    return not REGEX_METACHARACTERS.intersection(pattern)
+
+
+def split_by_groups(patterns):
+    """Split `patterns` into chunks whose capturing groups add up to no
+    more than MAX_MERGED_GROUPS, so that every chunk can be merged.
+    """
+    chunk = []
+    num_of_groups = 0
+    for pattern in patterns:
+        groups = re.compile(pattern).groups
+        if chunk and num_of_groups + groups > MAX_MERGED_GROUPS:
+            yield chunk
+            chunk = []
+            num_of_groups = 0
+        chunk.append(pattern)
+        num_of_groups += groups
+    if chunk:
+        yield chunk
+
+
+def merge_patterns(patterns):
+    """Return the compiled regexes that search for any of `patterns`.
+
+    The patterns are merged into a single alternation, unless they fail
+    to compile together, in which case they are compiled one by one.
+    """
+    if len(patterns) == 1:
+        return [re.compile(patterns[0])]
+    try:
+        return [re.compile('|'.join('(?:{0})'.format(p) for p in patterns))]
+    except (re.error, AssertionError, OverflowError):
+        # patterns that are valid on their own, but not together, are
+        # searched for one by one. python 2.7 raises an AssertionError
+        # rather than an re.error once a pattern has too many groups.
+        return [re.compile(p) for p in patterns]
+
+
+class AhoCorasick(object):
+    """ An Aho-Corasick automaton, which finds whether a text contains any
+    of a set of keywords in a single pass over the text.
+    """
+
+    def __init__(self, keywords):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [False]
+
+        for keyword in keywords:
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(False)
+                state = next_state
+            self._output[state] = True
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                if self._output[self._fail[next_state]]:
+                    self._output[next_state] = True
+
+        self._transitions = self._build_transitions()
+
+    def _build_transitions(self):
+        # the failure links are folded into a full transition table, so
+        # that searching costs a single lookup per character of the text
+        transitions = [None] * len(self._goto)
+        transitions[0] = dict(self._goto[0])
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            transitions[state] = dict(transitions[self._fail[state]])
+            transitions[state].update(self._goto[state])
+            queue.extend(self._goto[state].values())
+        return transitions
+
+    def search(self, text):
+        """Return True if `text` contains any of the keywords.
+        """
+        output = self._output
+        if output[0]:
+            return True
+        transitions = self._transitions
+        state = 0
+        for char in text:
+            state = transitions[state].get(char, 0)
+            if output[state]:
+                return True
+        return False
+
+
+class NameMatcher(object):
+    """ Matches names against a list of regular expressions.
+
+    A name matches if any of the patterns is found in it, exactly as with
+    `re.search`. The patterns are compiled once: plain literals are
+    searched for all at once, and the rest of the patterns are merged into
+    a single regular expression. Results are memoized per name, since the
+    same branch names recur across many repos.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._results = {}
+
+        literals = [p for p in self.patterns if is_literal(p)]
+        regexes = [p for p in self.patterns if not is_literal(p)]
+
+        self._literals = None
+        self._automaton = None
+        if len(literals) >= MIN_AUTOMATON_KEYWORDS:
+            self._automaton = AhoCorasick(literals)
+        elif literals:
+            self._literals = literals
+
+        mergeable = [p for p in regexes if not UNMERGEABLE_PATTERN.search(p)]
+        self._regexes = [merged for chunk in split_by_groups(mergeable)
+                         for merged in merge_patterns(chunk)]
+        self._regexes.extend(re.compile(p) for p in regexes
+                             if UNMERGEABLE_PATTERN.search(p))
+
+    def __eq__(self, other):
+        if type(other) is type(self):
+            return self.patterns == other.patterns
+        return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def matches(self, name):
+        result = self._results.get(name)
+        if result is None:
+            result = self._results[name] = self._match(name)
+        return result
+
+    def _match(self, name):
+        if self._automaton is not None and self._automaton.search(name):
+            return True
+        if self._literals is not None and \
+                any(literal in name for literal in self._literals):
+            return True
+        return any(regex.search(name) for regex in self._regexes)
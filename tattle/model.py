@@ -22,30 +22,80 @@ import posixpath
 import re
 import sys
 import tempfile
+import urllib
+import urlparse
+from collections import OrderedDict
 from collections import defaultdict
 from functools import partial
-from multiprocessing.dummy import Pool as ThreadPool
 
-import requests
+from tattle import credentials
+from tattle import executor
+from tattle import graphql
+from tattle import metrics
+from tattle import network
+from tattle.cache import DEFAULT_MAX_ENTRIES
+from tattle.executor import DEFAULT_THREAD_LIMIT
+from tattle.index import BranchIndex
+from tattle.index import IssueCondition
+from tattle.index import NameCondition
+from tattle.matcher import NameMatcher
+from tattle.pipeline import Pipeline
+from tattle.pipeline import Stage
+from tattle.pipeline import split_into_batches
+from tattle.report import JSON_FORMAT
+from tattle.report import ReportWriter
+from tattle.singleflight import SingleFlight
 
 PROJECT_NAME = 'tattle'
 
 ITEMS_PER_PAGE = 100
-NO_THREAD_LIMIT = sys.maxint
+# the maximum number of threads used by a single stage of a query pipeline
+MAX_STAGE_THREADS = 50
 
 GITHUB_API_URL = 'https://api.github.com/'
+# the environment variable of the GitHub tokens, separated by commas
+GITHUB_TOKENS = 'GITHUB_TOKENS'
 ORGS = 'orgs'
 REPOS = 'repos'
 BRANCHES = 'branches'
-
-PUBLIC_REPOS = 'public_repos'
-TOTAL_PRIVATE_REPOS = 'total_private_repos'
-
-JIRA_ISSUE_API_URL_TEMPLATE = 'https://{0}.atlassian.net/rest/api/2/issue/'
+COMMITS = 'commits'
+GIT = 'git'
+
+JIRA_SEARCH_API_URL_TEMPLATE = 'https://{0}.atlassian.net/rest/api/2/search'
+# the number of issue keys resolved by a single JIRA search request
+DEFAULT_JIRA_BATCH_SIZE = 100
+# the status code of a JIRA search whose query refers to an invalid key
+INVALID_QUERY = 400
 JIRA_ISSUE = 'jira_issue'
+COMMITTER_EMAIL = 'committer_email'
+# the namespace of the committer emails of commits, by commit SHA, in the
+# cache's database
+COMMITS_NAMESPACE = 'commits'
+# the namespace of JIRA issues, by team and key, in the cache's database
+ISSUES_NAMESPACE = 'issues'
+# the namespace of the branches listed for every repo by the last query,
+# along with the repo's push and update times at the time
+SNAPSHOTS_NAMESPACE = 'snapshots'
+PUSHED_AT = 'pushed_at'
+UPDATED_AT = 'updated_at'
+JSON_ISSUE = 'json_issue'
 
 DEFAULT_DATA_TYPE = 'branch'
 
+COMMIT_URL_REGEX = re.compile(
+        r'https://api.github.com/repos/(.*)/(.*)/commits/(.*)')
+
+LOCAL_COST = 0
+REMOTE_COST = 1
+COST_NAMES = {LOCAL_COST: 'local', REMOTE_COST: 'remote'}
+
+REST_FETCH_MODE = 'rest'
+GRAPHQL_FETCH_MODE = 'graphql'
+FETCH_MODES = (REST_FETCH_MODE, GRAPHQL_FETCH_MODE)
+
+# the GET requests that are in flight, by url and credentials
+_requests = SingleFlight()
+
 logger = logging.getLogger('model')
 logger.setLevel(logging.DEBUG)
 ish = logging.StreamHandler(sys.stdout)
@@ -56,25 +106,113 @@ ish.setFormatter(info_formatter)
 logger.addHandler(ish)
 
 
-def determine_num_of_threads(thread_limit, num_of_items, per_page=1):
-    requested_threads = int(math.ceil(num_of_items / float(per_page)))
-    return min(thread_limit, requested_threads)
+def get_json(url, auth=None, cache=True):
+    """Return the parsed body of a GET request to `url`.
 
+    Identical requests that are sent while the request is in flight wait
+    for it, and share its parsed body, instead of being sent again. Every
+    such request is counted in the `coalesced.<backend>.<endpoint>` metric.
 
-def create_thread_pool(number_of_threads):
-    if number_of_threads == 0:
-        return ThreadPool(1)
-    return ThreadPool(number_of_threads)
+    :param cache: whether the response goes through the response cache
+    """
+    sent = []
 
+    def send():
+        sent.append(True)
+        return parse_json(network.get(url, auth=auth, cache=cache))
 
-def get_json(url, auth=None):
-    response = requests.get(url, auth=auth)
+    result = _requests.do(network.generate_cache_key(url, auth), send)
+    if not sent:
+        metrics.increment('coalesced.{0}.{1}'.format(
+                network.backend_for_url(url), get_endpoint(url)))
+    return result
+
+
+def get_endpoint(url):
+    """Return the name of the API endpoint that `url` refers to, such as
+    `branches` or `issue`.
+    """
+    segments = urlparse.urlparse(url).path.strip('/').split('/')
+    if network.backend_for_url(url) == network.JIRA:
+        # rest/api/2/{endpoint}/...
+        return segments[3] if len(segments) > 3 else segments[-1]
+    # orgs/{org}/{endpoint}/..., repos/{owner}/{repo}/{endpoint}/... or
+    # repos/{owner}/{repo}/git/{endpoint}/...
+    position = 3 if segments[0] == REPOS else 2
+    if len(segments) > position + 1 and segments[position] == GIT:
+        position += 1
+    return segments[position] if len(segments) > position else segments[0]
+
+
+def parse_json(response):
     status_code = response.status_code
     if 300 > status_code >= 200 and response.text:
         return json.loads(response.text)
     return {}  # returns an empty dict for better handling down the line
 
 
+def count_sent_requests():
+    """Return the number of requests sent to GitHub and JIRA so far.
+    """
+    return sum(metrics.get_value('requests.{0}'.format(backend))
+               for backend in network.BACKENDS)
+
+
+def count_branches(chunks):
+    return sum(len(branches) for branches in chunks)
+
+
+def get_num_of_pages(response):
+    """Return the number of pages of a paginated GitHub API response.
+
+    Unless `response` is the last page, GitHub's Link header refers to the
+    last page, whose number is the number of pages.
+    """
+    last = response.links.get('last')
+    if last is None:
+        return 1
+    query = urlparse.parse_qs(urlparse.urlparse(last['url']).query)
+    return int(query['page'][0])
+
+
+def get_first_json_page(generate_url, auth=None):
+    """Return the items of the first page, along with the number of pages.
+
+    :param generate_url: a function that returns the url of a page,
+                         given its number
+    :param auth: the authentication to be used, if any
+    """
+    response = network.get(generate_url(1), auth=auth)
+    return parse_json(response) or [], get_num_of_pages(response)
+
+
+def get_json_pages(generate_url, auth=None):
+    """Return the items of all of the pages of a paginated GitHub resource.
+
+    The first page is fetched on its own, in order to learn the number of
+    pages from its Link header. The rest of the pages are then fetched in
+    parallel on the fetch executor, which keeps them parallel even when
+    this is called from one of the shared executor's workers.
+
+    :param generate_url: a function that returns the url of a page,
+                         given its number
+    :param auth: the authentication to be used, if any
+    :return: the items of all of the pages, in order
+    :rtype: list
+    """
+    items, num_of_pages = get_first_json_page(generate_url, auth=auth)
+    if num_of_pages == 1:
+        return items
+
+    pages = executor.get_fetch_executor().map(
+            lambda page_number: get_json(generate_url(page_number),
+                                         auth=auth),
+            range(2, num_of_pages + 1))
+    for page in pages:
+        items.extend(page or [])
+    return items
+
+
 def pagination_format(page_number):
     return '?page={0}&per_page={1}'.format(page_number, ITEMS_PER_PAGE)
 
@@ -84,6 +222,7 @@ def generate_github_api_url(request_type,
                             repo_name='',
                             branch_name='',
                             page_number=None,
+                            sha='',
                             ):
     """Return a Github API url based on the given parameters.
 
@@ -99,6 +238,7 @@ def generate_github_api_url(request_type,
     :param branch_name: name of a GitHub branch
     :param page_number: the page number to be used in the pagination
                         of the GitHub API
+    :param sha: the SHA of a GitHub commit
     :return: Github API url
     :rtype: str
     """
@@ -116,13 +256,21 @@ def generate_github_api_url(request_type,
                                             org_name,
                                             repo_name,
                                             BRANCHES
-                                            ),
+                                            ) + (pagination_format(
+                    page_number) if page_number else ''),
 
             'detailed_branch': posixpath.join(REPOS,
                                               org_name,
                                               repo_name,
                                               BRANCHES,
-                                              branch_name)
+                                              branch_name),
+
+            'commit': posixpath.join(REPOS,
+                                     org_name,
+                                     repo_name,
+                                     GIT,
+                                     COMMITS,
+                                     sha)
             }
 
     return posixpath.join(GITHUB_API_URL,
@@ -134,14 +282,36 @@ class GitHubObject(object):
 
     Contains methods shared by all the GitHub objects,
     such as rich comparison methods.
+
+    GitHub objects are kept in `__slots__` rather than in a `__dict__`,
+    since a query over a large organization holds many thousands of them.
+    The fields of an object are the slots of its class and of all of its
+    base classes.
     """
+    __slots__ = ('name',)
+    _fields = {}
 
     def __init__(self, name):
         self.name = name
 
+    @classmethod
+    def fields(cls):
+        fields = cls._fields.get(cls)
+        if fields is None:
+            fields = cls._fields[cls] = tuple(itertools.chain.from_iterable(
+                    klass.__dict__.get('__slots__', ())
+                    for klass in reversed(cls.__mro__)))
+        return fields
+
+    def values(self):
+        return tuple(getattr(self, field) for field in self.fields())
+
+    def to_dict(self):
+        return OrderedDict(itertools.izip(self.fields(), self.values()))
+
     def __eq__(self, other):
         if type(other) is type(self):
-            return self.__dict__ == other.__dict__
+            return self.values() == other.values()
         return False
 
     def __ne__(self, other):
@@ -151,9 +321,37 @@ class GitHubObject(object):
         return self.name < other.name
 
 
+class InternTable(object):
+    """ Shares a single instance of every organization and repo.
+
+    All the branches of a repo refer to the same `Repo`, and all the repos
+    of an organization to the same `Organization`, instead of each branch
+    carrying copies of its own. A table is kept per query.
+    """
+
+    def __init__(self, organizations=()):
+        self._organizations = dict((org.name, org) for org in organizations)
+        self._repos = {}
+
+    def organization(self, name):
+        org = self._organizations.get(name)
+        if org is None:
+            org = self._organizations.setdefault(name, Organization(name))
+        return org
+
+    def repo(self, name, org_name):
+        key = (org_name, name)
+        repo = self._repos.get(key)
+        if repo is None:
+            repo = self._repos.setdefault(
+                    key, Repo(name, org=self.organization(org_name)))
+        return repo
+
+
 class Organization(GitHubObject):
     """ Represents a GitHub organization
     """
+    __slots__ = ()
 
     def __init__(self, name):
         super(Organization, self).__init__(name)
@@ -161,30 +359,10 @@ class Organization(GitHubObject):
     def __str__(self):
         return self.name
 
-    @staticmethod
-    def get_num_of_repos(org):
-        """ Returns the number of repos of the `org` GitHub organization.
-
-        The number of repos includes the number of the private repos.
-        This method interacts with the GitHub API in order to retrieve
-        information about the `org` organization.
-        The numbers of the public and private repos are extracted from this
-        information, and added together as the method's return value
-
-        :param org: GitHub organization
-        :return: the number of repos of the specified organization
-        :rtype: int
-        """
-
-        url = generate_github_api_url('organization', org_name=org.name)
-
-        json_org = get_json(url, auth=QueryConfig.github_credentials())
-
-        return (json_org.get(PUBLIC_REPOS, 0) +
-                json_org.get(TOTAL_PRIVATE_REPOS, 0))
-
 
 class Repo(GitHubObject):
+    __slots__ = ('organization',)
+
     def __init__(self, name, org=None):
         super(Repo, self).__init__(name)
         self.organization = org
@@ -197,121 +375,121 @@ class Repo(GitHubObject):
                                                self.organization)
 
     @classmethod
-    def from_json(cls, json_repo):
+    def from_json(cls, json_repo, intern_table=None):
         name = json_repo['name']
-        organization = Organization(json_repo['owner']['login'])
-        return cls(name, organization)
-
-    @classmethod
-    def get_repos(cls, org, thread_limit=NO_THREAD_LIMIT):
-        logger.info('retrieving github repositories for the {0} '
-                    'organization...'
-                    .format(org))
+        org_name = json_repo['owner']['login']
+        if intern_table is not None:
+            return intern_table.repo(name, org_name)
+        return cls(name, Organization(org_name))
 
-        num_of_repos = Organization.get_num_of_repos(org)
-        num_of_threads = determine_num_of_threads(thread_limit,
-                                                  num_of_repos,
-                                                  per_page=ITEMS_PER_PAGE)
-        pool = create_thread_pool(num_of_threads)
+    @staticmethod
+    def generate_repos_url(org, page_number):
+        return generate_github_api_url('repos',
+                                       org_name=org.name,
+                                       page_number=page_number)
 
-        json_repos = pool.map(partial(cls.get_json_repos, org=org),
-                              range(1, num_of_threads + 1)
-                              )
-        repos = []
-        for list_of_json_repos in json_repos:
-            for json_repo in list_of_json_repos:
-                repos.append(cls.from_json(json_repo))
+    @staticmethod
+    def generate_stamp(json_repo):
+        """Return the push and update times of a repo.
 
-        return repos
+        Any change to the repo's branches changes its push time.
+        """
+        return [json_repo.get(PUSHED_AT), json_repo.get(UPDATED_AT)]
 
-    @staticmethod
-    def get_json_repos(page_number, org):
+    @classmethod
+    def get_json_repos(cls, page_number, org):
 
-        url = generate_github_api_url('repos',
-                                      org_name=org.name,
-                                      page_number=page_number,
-                                      )
+        url = cls.generate_repos_url(org, page_number)
 
         return get_json(url, auth=QueryConfig.github_credentials())
 
 
 class Branch(GitHubObject):
+    __slots__ = ('repo', 'jira_issue', 'committer_email', 'sha')
+
     def __init__(self,
                  name,
                  repo,
                  jira_issue=None,
-                 committer_email=None):
+                 committer_email=None,
+                 sha=None):
         super(Branch, self).__init__(name)
         self.repo = repo
         self.jira_issue = jira_issue
         self.committer_email = committer_email
+        self.sha = sha
 
     def __str__(self):
         return self.name
 
+    def copy(self):
+        return Branch(self.name,
+                      self.repo,
+                      jira_issue=self.jira_issue,
+                      committer_email=self.committer_email,
+                      sha=self.sha)
+
     @classmethod
-    def from_json(cls, json_branch):
+    def from_json(cls, json_branch, repo=None):
+        """Create a Branch from a branch of GitHub's branch listing.
 
+        :param repo: the repo the branch was listed for. If not given, the
+                     repo is parsed out of the branch's commit url.
+        """
         name = json_branch['name']
-        (repo_name, organization) = cls.extract_repo_data(
-                json_branch['commit']['url'])
-        repo = Repo(repo_name, org=organization)
+        if repo is None:
+            (repo_name, organization) = cls.extract_repo_data(
+                    json_branch['commit']['url'])
+            repo = Repo(repo_name, org=organization)
 
-        return cls(name, repo)
+        return cls(name, repo, sha=json_branch['commit'].get('sha'))
+
+    @staticmethod
+    def sort_key(branch):
+        return branch.name, branch.repo.name
+
+    @classmethod
+    def from_graphql(cls, json_ref, repo):
+        """Create a Branch from a ref of GitHub's GraphQL API.
+
+        Unlike a branch of the REST API's branch listing, a GraphQL ref
+        already contains the email of the author of its head commit.
+        """
+        author = json_ref['target'].get('author') or {}
+        return cls(json_ref['name'],
+                   repo,
+                   committer_email=author.get('email'),
+                   sha=json_ref['target'].get('oid'))
 
     @staticmethod
     def extract_repo_data(branch_url):
-        url_regex = re.compile(
-                r'https://api.github.com/repos/(.*)/(.*)/commits/(.*)')
-        groups = url_regex.findall(branch_url)
+        groups = COMMIT_URL_REGEX.findall(branch_url)
         name = groups[0][1]
         organization = Organization(groups[0][0])
         return name, organization
 
     @classmethod
-    def get_org_branches(cls, repos, org, thread_limit=NO_THREAD_LIMIT):
-        logger.info('retrieving basic github branch info '
-                    'for the {0} organization...'
-                    .format(org))
-        num_of_threads = determine_num_of_threads(thread_limit, len(repos))
-        pool = create_thread_pool(num_of_threads)
-
-        json_branches_lists = pool.map(cls.get_json_branches, repos)
-
-        # pool.map returned a list of lists of json-formatted branches.
-        # below we convert it to a list of Branch objects:
-        branches = []
-        for json_branches_list in json_branches_lists:
-            branches.extend([cls.from_json(json_branch)
-                             for json_branch in json_branches_list])
-        return sorted(branches)
+    def get_repo_branches(cls, repo):
+        return [cls.from_json(json_branch, repo=repo)
+                for json_branch in cls.get_json_branches(repo)]
 
     @staticmethod
     def get_json_branches(repo):
 
-        url = generate_github_api_url('list_branches',
-                                      org_name=repo.organization.name,
-                                      repo_name=repo.name)
+        def generate_url(page_number):
+            return generate_github_api_url('list_branches',
+                                           org_name=repo.organization.name,
+                                           repo_name=repo.name,
+                                           page_number=page_number)
 
-        return get_json(url, auth=QueryConfig.github_credentials())
+        return get_json_pages(generate_url,
+                              auth=QueryConfig.github_credentials())
 
     @staticmethod
     def update_branches_with_issues(branches, issues):
         for branch, issue in itertools.izip(branches, issues):
             branch.jira_issue = issue
 
-    @classmethod
-    def get_details(cls, branches, thread_limit):
-        if branches:
-            logger.info('retrieving detailed github branch info '
-                        'for the {0} organization...'
-                        .format(branches[0].repo.organization.name))
-
-        num_of_threads = determine_num_of_threads(thread_limit, len(branches))
-        pool = create_thread_pool(num_of_threads)
-
-        return pool.map(cls.fetch_details, branches)
-
     @staticmethod
     def fetch_details(branch):
 
@@ -324,8 +502,51 @@ class Branch(GitHubObject):
         return get_json(url, auth=QueryConfig.github_credentials())
 
     @staticmethod
-    def update_details(branch, details):
-        branch.committer_email = details['commit']['commit']['author']['email']
+    def fetch_commit(branch):
+
+        url = generate_github_api_url('commit',
+                                      org_name=branch.repo.organization.name,
+                                      repo_name=branch.repo.name,
+                                      sha=branch.sha)
+
+        # a commit's email is kept in the commit cache by its SHA, so the
+        # response itself is not cached
+        return get_json(url, auth=QueryConfig.github_credentials(),
+                        cache=False)
+
+    @classmethod
+    def get_committer_email(cls, branch, commit_cache=None):
+        """Return the email of the author of the branch's head commit.
+
+        A commit never changes, so the email is kept in `commit_cache`
+        under the commit's SHA for good, and is only fetched for commits
+        that were never seen before. Branches whose SHA is unknown fall
+        back to fetching the branch's details.
+        """
+        if branch.sha is None:
+            details = cls.fetch_details(branch)
+            return details['commit']['commit']['author']['email']
+
+        if commit_cache is not None:
+            entry = commit_cache.get(branch.sha)
+            if entry is not None:
+                metrics.increment('commit_cache.hits')
+                return entry[COMMITTER_EMAIL]
+            metrics.increment('commit_cache.misses')
+
+        json_commit = cls.fetch_commit(branch)
+        if not json_commit:
+            return None
+        email = json_commit['author']['email']
+        if commit_cache is not None:
+            commit_cache.set(branch.sha, {COMMITTER_EMAIL: email})
+        return email
+
+
+class JiraSearchError(Exception):
+    """ Raised when JIRA fails to answer a search for reasons other than
+    the keys it was asked for.
+    """
 
 
 class Issue(object):
@@ -334,6 +555,7 @@ class Issue(object):
                 u'Pending', u'Pull Request', u'Reopened', u'Resolved',
                 u'Stopped', u'To Do'
                 ]
+    __slots__ = ('key', 'status')
 
     def __init__(self, key, status):
 
@@ -342,7 +564,7 @@ class Issue(object):
 
     def __eq__(self, other):
         if type(other) is type(self):
-            return self.__dict__ == other.__dict__
+            return (self.key, self.status) == (other.key, other.status)
         return False
 
     def __ne__(self, other):
@@ -351,6 +573,9 @@ class Issue(object):
     def __str__(self):
         return 'key: {0}, status: {1}'.format(self.key, self.status)
 
+    def to_dict(self):
+        return OrderedDict([('key', self.key), ('status', self.status)])
+
     @staticmethod
     def generate_issue_keys(items, transform):
 
@@ -359,27 +584,127 @@ class Issue(object):
 
     @classmethod
     def get_json_issues(cls, keys, jira_team_name,
-                        thread_limit=NO_THREAD_LIMIT):
-
-        number_of_threads = determine_num_of_threads(thread_limit, len(keys))
-        pool = create_thread_pool(number_of_threads)
+                        batch_size=DEFAULT_JIRA_BATCH_SIZE):
+        """Return the json issues of `keys`, in the order of `keys`.
 
-        return pool.map(
-                partial(cls.get_json_issue, jira_team_name=jira_team_name),
-                keys
+        Keys are deduplicated, and looked up in batches of `batch_size`
+        keys per JIRA search request. The json issue of a key that could
+        not be found is None.
+        """
+        unique_keys = sorted(set(key for key in keys if key is not None))
+        batches = [unique_keys[i:i + batch_size]
+                   for i in range(0, len(unique_keys), batch_size)]
+
+        json_issues_lists = executor.get_executor().map(
+                partial(cls.search_json_issues,
+                        jira_team_name=jira_team_name),
+                batches
         )
 
+        json_issues = {}
+        for json_issues_list in json_issues_lists:
+            for json_issue in json_issues_list:
+                json_issues[json_issue['key']] = json_issue
+        return [json_issues.get(key) for key in keys]
+
+    @classmethod
+    def lookup_json_issues(cls, keys, jira_team_name,
+                           batch_size=DEFAULT_JIRA_BATCH_SIZE,
+                           issue_cache=None,
+                           refresh=False):
+        """Return a dict of the json issues of `keys`, by key.
+
+        Issues that are found in `issue_cache` are not searched for, unless
+        `refresh` is set. The issues that are searched for are stored in
+        the cache. Keys that could not be found are not cached, since a
+        failed search looks the same as a missing issue.
+        """
+        json_issues = {}
+        missing_keys = []
+        for key in keys:
+            entry = None
+            if issue_cache is not None and not refresh:
+                entry = issue_cache.get(cls.cache_key(key, jira_team_name))
+                metrics.increment('issue_cache.hits' if entry is not None
+                                  else 'issue_cache.misses')
+            if entry is None:
+                missing_keys.append(key)
+            else:
+                json_issues[key] = entry[JSON_ISSUE]
+
+        if missing_keys:
+            found_json_issues = cls.get_json_issues(missing_keys,
+                                                    jira_team_name,
+                                                    batch_size=batch_size)
+            for key, json_issue in itertools.izip(missing_keys,
+                                                  found_json_issues):
+                json_issues[key] = json_issue
+                if issue_cache is not None and json_issue is not None:
+                    issue_cache.set(cls.cache_key(key, jira_team_name),
+                                    {JSON_ISSUE: json_issue})
+        return json_issues
+
     @staticmethod
-    def get_json_issue(key, jira_team_name):
+    def cache_key(key, jira_team_name):
+        return '{0}/{1}'.format(jira_team_name, key)
 
-        if key is None:  # because of CFY-GIVEAWAY
-            return key
-        url = posixpath.join(JIRA_ISSUE_API_URL_TEMPLATE
-                             .format(jira_team_name),
-                             key,
-                             '?fields=status'
-                             )
-        return get_json(url)
+    @classmethod
+    def search_json_issues(cls, keys, jira_team_name):
+        """Return the json issues of `keys` found by a JIRA search.
+
+        Keys that do not exist are only reported as warnings by JIRA, and
+        are missing from the result. JIRA rejects the whole search if one
+        of the keys is invalid, in which case the batch is split in two and
+        each half is searched on its own, so one bad key costs a few extra
+        requests rather than the whole batch. JIRA may return fewer issues
+        than asked for, and the rest are then fetched page by page.
+
+        :raises JiraSearchError: if JIRA fails the search for any other
+                                 reason
+        """
+        if not keys:
+            return []
+        jql = 'key in ({0})'.format(
+                ', '.join('"{0}"'.format(key) for key in keys))
+
+        def search(start_at):
+            url = '{0}?{1}'.format(
+                    JIRA_SEARCH_API_URL_TEMPLATE.format(jira_team_name),
+                    urllib.urlencode([('jql', jql),
+                                      ('fields', 'status'),
+                                      ('startAt', start_at),
+                                      ('maxResults', len(keys)),
+                                      ('validateQuery', 'warn')]))
+            response = network.get(url)
+            if not 300 > response.status_code >= 200 and \
+                    response.status_code != INVALID_QUERY:
+                raise JiraSearchError(
+                        'JIRA answered the search for {0} issues of the {1} '
+                        'team with status code {2}'.format(
+                                len(keys), jira_team_name,
+                                response.status_code))
+            return response.status_code, parse_json(response)
+
+        status_code, result = search(0)
+        if status_code == INVALID_QUERY:
+            if len(keys) == 1:
+                logger.debug('could not find the JIRA issue {0}'
+                             .format(keys[0]))
+                return []
+            middle = len(keys) / 2
+            return (cls.search_json_issues(keys[:middle], jira_team_name) +
+                    cls.search_json_issues(keys[middle:], jira_team_name))
+
+        json_issues = result.get('issues', [])
+        total = result.get('total', len(json_issues))
+        if not json_issues or len(json_issues) >= total:
+            return json_issues
+        pages = executor.get_fetch_executor().map(
+                lambda start_at: search(start_at)[1].get('issues', []),
+                range(len(json_issues), total, len(json_issues)))
+        for page in pages:
+            json_issues.extend(page)
+        return json_issues
 
     @classmethod
     def from_json(cls, json_issue):
@@ -395,10 +720,29 @@ class Issue(object):
 
 class Filter(object):
     PRECEDENCE = 'precedence'
+    # the cost of applying the filter. filters that only inspect the items
+    # themselves are applied before filters that look up remote data.
+    COST = LOCAL_COST
+    DESCRIPTION = 'filter'
 
     def __init__(self, precedence):
         self.precedence = precedence
 
+    def estimate_requests(self, chunks, known_keys=frozenset()):
+        """Return the number of requests needed to filter `chunks`, the
+        branches of every repo.
+
+        :param known_keys: the keys of the issues that need not be looked
+                           up, since they are already known
+        """
+        return 0
+
+    def index_condition(self):
+        """Return the condition that applies the filter to the branch
+        index.
+        """
+        raise NotImplementedError()
+
     def __eq__(self, other):
         if type(other) is type(self):
             return self.__dict__ == other.__dict__
@@ -434,6 +778,7 @@ class Filter(object):
 
 class NameFilter(Filter):
     REGEXES = 'regular_expressions'
+    DESCRIPTION = 'name filter'
 
     @staticmethod
     def convert_arguments_to_strings(regex_list):
@@ -448,6 +793,7 @@ class NameFilter(Filter):
             self.regexes = self.convert_arguments_to_strings(regexes)
         else:
             self.regexes = []
+        self.matcher = NameMatcher(self.regexes)
 
     @classmethod
     def from_yaml(cls, yaml_nf):
@@ -470,27 +816,32 @@ class NameFilter(Filter):
         return filter(self.legal, items)
 
     def legal(self, item):
-        for regex in self.regexes:
-            if re.search(regex, item.name):
-                return True
-        return False
+        return self.matcher.matches(item.name)
+
+    def index_condition(self):
+        return NameCondition(self.matcher.matches)
 
 
 class IssueFilter(Filter):
     JIRA_TEAM_NAME = 'jira_team_name'
     JIRA_STATUSES = 'jira_statuses'
     TRANSFORM = 'transform'
+    BATCH_SIZE = 'batch_size'
     DEFAULT_JIRA_TEAM = 'cloudifysource'
+    COST = REMOTE_COST
+    DESCRIPTION = 'issue filter'
 
     def __init__(self,
                  precedence,
                  jira_team_name,
                  jira_statuses,
-                 transform):
+                 transform,
+                 batch_size=DEFAULT_JIRA_BATCH_SIZE):
         super(IssueFilter, self).__init__(precedence)
         self.jira_team_name = jira_team_name
         self.jira_statuses = jira_statuses
         self.transform = transform
+        self.batch_size = batch_size
 
     @classmethod
     def from_args(cls, args_if):
@@ -514,8 +865,10 @@ class IssueFilter(Filter):
 
         yaml_transform = yaml_if.get(cls.TRANSFORM, None)
         transform = Transform.from_yaml(yaml_transform)
+        batch_size = yaml_if.get(cls.BATCH_SIZE, DEFAULT_JIRA_BATCH_SIZE)
 
-        return cls(precedence, jira_team_name, jira_statuses, transform)
+        return cls(precedence, jira_team_name, jira_statuses, transform,
+                   batch_size=batch_size)
 
     def filter(self, items):
         return filter(self.legal, items)
@@ -525,6 +878,33 @@ class IssueFilter(Filter):
             return False
         return item.jira_issue.status in self.jira_statuses
 
+    def index_condition(self):
+        return IssueCondition(self.jira_team_name,
+                              self.transform.transform,
+                              self.jira_statuses)
+
+    def count_keys(self, items):
+        """Return the number of distinct issue keys of `items`.
+        """
+        keys = set(Issue.generate_issue_keys(items, self.transform))
+        keys.discard(None)
+        return len(keys)
+
+    def estimate_requests(self, chunks, known_keys=frozenset()):
+        # the chunks are batched just like the query batches them, and the
+        # keys of every batch that are still unknown are searched for
+        known_keys = set(known_keys)
+        requests = 0
+        for batch in split_into_batches(chunks, self.batch_size,
+                                        self.count_keys):
+            keys = set(Issue.generate_issue_keys(
+                    itertools.chain.from_iterable(batch), self.transform))
+            keys.discard(None)
+            keys -= known_keys
+            known_keys |= keys
+            requests += int(math.ceil(len(keys) / float(self.batch_size)))
+        return requests
+
 
 class Transform(object):
     BASE = 'base'
@@ -537,10 +917,17 @@ class Transform(object):
         self.if_doesnt_contain = if_doesnt_contain
         self.replace_from = replace_from
         self.replace_to = replace_to
+        self._base_regex = re.compile(base) if base else None
+        # transforms are memoized per name, since the same branch names
+        # recur across many repos
+        self._results = {}
 
     def __eq__(self, other):
         if type(other) is type(self):
-            return self.__dict__ == other.__dict__
+            return ((self.base, self.if_doesnt_contain,
+                     self.replace_from, self.replace_to) ==
+                    (other.base, other.if_doesnt_contain,
+                     other.replace_from, other.replace_to))
         return False
 
     @classmethod
@@ -569,8 +956,14 @@ class Transform(object):
         return cls('CFY-*\d+', '-', 'CFY', 'CFY-')
 
     def transform(self, src):
+        result = self._results.get(src)
+        if result is None:
+            result = self._results[src] = self._transform(src)
+        return result
 
-        base = re.search(self.base, src) if self.base else None
+    def _transform(self, src):
+
+        base = self._base_regex.search(src) if self._base_regex else None
         if base is not None:
             group = base.group()
             if self.if_doesnt_contain == '':
@@ -595,9 +988,45 @@ class QueryConfig(object):
                                                 DEFAULT_OUTPUT_FILE_NAME)
     DEFAULT_OUTPUT_PATH = os.path.join(tempfile.gettempdir(),
                                        DEFAULT_OUTPUT_RELATIVE_PATH)
+    OUTPUT_FORMAT = 'output_format'
+    DEFAULT_OUTPUT_FORMAT = JSON_FORMAT
+    FETCH_MODE = 'fetch_mode'
+    DEFAULT_FETCH_MODE = REST_FETCH_MODE
+    CACHE_PATH = 'cache_path'
+    CACHE_SIZE = 'cache_size'
+    ISSUE_CACHE_TTL = 'issue_cache_ttl'
+    DEFAULT_ISSUE_CACHE_TTL = 60 * 60
+    REFRESH_ISSUES = 'refresh_issues'
+    FULL_REFRESH = 'full_refresh'
+    DEFAULT_CACHE_FILE_NAME = 'cache.db'
+    DEFAULT_CACHE_PATH = os.path.join(tempfile.gettempdir(),
+                                      PROJECT_NAME,
+                                      DEFAULT_CACHE_FILE_NAME)
+    DEFAULT_CACHE_SIZE = DEFAULT_MAX_ENTRIES
+    INDEX_PATH = 'index_path'
+    DEFAULT_INDEX_FILE_NAME = 'index.db'
+    DEFAULT_INDEX_PATH = os.path.join(tempfile.gettempdir(),
+                                      PROJECT_NAME,
+                                      DEFAULT_INDEX_FILE_NAME)
+    OFFLINE = 'offline'
+    REQUEST_TIMEOUT = 'request_timeout'
+    DEFAULT_REQUEST_TIMEOUT = network.DEFAULT_REQUEST_TIMEOUT
+    MAX_RETRIES = 'max_retries'
+    DEFAULT_MAX_RETRIES = network.DEFAULT_MAX_RETRIES
+    HEDGE_REQUESTS = 'hedge_requests'
 
     @staticmethod
     def github_credentials():
+        """Return the GitHub credentials found in the environment.
+
+        If several tokens are given by GITHUB_TOKENS, separated by commas,
+        requests are spread over all of them by a CredentialPool.
+        """
+        tokens = [token.strip() for token in
+                  os.environ.get(GITHUB_TOKENS, '').split(',')
+                  if token.strip()]
+        if tokens:
+            return credentials.get_credential_pool(tokens)
         try:
             return (os.environ['GITHUB_USER'],
                     os.environ['GITHUB_PASS'])
@@ -608,12 +1037,36 @@ class QueryConfig(object):
                  data_type,
                  thread_limit,
                  github_org,
-                 output_path):
+                 output_path,
+                 cache_path=DEFAULT_CACHE_PATH,
+                 cache_size=DEFAULT_CACHE_SIZE,
+                 fetch_mode=DEFAULT_FETCH_MODE,
+                 output_format=DEFAULT_OUTPUT_FORMAT,
+                 issue_cache_ttl=DEFAULT_ISSUE_CACHE_TTL,
+                 refresh_issues=False,
+                 full_refresh=False,
+                 index_path=DEFAULT_INDEX_PATH,
+                 offline=False,
+                 request_timeout=DEFAULT_REQUEST_TIMEOUT,
+                 max_retries=DEFAULT_MAX_RETRIES,
+                 hedge_requests=False):
 
         self.data_type = data_type
         self.thread_limit = thread_limit
         self.github_org = github_org
         self.output_path = output_path
+        self.cache_path = cache_path
+        self.cache_size = cache_size
+        self.fetch_mode = fetch_mode
+        self.output_format = output_format
+        self.issue_cache_ttl = issue_cache_ttl
+        self.refresh_issues = refresh_issues
+        self.full_refresh = full_refresh
+        self.index_path = index_path
+        self.offline = offline
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.hedge_requests = hedge_requests
 
     def __eq__(self, other):
         if type(other) is type(self):
@@ -624,14 +1077,42 @@ class QueryConfig(object):
     def from_yaml(cls, yaml_qc):
 
         data_type = yaml_qc.get(cls.DATA_TYPE)
-        thread_limit = yaml_qc.get(cls.THREAD_LIMIT, NO_THREAD_LIMIT)
+        thread_limit = yaml_qc.get(cls.THREAD_LIMIT, DEFAULT_THREAD_LIMIT)
         github_org = yaml_qc.get(cls.GITHUB_ORG, cls.DEFAULT_ORGANIZATION)
         output_path = yaml_qc.get(cls.OUTPUT_PATH, cls.DEFAULT_OUTPUT_PATH)
+        # an explicit `cache_path: null` disables the response cache
+        cache_path = yaml_qc.get(cls.CACHE_PATH, cls.DEFAULT_CACHE_PATH)
+        cache_size = yaml_qc.get(cls.CACHE_SIZE, cls.DEFAULT_CACHE_SIZE)
+        fetch_mode = yaml_qc.get(cls.FETCH_MODE, cls.DEFAULT_FETCH_MODE)
+        output_format = yaml_qc.get(cls.OUTPUT_FORMAT,
+                                    cls.DEFAULT_OUTPUT_FORMAT)
+        issue_cache_ttl = yaml_qc.get(cls.ISSUE_CACHE_TTL,
+                                      cls.DEFAULT_ISSUE_CACHE_TTL)
+        refresh_issues = yaml_qc.get(cls.REFRESH_ISSUES, False)
+        full_refresh = yaml_qc.get(cls.FULL_REFRESH, False)
+        index_path = yaml_qc.get(cls.INDEX_PATH, cls.DEFAULT_INDEX_PATH)
+        offline = yaml_qc.get(cls.OFFLINE, False)
+        request_timeout = yaml_qc.get(cls.REQUEST_TIMEOUT,
+                                      cls.DEFAULT_REQUEST_TIMEOUT)
+        max_retries = yaml_qc.get(cls.MAX_RETRIES, cls.DEFAULT_MAX_RETRIES)
+        hedge_requests = yaml_qc.get(cls.HEDGE_REQUESTS, False)
 
         return cls(data_type,
                    thread_limit,
                    Organization(github_org),
-                   output_path)
+                   output_path,
+                   cache_path=cache_path,
+                   cache_size=cache_size,
+                   fetch_mode=fetch_mode,
+                   output_format=output_format,
+                   issue_cache_ttl=issue_cache_ttl,
+                   refresh_issues=refresh_issues,
+                   full_refresh=full_refresh,
+                   index_path=index_path,
+                   offline=offline,
+                   request_timeout=request_timeout,
+                   max_retries=max_retries,
+                   hedge_requests=hedge_requests)
 
     @classmethod
     def from_args(cls, args):
@@ -643,7 +1124,7 @@ class QueryConfig(object):
         if hasattr(args, cls.THREAD_LIMIT) and args.thread_limit:
             thread_limit = args.thread_limit
         else:
-            thread_limit = NO_THREAD_LIMIT
+            thread_limit = DEFAULT_THREAD_LIMIT
 
         if hasattr(args, cls.OUTPUT_PATH) and args.output_path:
             output_path = args.output_path
@@ -655,10 +1136,55 @@ class QueryConfig(object):
         else:
             github_org = cls.DEFAULT_ORGANIZATION
 
+        if hasattr(args, cls.CACHE_PATH) and args.cache_path:
+            cache_path = args.cache_path
+        else:
+            cache_path = cls.DEFAULT_CACHE_PATH
+
+        if hasattr(args, cls.FETCH_MODE) and args.fetch_mode:
+            fetch_mode = args.fetch_mode
+        else:
+            fetch_mode = cls.DEFAULT_FETCH_MODE
+
+        if hasattr(args, cls.OUTPUT_FORMAT) and args.output_format:
+            output_format = args.output_format
+        else:
+            output_format = cls.DEFAULT_OUTPUT_FORMAT
+
+        if hasattr(args, cls.INDEX_PATH) and args.index_path:
+            index_path = args.index_path
+        else:
+            index_path = cls.DEFAULT_INDEX_PATH
+
+        if hasattr(args, cls.REQUEST_TIMEOUT) and args.request_timeout:
+            request_timeout = args.request_timeout
+        else:
+            request_timeout = cls.DEFAULT_REQUEST_TIMEOUT
+
+        if hasattr(args, cls.MAX_RETRIES) and args.max_retries is not None:
+            max_retries = args.max_retries
+        else:
+            max_retries = cls.DEFAULT_MAX_RETRIES
+
+        refresh_issues = bool(getattr(args, cls.REFRESH_ISSUES, False))
+        full_refresh = bool(getattr(args, cls.FULL_REFRESH, False))
+        offline = bool(getattr(args, cls.OFFLINE, False))
+        hedge_requests = bool(getattr(args, cls.HEDGE_REQUESTS, False))
+
         return cls(DEFAULT_DATA_TYPE,
                    thread_limit,
                    Organization(github_org),
-                   output_path)
+                   output_path,
+                   cache_path=cache_path,
+                   fetch_mode=fetch_mode,
+                   output_format=output_format,
+                   refresh_issues=refresh_issues,
+                   full_refresh=full_refresh,
+                   index_path=index_path,
+                   offline=offline,
+                   request_timeout=request_timeout,
+                   max_retries=max_retries,
+                   hedge_requests=hedge_requests)
 
 
 class Query(object):
@@ -681,71 +1207,573 @@ class Query(object):
         return query_class(config)
 
     def attach_filters(self, filters):
-        """
-        Sorts `filters` by precedence,
+        """Attach `filters` to the query, in the order they will be applied.
+
+        All of the filters must be satisfied by the query's items, so they
+        can be applied in any order. Cheap local filters are applied
+        first, so that remote lookups are only made for the items that
+        passed them. Filters of the same cost are sorted by precedence,
         and then by their relative order in config.yaml
         :param filters: a list of Filter-subclasses objects
         """
-        precedence_dict = defaultdict(list)
+        self.filters = self.plan_filters(self.filters + list(filters))
+
+    @staticmethod
+    def plan_filters(filters):
+        return sorted(filters, key=lambda f: (f.COST, f.precedence))
+
+    def create_writer(self):
+        return ReportWriter.from_format(self.config.output_path,
+                                        self.config.output_format)
+
+    def run(self):
+        """Run the query and write its report.
+
+        Streaming report formats are written while the query is running,
+        the rest are written once it is complete.
+        """
+        self.write_report(self.query)
 
-        for f in filters:
-            precedence_dict[f.precedence].append(f)
+    def write_report(self, query_function, *args):
+        """Run `query_function(*args)`, which sets the query's result, and
+        write the query's report.
+        """
+        with self.create_writer() as writer:
+            if writer.STREAMING:
+                query_function(*args, on_result=writer.write)
+            else:
+                query_function(*args)
+                for item in self.result:
+                    writer.write(item)
+
+    def query(self, on_result=None):
+        raise NotImplementedError()
+
+
+class QueryBatch(object):
+    """ Runs several branch queries, each with its own filters and report,
+    at the cost of about one.
+
+    The branches of every organization are listed once, and are shared by
+    all of the queries against it. The queries share their lookups as
+    well, so the details of every branch and the status of every issue
+    are looked up once, however many queries need them.
+    """
 
-        for key in sorted(precedence_dict.keys()):
-            self.filters.extend(precedence_dict[key])
+    def __init__(self, queries):
+        self.queries = queries
+        commit_lookups = SingleFlight(memoize=True)
+        issue_lookups = SingleFlight(memoize=True)
+        for query in queries:
+            query.commit_lookups = commit_lookups
+            query.issue_lookups = issue_lookups
 
-    def output(self):
+    def run(self):
+        """Run the queries and write their reports.
 
-        output_path = self.config.output_path
-        output_dir = os.path.dirname(output_path)
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
+        The queries run with the sessions, caches and executor of the
+        first query.
+        """
+        self.queries[0].run_online(self.run_queries)
 
-        file_logger = logging.getLogger('model')
-        fh = logging.FileHandler(self.config.output_path)
-        fh.setLevel(logging.INFO)
-        file_logger.addHandler(fh)
-        file_logger.log(logging.INFO, json.dumps(self.result,
-                                                 default=lambda x: x.__dict__)
-                        )
+    def run_queries(self):
+        listings = {}
+        for query in self.queries:
+            if query.config.offline:
+                query.run()
+                continue
+            key = (query.config.github_org.name, query.config.fetch_mode)
+            if key not in listings:
+                listings[key] = query.list_org_branches()
+            query.write_report(query.query_listing, listings[key])
 
 
 class BranchQuery(Query):
     def __init__(self, config):
         super(BranchQuery, self).__init__(config)
-        self.issues = None
+        self.intern_table = InternTable([config.github_org]
+                                        if config.github_org else [])
+        # branches that share a head commit share a single lookup
+        self.commit_lookups = SingleFlight(memoize=True)
+        # and branches that refer to the same issue share its lookup
+        self.issue_lookups = SingleFlight(memoize=True)
+
+    def query(self, on_result=None):
+        """Query the branches of the configured GitHub organization.
+
+        The query runs as a pipeline: the branches of every repo are
+        filtered, and the details of the remaining branches are fetched,
+        as soon as the repo's branches are listed, without waiting for the
+        other repos. All of the query's requests are made by a single
+        executor, which is shut down once the query is complete.
+
+        An offline query is answered by the branch index instead, without
+        making any requests.
+
+        :param on_result: if given, called with every resulting branch as
+                          soon as the branch is ready.
+        """
+        if self.config.offline:
+            self.result = self.query_index(on_result)
+        else:
+            self.result = self.run_online(self.run_pipeline, on_result)
+
+    def run_online(self, function, *args):
+        """Return `function(*args)`, run with the query's sessions, caches
+        and executor.
+        """
+        network.configure_sessions(self.config.thread_limit)
+        network.configure_cache(self.config.cache_path,
+                                self.config.cache_size)
+        network.configure_retries(self.config.request_timeout,
+                                  self.config.max_retries)
+        network.configure_hedging(self.config.hedge_requests)
+
+        executor.configure_executor(self.config.thread_limit)
+        try:
+            result = function(*args)
+        except BaseException:
+            executor.shutdown_executor(wait=False)
+            raise
+        executor.shutdown_executor()
+        network.flush_cache()
+        return result
+
+    def run_pipeline(self, on_result=None):
+        org = self.config.github_org
+        logger.info('querying the branches of the {0} organization...'
+                    .format(org))
 
-    def query(self):
+        stages, items = self.create_listing_stages(org)
+        pipeline = Pipeline(stages + self.create_query_stages(),
+                            executor=executor.get_executor())
+        return self.collect(pipeline.run(items), on_result)
+
+    def collect(self, branches, on_result=None):
+        query_branches = []
+        for branch in branches:
+            query_branches.append(branch)
+            if on_result is not None:
+                on_result(branch)
+        metrics.set_value('commit_lookups.coalesced',
+                          self.commit_lookups.coalesced)
+        return sorted(query_branches, key=Branch.sort_key)
+
+    def list_org_branches(self):
+        """Return the branches of the configured organization, without
+        filtering them.
+
+        :return: a list of the branches of every repo
+        :rtype: list
+        """
+        stages, items = self.create_listing_stages(self.config.github_org)
+        pipeline = Pipeline(stages, executor=executor.get_executor())
+        return list(pipeline.run(items))
 
-        repos = Repo.get_repos(self.config.github_org,
-                               self.config.thread_limit)
+    def query_listing(self, listing, on_result=None):
+        """Query the branches of `listing`, as returned by
+        `list_org_branches`, instead of listing them again.
 
-        branches = Branch.get_org_branches(
-                repos,
-                self.config.github_org,
-                thread_limit=self.config.thread_limit
-        )
+        The branches of the listing are copied, so the same listing can be
+        shared by several queries at once. The query's sessions, caches
+        and executor are expected to be configured already.
+        """
+        chunks = [[branch.copy() for branch in branches]
+                  for branches in listing]
+        pipeline = Pipeline(self.create_query_stages(),
+                            executor=executor.get_executor())
+        self.result = self.collect(pipeline.run(chunks), on_result)
 
-        query_branches = self.filter(branches)
-        details = Branch.get_details(query_branches,
-                                     self.config.thread_limit)
+    def create_listing_stages(self, org):
+        """Create the stages that list the organization's branches.
 
-        for branch, branch_details in itertools.izip(query_branches, details):
-            Branch.update_details(branch, branch_details)
+        The branches of every repo are passed on together, so that the
+        issue filters can look up their issues in bulk.
 
-        self.result = query_branches
+        :return: the stages, and the items to be fed to them
+        """
+        if self.config.fetch_mode == GRAPHQL_FETCH_MODE:
+            return self.create_graphql_listing_stages(org)
 
-    def filter(self, branches):
-        for f in self.filters:
-            if isinstance(f, IssueFilter) and not self.issues:
-                keys = Issue.generate_issue_keys(branches, f.transform)
-                json_issues = \
-                    Issue.get_json_issues(
-                            keys,
-                            f.jira_team_name,
-                            thread_limit=self.config.thread_limit)
-                self.issues = [Issue.from_json(j_issue)
-                               for j_issue in json_issues]
-                Branch.update_branches_with_issues(branches, self.issues)
+        num_of_threads = min(self.config.thread_limit, MAX_STAGE_THREADS)
+        list_repos, page_numbers = self.create_repo_lister(org)
+
+        def list_branches(repo_and_stamp):
+            return [self.list_repo_branches(*repo_and_stamp)]
+
+        stages = [Stage('list_repos', list_repos, num_of_threads),
+                  Stage('list_branches', list_branches, num_of_threads)]
+        return stages, page_numbers
+
+    def create_query_stages(self):
+        """Create the stages that filter the listed branches, and fetch
+        the details of the remaining ones.
+
+        The details of branches listed by GitHub's GraphQL API are listed
+        along with them.
+        """
+        num_of_threads = min(self.config.thread_limit, MAX_STAGE_THREADS)
+        stages = [self.create_filter_stage(f, num_of_threads)
+                  for f in self.filters]
+        # the filters are applied to the branches of a repo together, while
+        # the details of every branch are fetched on their own
+        stages.append(Stage('split', lambda branches: branches,
+                            num_of_threads))
+        if self.config.fetch_mode != GRAPHQL_FETCH_MODE:
+            def fetch_details(branch):
+                branch.committer_email = self.get_committer_email(branch)
+                return [branch]
+
+            stages.append(Stage('fetch_details', fetch_details,
+                                num_of_threads))
+        return stages
+
+    def create_filter_stage(self, f, num_of_threads):
+        """Create the stage that applies the filter `f` to the branches of
+        every repo.
+
+        The stage of an issue filter gathers the branches of several repos,
+        until they have enough issue keys between them to fill a JIRA
+        search, so that the keys of repos with few branches are not looked
+        up a handful at a time.
+        """
+        def filter_chunk(branches):
             branches = f.filter(branches)
+            return [branches] if branches else []
+
+        if not isinstance(f, IssueFilter):
+            return Stage(f.DESCRIPTION, filter_chunk, num_of_threads)
+
+        def filter_chunks(chunks):
+            self.lookup_issues(list(itertools.chain.from_iterable(chunks)),
+                               f)
+            return list(itertools.chain.from_iterable(
+                    filter_chunk(branches) for branches in chunks))
+
+        return Stage(f.DESCRIPTION, filter_chunks, num_of_threads,
+                     batch_size=f.batch_size, weigh=f.count_keys)
+
+    def create_repo_lister(self, org):
+        """Return a function that lists a page of the organization's repos,
+        along with the numbers of the pages.
+
+        The repos are listed along with their push and update times.
+        """
+        first_page, num_of_pages = get_first_json_page(
+                partial(Repo.generate_repos_url, org),
+                auth=QueryConfig.github_credentials())
+
+        def list_repos(page_number):
+            if page_number == 1:
+                json_repos = first_page
+            else:
+                json_repos = Repo.get_json_repos(page_number, org)
+            return [(Repo.from_json(json_repo,
+                                    intern_table=self.intern_table),
+                     Repo.generate_stamp(json_repo))
+                    for json_repo in json_repos]
+
+        return list_repos, range(1, num_of_pages + 1)
+
+    def query_index(self, on_result=None):
+        """Return the branches of the branch index that pass the query's
+        filters.
+        """
+        org = self.config.github_org
+        with BranchIndex(self.config.index_path) as index:
+            rows = index.find_branches(
+                    org.name, [f.index_condition() for f in self.filters])
+
+        branches = []
+        for row in rows:
+            branch = self.branch_from_index(row)
+            branches.append(branch)
+            if on_result is not None:
+                on_result(branch)
+        return branches
+
+    def branch_from_index(self, row):
+        repo = self.intern_table.repo(row['repo'], row['org'])
+        jira_issue = None
+        if row['issue_key'] is not None:
+            jira_issue = Issue(row['issue_key'], row['issue_status'])
+        return Branch(row['name'],
+                      repo,
+                      jira_issue=jira_issue,
+                      committer_email=row['committer_email'],
+                      sha=row['sha'])
+
+    def refresh_index(self):
+        """Crawl the organization into the branch index.
+
+        Every branch of every repo is indexed, along with the email of its
+        head commit's author, and the status of its issue for every issue
+        filter of the query. The filters themselves are not applied, so
+        that any query can later run against the index.
+        """
+        with BranchIndex(self.config.index_path) as index:
+            repo_names = self.run_online(self.crawl, index)
+            index.remove_missing_repos(self.config.github_org.name,
+                                       repo_names)
+
+    def crawl(self, index):
+        """Index the organization's repos and branches into `index`.
+
+        :return: the names of the organization's repos
+        """
+        org = self.config.github_org
+        logger.info('indexing the branches of the {0} organization...'
+                    .format(org))
+        num_of_threads = min(self.config.thread_limit, MAX_STAGE_THREADS)
+        list_repos, page_numbers = self.create_repo_lister(org)
+        issue_filters = [f for f in self.filters
+                         if isinstance(f, IssueFilter)]
+        repo_names = []
+
+        def list_branches(repo_and_stamp):
+            repo, stamp = repo_and_stamp
+            repo_names.append(repo.name)
+            branches = self.list_repo_branches(repo, stamp)
+            index.update_repo(org.name, repo.name, stamp,
+                              [(branch.name, branch.sha)
+                               for branch in branches])
+            return [branches] if branches else []
+
+        def index_issues(chunks):
+            branches = list(itertools.chain.from_iterable(chunks))
+            for f in issue_filters:
+                keys = Issue.generate_issue_keys(branches, f.transform)
+                issues = [Issue.from_json(json_issue) for json_issue in
+                          self.lookup_json_issues(keys, f)]
+                index.update_issues(f.jira_team_name,
+                                    [(issue.key, issue.status)
+                                     for issue in issues if issue])
+            return branches
+
+        # the branches of several repos are indexed together, so that their
+        # issues fill the JIRA searches
+        batch_size = min([f.batch_size for f in issue_filters] or
+                         [DEFAULT_JIRA_BATCH_SIZE])
+
+        def count_keys(branches):
+            return max([f.count_keys(branches) for f in issue_filters] or
+                       [len(branches)])
+
+        def index_details(branch):
+            index.update_committer_email(org.name,
+                                         branch.repo.name,
+                                         branch.name,
+                                         self.get_committer_email(branch))
+            return []
+
+        pipeline = Pipeline([Stage('list_repos', list_repos,
+                                   num_of_threads),
+                             Stage('list_branches', list_branches,
+                                   num_of_threads),
+                             Stage('index_issues', index_issues,
+                                   num_of_threads, batch_size=batch_size,
+                                   weigh=count_keys),
+                             Stage('index_details', index_details,
+                                   num_of_threads)],
+                            executor=executor.get_executor())
+        for _ in pipeline.run(page_numbers):
+            pass
+        return repo_names
+
+    def list_repo_branches(self, repo, stamp):
+        """Return the branches of `repo`.
+
+        Unless a full refresh is requested, the branches listed for the
+        repo by a previous query are reused, as long as the repo was not
+        pushed to or updated since. Otherwise the branches are listed,
+        and are stored for the next query.
+
+        :param stamp: the repo's push and update times
+        """
+        snapshot_cache = network.get_cache(SNAPSHOTS_NAMESPACE)
+        key = '{0}/{1}'.format(repo.organization.name, repo.name)
+        if snapshot_cache is not None and not self.config.full_refresh:
+            snapshot = snapshot_cache.get(key)
+            if snapshot is not None and snapshot['stamp'] == stamp:
+                metrics.increment('snapshots.reused_repos')
+                return [Branch(name, repo, sha=sha)
+                        for name, sha in snapshot['branches']]
+
+        branches = Branch.get_repo_branches(repo)
+        metrics.increment('snapshots.listed_repos')
+        # a failed listing looks like an empty one, so empty listings are
+        # not stored
+        if snapshot_cache is not None and branches:
+            snapshot_cache.set(key, {'stamp': stamp,
+                                     'branches': [[branch.name, branch.sha]
+                                                  for branch in branches]})
         return branches
+
+    def get_committer_email(self, branch):
+        commit_cache = network.get_cache(COMMITS_NAMESPACE)
+        if branch.sha is None:
+            return Branch.get_committer_email(branch)
+        return self.commit_lookups.do(branch.sha,
+                                      Branch.get_committer_email,
+                                      branch,
+                                      commit_cache=commit_cache)
+
+    def create_graphql_listing_stages(self, org):
+        """Create the stages that list the organization's branches using
+        GitHub's GraphQL API.
+
+        The repos, their branches and the emails of the branches' head
+        commit authors are all retrieved by a handful of paginated
+        queries, so no per-branch requests are needed.
+
+        :return: the stages, and the items to be fed to them
+        """
+        num_of_threads = min(self.config.thread_limit, MAX_STAGE_THREADS)
+        auth = QueryConfig.github_credentials()
+
+        def list_branches(json_repo):
+            repo = Repo.from_json(json_repo, intern_table=self.intern_table)
+            return [[Branch.from_graphql(json_ref, repo)
+                     for json_ref in graphql.get_repository_refs(json_repo,
+                                                                 auth=auth)]]
+
+        json_repos = itertools.chain.from_iterable(
+                graphql.get_org_repositories(org.name, auth=auth))
+        stages = [Stage('list_branches', list_branches, num_of_threads)]
+        return stages, json_repos
+
+    def explain(self):
+        """Return a description of the query's plan.
+
+        The branches of the organization are listed the way the query lists
+        them, with the query's caches and retries, and the local filters
+        are applied to them, in order to estimate the number of requests
+        each step of the plan costs. The estimates follow the query's
+        batching of issue keys, and leave out the issues and commits that
+        are already cached. Remote filters are not applied, so the
+        estimates of the steps that follow them are upper bounds.
+        """
+        return self.run_online(self.describe_plan)
+
+    def describe_plan(self):
+        org = self.config.github_org
+        sent_requests = count_sent_requests()
+        chunks = self.list_org_branches()
+        listing_requests = count_sent_requests() - sent_requests
+        chunks = [branches for branches in chunks if branches]
+
+        lines = ['query plan for {0} branches in {1} repos of the {2} '
+                 'organization:'.format(count_branches(chunks), len(chunks),
+                                        org),
+                 '  1. list branches: {0} requests'.format(listing_requests)]
+        total_requests = listing_requests
+        exact = True
+        looked_up_keys = defaultdict(set)
+        for step, f in enumerate(self.filters, 2):
+            known_keys = frozenset()
+            if isinstance(f, IssueFilter):
+                known_keys = self.find_known_issue_keys(
+                        chunks, f, looked_up_keys[f.jira_team_name])
+            requests = f.estimate_requests(chunks, known_keys)
+            total_requests += requests
+            requests_bound = '' if exact else 'at most '
+            if f.COST == LOCAL_COST:
+                chunks = [branches for branches in
+                          (f.filter(branches) for branches in chunks)
+                          if branches]
+            else:
+                exact = False
+            lines.append('  {0}. {1} ({2}, precedence {3}): {4}{5} '
+                         'requests, {6}{7} branches remain'
+                         .format(step, f.DESCRIPTION, COST_NAMES[f.COST],
+                                 f.precedence, requests_bound, requests,
+                                 '' if exact else 'at most ',
+                                 count_branches(chunks)))
+
+        if self.config.fetch_mode == GRAPHQL_FETCH_MODE:
+            details_requests = 0
+        else:
+            details_requests = self.estimate_details_requests(
+                    itertools.chain.from_iterable(chunks))
+        total_requests += details_requests
+        lines.append('  {0}. fetch branch details: {1}{2} requests'
+                     .format(len(self.filters) + 2,
+                             '' if exact else 'at most ',
+                             details_requests))
+        lines.append('estimated requests: {0}{1}'
+                     .format('' if exact else 'at most ', total_requests))
+        return '\n'.join(lines)
+
+    def find_known_issue_keys(self, chunks, issue_filter, looked_up_keys):
+        """Return the issue keys of `chunks` that the query doesn't search
+        for: the ones whose issues are fresh in the issue cache, and the
+        ones in `looked_up_keys`, which an earlier filter of the same JIRA
+        team looks up. The keys of `chunks` are added to `looked_up_keys`.
+        """
+        keys = set(Issue.generate_issue_keys(
+                itertools.chain.from_iterable(chunks),
+                issue_filter.transform))
+        keys.discard(None)
+        known_keys = keys & looked_up_keys
+        issue_cache = network.get_cache(ISSUES_NAMESPACE,
+                                        ttl=self.config.issue_cache_ttl)
+        if issue_cache is not None and not self.config.refresh_issues:
+            team = issue_filter.jira_team_name
+            known_keys.update(
+                    key for key in keys - known_keys
+                    if issue_cache.get(Issue.cache_key(key, team)))
+        looked_up_keys.update(keys)
+        return known_keys
+
+    @staticmethod
+    def estimate_details_requests(branches):
+        """Return the number of requests needed to find the committer
+        emails of `branches`. Every commit is looked up once, unless it is
+        in the commit cache.
+        """
+        commit_cache = network.get_cache(COMMITS_NAMESPACE)
+        shas = set()
+        requests = 0
+        for branch in branches:
+            if branch.sha is None:
+                requests += 1
+            elif branch.sha not in shas:
+                shas.add(branch.sha)
+                if commit_cache is None or \
+                        commit_cache.get(branch.sha) is None:
+                    requests += 1
+        return requests
+
+    def lookup_json_issues(self, keys, issue_filter):
+        """Return the json issues of `keys`, in the order of `keys`.
+
+        Every issue is looked up once per query, however many branches
+        refer to it. Lookups go through the persistent issue cache, whose
+        entries go stale after the configured TTL.
+        """
+        team = issue_filter.jira_team_name
+        issue_cache = network.get_cache(ISSUES_NAMESPACE,
+                                        ttl=self.config.issue_cache_ttl)
+
+        def lookup(team_keys):
+            json_issues = Issue.lookup_json_issues(
+                    [key for _, key in team_keys],
+                    team,
+                    batch_size=issue_filter.batch_size,
+                    issue_cache=issue_cache,
+                    refresh=self.config.refresh_issues)
+            return dict(((team, key), json_issue)
+                        for key, json_issue in json_issues.items())
+
+        json_issues = self.issue_lookups.do_many(
+                [(team, key) for key in keys if key is not None], lookup)
+        return [json_issues.get((team, key)) for key in keys]
+
+    def lookup_issues(self, branches, issue_filter):
+        """Look up the issues of `branches` for `issue_filter`, and attach
+        them to the branches.
+        """
+        keys = Issue.generate_issue_keys(branches, issue_filter.transform)
+        json_issues = self.lookup_json_issues(keys, issue_filter)
+        issues = [Issue.from_json(j_issue) for j_issue in json_issues]
+        Branch.update_branches_with_issues(branches, issues)
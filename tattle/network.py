@@ -0,0 +1,566 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import hashlib
+import logging
+import random
+import threading
+import time
+import urlparse
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from tattle import hedging
+from tattle import metrics
+from tattle.cache import PersistentCache
+from tattle.concurrency import AdaptiveLimit
+from tattle.credentials import CredentialPool
+from tattle.executor import Executor
+from tattle.hedging import HedgeBudget
+from tattle.hedging import LatencyTracker
+from tattle.ratelimit import RateLimitScheduler
+
+GITHUB = 'github'
+JIRA = 'jira'
+BACKENDS = (GITHUB, JIRA)
+
+JIRA_HOST_SUFFIX = '.atlassian.net'
+
+# the number of connections kept alive per backend. a connection pool
+# larger than this gains nothing, since GitHub and JIRA throttle heavy
+# concurrent clients anyway.
+DEFAULT_POOL_SIZE = 10
+MAX_POOL_SIZE = 100
+# the number of requests in flight to each backend is adapted to how well
+# the backend copes with them. it starts at INITIAL_CONCURRENT_REQUESTS,
+# and never exceeds MAX_CONCURRENT_REQUESTS, however many threads the
+# query uses. JIRA is less tolerant of concurrent clients.
+INITIAL_CONCURRENT_REQUESTS = {GITHUB: 8, JIRA: 4}
+MAX_CONCURRENT_REQUESTS = {GITHUB: 50, JIRA: 16}
+# the status codes of responses that show that a backend is overloaded,
+# besides the rate limit responses
+CONGESTION_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+RESPONSES_NAMESPACE = 'responses'
+# the response headers that are kept along with a cached response body
+CACHED_HEADERS = ('ETag', 'Last-Modified', 'Link')
+NOT_MODIFIED = 304
+
+# the number of times a request is sent again after being rejected due to
+# the rate limit. every attempt first waits for the budget to be reset.
+MAX_RATE_LIMIT_RETRIES = 5
+
+# the number of seconds to wait for a connection, or for the next byte of
+# a response, before the request is considered failed
+DEFAULT_REQUEST_TIMEOUT = 30
+# the number of times a request is sent again after it timed out, failed
+# to connect, or was answered with one of RETRIED_STATUS_CODES. all of
+# tattle's requests only read data, so they are safe to send again.
+DEFAULT_MAX_RETRIES = 3
+RETRIED_STATUS_CODES = frozenset([500, 502, 503, 504])
+# retries back off exponentially from BACKOFF_BASE seconds, up to
+# MAX_BACKOFF seconds, and the actual wait is drawn uniformly below that
+BACKOFF_BASE = 1
+MAX_BACKOFF = 30
+
+# the number of threads that send hedged requests. every hedged request
+# holds a thread for each of its attempts.
+HEDGING_THREADS = 2 * sum(MAX_CONCURRENT_REQUESTS.values())
+
+logger = logging.getLogger('model.network')
+
+_sessions = {}
+_pool_size = DEFAULT_POOL_SIZE
+_request_slots = {}
+_response_cache = None
+# caches kept by other modules in the response cache's database, by
+# namespace
+_caches = {}
+_request_timeout = DEFAULT_REQUEST_TIMEOUT
+_max_retries = DEFAULT_MAX_RETRIES
+_scheduler = RateLimitScheduler()
+_latencies = LatencyTracker()
+_hedge_budget = HedgeBudget()
+# set while hedging is enabled
+_hedge_executor = None
+_lock = threading.Lock()
+
+
+class RetriesExhaustedError(Exception):
+    """ Raised when a request still fails after all of its retries.
+    """
+
+
+def determine_pool_size(thread_limit):
+    """Return the connection pool size that matches `thread_limit`.
+
+    :param thread_limit: the maximum number of threads used by tattle
+    :return: the number of keep-alive connections held per backend
+    :rtype: int
+    """
+    if not thread_limit:
+        return DEFAULT_POOL_SIZE
+    return max(1, min(thread_limit, MAX_POOL_SIZE))
+
+
+def configure_sessions(thread_limit):
+    """Size the per-backend connection pools according to `thread_limit`.
+
+    Sessions that were created with a different pool size are closed,
+    and will be recreated on their next use.
+    """
+    global _pool_size
+
+    pool_size = determine_pool_size(thread_limit)
+    with _lock:
+        _configure_request_slots(thread_limit)
+        if pool_size == _pool_size:
+            return
+        _pool_size = pool_size
+        _close_sessions()
+
+
+def determine_concurrency(backend, thread_limit):
+    """Return the highest number of requests that may be sent to
+    `backend` at the same time.
+    """
+    limit = MAX_CONCURRENT_REQUESTS[backend]
+    if not thread_limit:
+        return limit
+    return max(1, min(thread_limit, limit))
+
+
+def _create_request_slots(backend, thread_limit):
+    maximum = determine_concurrency(backend, thread_limit)
+    return AdaptiveLimit(backend,
+                         min(INITIAL_CONCURRENT_REQUESTS[backend], maximum),
+                         maximum)
+
+
+def _configure_request_slots(thread_limit):
+    # the limits learned by earlier queries are kept, so that every query
+    # doesn't have to learn them again
+    for backend in BACKENDS:
+        slots = _request_slots.get(backend)
+        if slots is None:
+            _request_slots[backend] = _create_request_slots(backend,
+                                                            thread_limit)
+        else:
+            slots.set_maximum(determine_concurrency(backend, thread_limit))
+
+
+def configure_retries(request_timeout=DEFAULT_REQUEST_TIMEOUT,
+                      max_retries=DEFAULT_MAX_RETRIES):
+    """Set the timeout of every request, and the number of times failed
+    requests are sent again.
+    """
+    global _request_timeout, _max_retries
+
+    with _lock:
+        _request_timeout = request_timeout
+        _max_retries = max_retries
+
+
+def configure_hedging(enabled):
+    """Enable or disable the hedging of slow GET requests.
+    """
+    global _hedge_executor
+
+    with _lock:
+        if enabled and _hedge_executor is None:
+            _hedge_executor = Executor(HEDGING_THREADS)
+        elif not enabled and _hedge_executor is not None:
+            _hedge_executor.shutdown(wait=False)
+            _hedge_executor = None
+
+
+def backoff_delay(attempt):
+    """Return the number of seconds to wait before the `attempt`th retry.
+    """
+    return random.uniform(0, min(MAX_BACKOFF, BACKOFF_BASE * 2 ** attempt))
+
+
+def get_request_slots(backend):
+    """Return the adaptive limit that caps the concurrency of `backend`.
+    """
+    with _lock:
+        slots = _request_slots.get(backend)
+        if slots is None:
+            slots = _request_slots[backend] = _create_request_slots(backend,
+                                                                    None)
+        return slots
+
+
+def is_congested(response):
+    """Return True if `response` shows that its backend is overloaded.
+    """
+    return (response.status_code in CONGESTION_STATUS_CODES or
+            RateLimitScheduler.is_rate_limited(response))
+
+
+def create_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(backend):
+    """Return the shared keep-alive session of `backend`.
+
+    A single session (and therefore a single connection pool) is shared
+    by all of the threads that talk to the same backend.
+    """
+    with _lock:
+        session = _sessions.get(backend)
+        if session is None:
+            session = create_session(_pool_size)
+            _sessions[backend] = session
+        return session
+
+
+def close_sessions():
+    with _lock:
+        _close_sessions()
+
+
+def _close_sessions():
+    for session in _sessions.values():
+        session.close()
+    _sessions.clear()
+
+
+def backend_for_url(url):
+    hostname = urlparse.urlparse(url).hostname or ''
+    if hostname.endswith(JIRA_HOST_SUFFIX):
+        return JIRA
+    return GITHUB
+
+
+def configure_cache(cache_path, max_entries):
+    """Open the on-disk response cache at `cache_path`.
+
+    If `cache_path` is None, conditional requests are disabled and every
+    GitHub response is downloaded in full.
+    """
+    global _response_cache
+
+    with _lock:
+        if _response_cache is not None:
+            if _response_cache.path == cache_path:
+                _response_cache.max_entries = max_entries
+                return
+            _close_caches()
+        if cache_path is not None:
+            _response_cache = PersistentCache(cache_path,
+                                              RESPONSES_NAMESPACE,
+                                              max_entries=max_entries)
+
+
+def get_cache(namespace, max_entries=None, ttl=None):
+    """Return the cache of `namespace`, stored along with the responses.
+
+    :param max_entries: the size of the cache, if it differs from the size
+                        of the response cache
+    :param ttl: the number of seconds an entry of the cache stays fresh,
+                if entries of the cache go stale
+    :return: the cache, or None if caching is disabled
+    :rtype: PersistentCache
+    """
+    with _lock:
+        if _response_cache is None:
+            return None
+        cache = _caches.get(namespace)
+        if cache is None:
+            cache = _caches[namespace] = PersistentCache(
+                    _response_cache.path,
+                    namespace,
+                    max_entries=max_entries or _response_cache.max_entries,
+                    ttl=ttl)
+        else:
+            cache.ttl = ttl
+        return cache
+
+
+def flush_cache():
+    with _lock:
+        caches = [_response_cache] + _caches.values()
+    for cache in caches:
+        if cache is not None:
+            cache.flush()
+
+
+def close_cache():
+    with _lock:
+        _close_caches()
+
+
+def _close_caches():
+    global _response_cache
+
+    for cache in [_response_cache] + _caches.values():
+        if cache is not None:
+            cache.close()
+    _response_cache = None
+    _caches.clear()
+
+
+def generate_cache_key(url, auth):
+    """Return the response cache key of a request.
+
+    The credentials take part in the key, since different users may be
+    allowed to see different data. They are hashed along with the url,
+    so they never reach the disk.
+    """
+    key = hashlib.sha1(encode(url))
+    for part in auth or ():
+        key.update('\0')
+        key.update(encode(part))
+    return key.hexdigest()
+
+
+def encode(string):
+    if isinstance(string, unicode):
+        return string.encode('utf-8')
+    return string
+
+
+def conditional_headers(entry):
+    headers = {}
+    if entry.get('ETag'):
+        headers['If-None-Match'] = entry['ETag']
+    if entry.get('Last-Modified'):
+        headers['If-Modified-Since'] = entry['Last-Modified']
+    return headers
+
+
+def response_from_cache_entry(url, entry):
+    response = requests.Response()
+    response.status_code = requests.codes.ok
+    response.url = url
+    response.encoding = 'utf-8'
+    response._content = entry['body'].encode('utf-8')
+    for header in CACHED_HEADERS:
+        if entry.get(header):
+            response.headers[header] = entry[header]
+    return response
+
+
+def cache_entry_from_response(response):
+    entry = {'body': response.text}
+    for header in CACHED_HEADERS:
+        entry[header] = response.headers.get(header)
+    return entry
+
+
+def get(url, auth=None, cache=True):
+    """Send a GET request over the pooled session of the url's backend.
+
+    GitHub requests are made conditional when a previous response to the
+    same url is found in the response cache. A `304 Not Modified` answer
+    is then served from the cache, and is not counted by GitHub against
+    the rate limit.
+
+    :param url: the requested url
+    :param auth: the authentication to be used, if any
+    :param cache: whether the response cache is used. responses that are
+                  kept elsewhere need not be cached twice.
+    :return: the response to the request
+    :rtype: requests.Response
+    """
+    backend = backend_for_url(url)
+    response_cache = _response_cache if cache else None
+    if backend != GITHUB or response_cache is None:
+        return send(backend, url, auth=auth)
+
+    key = generate_cache_key(url, auth)
+    entry = response_cache.get(key)
+    headers = conditional_headers(entry) if entry else {}
+    response = send(backend, url, auth=auth, headers=headers)
+
+    if response.status_code == NOT_MODIFIED and entry:
+        metrics.increment('response_cache.hits')
+        return response_from_cache_entry(url, entry)
+
+    metrics.increment('response_cache.misses')
+    if response.status_code == requests.codes.ok and \
+            (response.headers.get('ETag') or
+             response.headers.get('Last-Modified')):
+        response_cache.set(key, cache_entry_from_response(response))
+    return response
+
+
+def rate_limit_key(backend, auth):
+    # GitHub counts the rate limit per user, or per IP address for
+    # anonymous requests
+    return backend, auth[0] if auth else None
+
+
+def post(url, data, auth=None):
+    """Send a POST request over the pooled session of the url's backend.
+
+    POST requests are never cached.
+    """
+    return send(backend_for_url(url), url, auth=auth, data=data)
+
+
+class Attempt(object):
+    """ A single attempt at sending a request.
+
+    An attempt is created once the rate limit and the adaptive concurrency
+    limit of its backend allow another request, and holds a slot of the
+    concurrency limit until it is sent. If the request's `auth` is a
+    CredentialPool, the attempt is sent on the pool's token with the most
+    headroom.
+    """
+
+    def __init__(self, backend, auth):
+        self.backend = backend
+        self.auth = auth
+        if isinstance(auth, CredentialPool):
+            self.credentials = auth.acquire()
+        else:
+            self.credentials = auth
+        self.key = rate_limit_key(backend, self.credentials)
+        _scheduler.wait(self.key)
+        self._slots = get_request_slots(backend)
+        self._ticket = self._slots.acquire()
+        metrics.increment('requests.{0}'.format(backend))
+
+    def send(self, request):
+        """Send the attempt by calling `request(auth=credentials)`, and
+        record the outcome and the rate limit headers of its response.
+
+        :return: the response, and whether it was rejected due to the rate
+                 limit
+        """
+        start = time.time()
+        response = None
+        try:
+            response = request(auth=self.credentials)
+        finally:
+            # requests that failed without a response count as congestion
+            if response is None:
+                self._slots.release(self._ticket, congested=True)
+            else:
+                self._slots.release(self._ticket, time.time() - start,
+                                    is_congested(response))
+        if isinstance(self.auth, CredentialPool):
+            self.auth.update(self.credentials, response)
+        return response, _scheduler.update(self.key, response)
+
+
+def get_with_hedging(attempt, get):
+    """Send `attempt` of the GET request `get`, hedged if hedging is
+    enabled.
+
+    A GET request that is slower than the hedging percentile of the recent
+    requests to its backend is sent a second time, and the response that
+    arrives first is used. Hedges are capped to a small fraction of all
+    of the requests. A hedge is an attempt of its own: it waits for the
+    rate limit and the concurrency limit like any other attempt, and its
+    rate limit headers are recorded whether or not it wins.
+
+    :return: the response, and whether it was rejected due to the rate
+             limit
+    """
+    backend = attempt.backend
+    hedge_executor = _hedge_executor
+    _hedge_budget.record_request()
+    threshold = None
+    if hedge_executor is not None:
+        threshold = _latencies.threshold(backend)
+
+    def send_attempt(attempt):
+        start = time.time()
+        result = attempt.send(get)
+        _latencies.record(backend, time.time() - start)
+        return result
+
+    if threshold is None:
+        return send_attempt(attempt)
+    return hedging.hedged_call(
+            partial(send_attempt, attempt), threshold, _hedge_budget,
+            hedge_executor,
+            hedge=lambda: send_attempt(Attempt(backend, attempt.auth)))
+
+
+def send(backend, url, auth=None, headers=None, data=None):
+    """Send a request, paced by the rate limit of its backend.
+
+    The request is a POST request if `data` is given, and a GET request
+    otherwise.
+
+    Requests that are rejected due to the rate limit are sent again once
+    the rate limit allows it, instead of being reported as failures. If
+    `auth` is a CredentialPool, every attempt is sent on the pool's token
+    with the most headroom.
+
+    Requests that time out, fail to connect or are answered with a server
+    error are sent again after an exponential, jittered backoff. Slow GET
+    requests are hedged if hedging is enabled.
+    No more than the backend's adaptive concurrency limit of requests are
+    in flight at the same time, and the outcome of every request adapts
+    that limit.
+
+    :raises RetriesExhaustedError: if the request still fails after all
+                                   of its retries
+    """
+    session = get_session(backend)
+    rate_limited = 0
+    failures = 0
+    while True:
+        # every attempt picks its own token out of a credential pool, so a
+        # request that was rate limited is sent again on another token
+        attempt = Attempt(backend, auth)
+        response = None
+        try:
+            if data is None:
+                response, rejected = get_with_hedging(
+                        attempt,
+                        partial(session.get, url, headers=headers or {},
+                                timeout=_request_timeout))
+            else:
+                response, rejected = attempt.send(
+                        partial(session.post, url, headers=headers or {},
+                                data=data, timeout=_request_timeout))
+        except (requests.exceptions.Timeout,
+                requests.exceptions.ConnectionError) as e:
+            failure = e
+        if response is not None:
+            if rejected:
+                rate_limited += 1
+                if rate_limited > MAX_RATE_LIMIT_RETRIES:
+                    raise RetriesExhaustedError(
+                            'giving up on {0} after being rate limited {1} '
+                            'times'.format(url, rate_limited))
+                continue
+            if response.status_code not in RETRIED_STATUS_CODES:
+                return response
+            failure = 'status code {0}'.format(response.status_code)
+
+        failures += 1
+        metrics.increment('retries.{0}'.format(backend))
+        if failures > _max_retries:
+            raise RetriesExhaustedError(
+                    'giving up on {0} after {1} failed attempts, the last '
+                    'of which failed with: {2}'.format(url, failures,
+                                                       failure))
+        logger.debug('retrying {0} after it failed with: {1}'
+                     .format(url, failure))
+        time.sleep(backoff_delay(failures))
@@ -0,0 +1,200 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import sys
+from collections import deque
+from Queue import Queue
+
+from tattle.executor import Executor
+
+# the maximum number of items waiting in front of a stage. once a stage's
+# queue is full, the stages before it stop producing more items.
+DEFAULT_QUEUE_SIZE = 1000
+
+
+def split_into_batches(items, batch_size, weigh):
+    """Split `items` into the batches that a stage with a `batch_size`
+    forms, if all of the items reach it before it starts any of them.
+    """
+    batch = []
+    batch_weight = 0
+    for item in items:
+        weight = weigh(item)
+        if batch and batch_weight + weight > batch_size:
+            yield batch
+            batch = []
+            batch_weight = 0
+        batch.append(item)
+        batch_weight += weight
+    if batch:
+        yield batch
+
+
+class Stage(object):
+    """ A single step of a Pipeline.
+
+    `function` is applied to every item that reaches the stage, and
+    returns an iterable of the items that are passed on to the next stage.
+    Up to `num_of_threads` items are processed by the stage concurrently.
+
+    A stage with a `batch_size` is applied to lists of items instead. The
+    items are held back until the sum of their weights, as given by
+    `weigh`, reaches `batch_size`, or until no more items can reach the
+    stage. A batch is never heavier than `batch_size`, unless it consists
+    of a single item.
+    """
+
+    def __init__(self, name, function, num_of_threads,
+                 queue_size=DEFAULT_QUEUE_SIZE, batch_size=None,
+                 weigh=None):
+        self.name = name
+        self.function = function
+        self.num_of_threads = max(1, num_of_threads)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.weigh = weigh or (lambda item: 1)
+        self.queue = deque()
+        self.weights = deque()
+        self.queued_weight = 0
+        self.in_flight = 0
+
+    def is_idle(self):
+        return not self.queue and not self.in_flight
+
+    def is_full(self):
+        return len(self.queue) >= self.queue_size
+
+    def can_start(self, flush=False):
+        """Return True if a task can be started.
+
+        :param flush: whether the items of a batched stage are to be
+                      processed even if they don't fill a batch
+        """
+        if not self.queue or self.in_flight >= self.num_of_threads:
+            return False
+        return (self.batch_size is None or flush or self.is_full() or
+                self.queued_weight >= self.batch_size)
+
+    def put(self, items):
+        for item in items:
+            self.queue.append(item)
+            if self.batch_size is not None:
+                weight = self.weigh(item)
+                self.weights.append(weight)
+                self.queued_weight += weight
+
+    def take(self):
+        """Remove the item of the next task from the queue, or the batch of
+        items of a batched stage.
+        """
+        if self.batch_size is None:
+            return self.queue.popleft()
+        batch = []
+        batch_weight = 0
+        while self.queue and (not batch or batch_weight + self.weights[0] <=
+                              self.batch_size):
+            batch.append(self.queue.popleft())
+            batch_weight += self.weights.popleft()
+        self.queued_weight -= batch_weight
+        return batch
+
+
+class Pipeline(object):
+    """ Streams items through a sequence of stages.
+
+    Items flow into a stage as soon as the previous stage produces them,
+    rather than after the previous stage finished processing all of its
+    items. The queues between the stages are bounded, so a slow stage
+    holds back the stages before it instead of piling up items in memory.
+
+    All of the stages are scheduled by the thread that iterates over `run`,
+    so the worker threads never block on one another.
+
+    The stages' tasks run on `executor`, which is shared with the rest of
+    the query. If no executor is given, the pipeline uses one of its own,
+    with enough threads for all of its stages.
+    """
+
+    def __init__(self, stages, executor=None):
+        self.stages = stages
+        self.executor = executor
+        self._completions = Queue()
+
+    def run(self, items):
+        """Feed `items` to the first stage, and yield the outputs of the
+        last stage in the order they are produced.
+        """
+        source = iter(items)
+        source_exhausted = False
+        executor = self.executor
+        if executor is None:
+            executor = Executor(sum(stage.num_of_threads
+                                    for stage in self.stages))
+
+        try:
+            while True:
+                first_stage = self.stages[0]
+                while not source_exhausted and not first_stage.is_full():
+                    try:
+                        first_stage.put([next(source)])
+                    except StopIteration:
+                        source_exhausted = True
+
+                self._start_tasks(executor, source_exhausted)
+                if source_exhausted and \
+                        all(stage.is_idle() for stage in self.stages):
+                    return
+
+                index, outputs = self._wait_for_task()
+                if index + 1 < len(self.stages):
+                    self.stages[index + 1].put(outputs)
+                else:
+                    for output in outputs:
+                        yield output
+        finally:
+            if self.executor is None:
+                executor.shutdown(wait=False)
+
+    def _start_tasks(self, executor, source_exhausted):
+        # later stages are served first, so items that are already deep in
+        # the pipeline make their way out of it before new items enter it
+        for index in reversed(range(len(self.stages))):
+            stage = self.stages[index]
+            next_stage = (self.stages[index + 1]
+                          if index + 1 < len(self.stages) else None)
+            # once the stages before a stage are done, its last items are
+            # not held back for a full batch
+            flush = source_exhausted and \
+                all(previous_stage.is_idle()
+                    for previous_stage in self.stages[:index])
+            while stage.can_start(flush) and \
+                    (next_stage is None or not next_stage.is_full()):
+                item = stage.take()
+                stage.in_flight += 1
+                executor.apply_async(self._run_task, (index, item))
+
+    def _run_task(self, index, item):
+        try:
+            outputs = list(self.stages[index].function(item))
+            self._completions.put((index, outputs, None))
+        except Exception:
+            self._completions.put((index, None, sys.exc_info()))
+
+    def _wait_for_task(self):
+        index, outputs, exc_info = self._completions.get()
+        self.stages[index].in_flight -= 1
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return index, outputs
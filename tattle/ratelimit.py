@@ -0,0 +1,148 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import threading
+import time
+
+from tattle import metrics
+
+RATE_LIMIT_LIMIT = 'X-RateLimit-Limit'
+RATE_LIMIT_REMAINING = 'X-RateLimit-Remaining'
+RATE_LIMIT_RESET = 'X-RateLimit-Reset'
+RETRY_AFTER = 'Retry-After'
+
+FORBIDDEN = 403
+TOO_MANY_REQUESTS = 429
+
+# requests are not paced while more than this fraction of the budget
+# remains. below it, the remaining requests are spread evenly until the
+# budget is reset.
+PACING_THRESHOLD = 0.1
+# used when a rate limited response carries no hint on when to retry
+DEFAULT_RETRY_AFTER = 60
+# GitHub's secondary (abuse) rate limits don't always come with a
+# Retry-After header, but are always explained by the response's message
+SECONDARY_RATE_LIMIT_MESSAGE = 'secondary rate limit'
+
+
+class RateLimitState(object):
+    """ The rate limit budget of a single backend & credentials pair.
+    """
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.blocked_until = 0
+        self.next_slot = 0
+
+
+class RateLimitScheduler(object):
+    """ Paces requests according to the rate limit headers of the responses.
+
+    The scheduler is shared by all of the threads that send requests, so
+    the pace it imposes applies to every thread pool at once.
+    Every request has to call `wait` before it is sent, and `update` once
+    its response arrives.
+    """
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def _state(self, key):
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = RateLimitState()
+        return state
+
+    def remaining(self, key):
+        with self._lock:
+            return self._state(key).remaining
+
+    def delay(self, key):
+        """Reserve a time slot for a request and return how long to wait.
+        """
+        with self._lock:
+            state = self._state(key)
+            now = time.time()
+            budget_is_known = (state.remaining is not None and
+                               state.reset is not None and
+                               state.reset > now)
+            if budget_is_known and state.remaining <= 0:
+                # once the budget is gone, requests wait for its reset
+                state.blocked_until = max(state.blocked_until, state.reset)
+
+            start = max(now, state.blocked_until, state.next_slot)
+            if budget_is_known and start < state.reset:
+                state.next_slot = start + self._interval(state, start)
+                # responses report the actual budget; until they arrive,
+                # every reserved slot is assumed to consume a request
+                state.remaining = max(state.remaining - 1, 0)
+            return start - now
+
+    @staticmethod
+    def _interval(state, now):
+        if state.limit and state.remaining > state.limit * PACING_THRESHOLD:
+            return 0
+        return (state.reset - now) / float(max(state.remaining, 1))
+
+    def wait(self, key):
+        delay = self.delay(key)
+        if delay > 0:
+            metrics.increment('rate_limit.waits')
+            metrics.increment('rate_limit.wait_seconds', delay)
+            time.sleep(delay)
+
+    def update(self, key, response):
+        """Record the rate limit headers of `response`.
+
+        :return: True if the request was rejected due to the rate limit,
+                 in which case it should be sent again.
+        :rtype: bool
+        """
+        headers = response.headers
+        with self._lock:
+            state = self._state(key)
+            if headers.get(RATE_LIMIT_REMAINING) is not None:
+                state.remaining = int(headers[RATE_LIMIT_REMAINING])
+            if headers.get(RATE_LIMIT_LIMIT) is not None:
+                state.limit = int(headers[RATE_LIMIT_LIMIT])
+            if headers.get(RATE_LIMIT_RESET) is not None:
+                state.reset = float(headers[RATE_LIMIT_RESET])
+
+            if not self.is_rate_limited(response):
+                return False
+
+            now = time.time()
+            if headers.get(RETRY_AFTER) is not None:
+                blocked_until = now + float(headers[RETRY_AFTER])
+            elif state.remaining == 0 and state.reset:
+                blocked_until = state.reset
+            else:
+                blocked_until = now + DEFAULT_RETRY_AFTER
+            state.blocked_until = max(state.blocked_until, blocked_until)
+            metrics.increment('rate_limit.rejected_requests')
+            return True
+
+    @staticmethod
+    def is_rate_limited(response):
+        if response.status_code == TOO_MANY_REQUESTS:
+            return True
+        if response.status_code != FORBIDDEN:
+            return False
+        return (response.headers.get(RETRY_AFTER) is not None or
+                response.headers.get(RATE_LIMIT_REMAINING) == '0' or
+                SECONDARY_RATE_LIMIT_MESSAGE in response.text.lower())
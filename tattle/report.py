@@ -0,0 +1,151 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import gzip
+import json
+import os
+
+JSON_FORMAT = 'json'
+NDJSON_FORMAT = 'ndjson'
+OUTPUT_FORMATS = (JSON_FORMAT, NDJSON_FORMAT)
+
+GZIP_SUFFIX = '.gz'
+# the report is written under this suffix until it is complete, and is
+# then renamed to its final path
+PARTIAL_SUFFIX = '.partial'
+# a compressed stream is flushed every this many items, since every flush
+# costs some of the compression
+COMPRESSED_FLUSH_INTERVAL = 100
+
+
+def serialize(item):
+    return json.dumps(item, default=lambda x: x.to_dict())
+
+
+class ReportWriter(object):
+    """ Writes the items of a query's report to `path`.
+
+    The report is written to `<path>.partial` while the query is running,
+    and is atomically renamed to `path` once it is complete, so `path`
+    never holds a partial report. Reports whose path ends with `.gz` are
+    gzip compressed.
+
+    Writers are used as context managers: the report is completed when
+    the context exits normally, and discarded if it exits due to an error.
+    """
+    # whether items should be written as soon as they are produced, rather
+    # than once the query is complete
+    STREAMING = False
+
+    def __init__(self, path):
+        self.path = path
+        self.partial_path = path + PARTIAL_SUFFIX
+        self.compressed = path.endswith(GZIP_SUFFIX)
+        self.num_of_items = 0
+        self._file = None
+        self._stream = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self):
+        output_dir = os.path.dirname(self.path)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        self._file = open(self.partial_path, 'wb')
+        if self.compressed:
+            self._stream = gzip.GzipFile(filename=os.path.basename(self.path),
+                                         mode='wb',
+                                         fileobj=self._file)
+        else:
+            self._stream = self._file
+        self.write_header()
+
+    def write(self, item):
+        self.write_item(serialize(item))
+        self.num_of_items += 1
+        if not self.compressed or \
+                self.num_of_items % COMPRESSED_FLUSH_INTERVAL == 0:
+            self._stream.flush()
+
+    def close(self):
+        self.write_footer()
+        if self.compressed:
+            self._stream.close()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.rename(self.partial_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self.partial_path)
+
+    def write_header(self):
+        pass
+
+    def write_item(self, serialized_item):
+        raise NotImplementedError()
+
+    def write_footer(self):
+        pass
+
+    @staticmethod
+    def get_writer_class(output_format):
+        writers_dict = {JSON_FORMAT: JsonReportWriter,
+                        NDJSON_FORMAT: NdjsonReportWriter}
+        return writers_dict[output_format]
+
+    @classmethod
+    def from_format(cls, path, output_format):
+        return cls.get_writer_class(output_format)(path)
+
+
+class JsonReportWriter(ReportWriter):
+    """ Writes the report as a single json list.
+
+    The list is written once the query is complete, so it is sorted.
+    """
+
+    def write_header(self):
+        self._stream.write('[')
+
+    def write_item(self, serialized_item):
+        if self.num_of_items:
+            self._stream.write(', ')
+        self._stream.write(serialized_item)
+
+    def write_footer(self):
+        self._stream.write(']\n')
+
+
+class NdjsonReportWriter(ReportWriter):
+    """ Writes the report as newline delimited json, one item per line.
+
+    Items are written as soon as the query produces them, so the partial
+    report can be followed while the query is running.
+    """
+    STREAMING = True
+
+    def write_item(self, serialized_item):
+        self._stream.write(serialized_item)
+        self._stream.write('\n')
@@ -0,0 +1,121 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import sys
+import threading
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """ Coalesces concurrent calls that share a key.
+
+    The first caller of `do` with a given key runs the function, and the
+    callers that arrive while it is running wait for its result instead of
+    running the function again. If `memoize` is set, the result of `do` is
+    also returned to all of the later callers with the same key, unless it
+    is None, which is what a failed lookup usually returns.
+    """
+
+    def __init__(self, memoize=False):
+        self.memoize = memoize
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        """Return `function(*args, **kwargs)`, or the result of the call
+        that is already running (or was run) for `key`.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+        else:
+            succeeded = False
+            try:
+                call.result = function(*args, **kwargs)
+                succeeded = True
+            except Exception:
+                call.exc_info = sys.exc_info()
+            finally:
+                # failures are never memoized, so that they can be retried
+                if not self.memoize or not succeeded or call.result is None:
+                    with self._lock:
+                        del self._calls[key]
+                call.done.set()
+
+        if call.exc_info is not None:
+            raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+        return call.result
+
+    def do_many(self, keys, function):
+        """Return a dict of the results of `keys`.
+
+        `function` is called once, with the keys that no other call is
+        running (or ran) for, and returns a dict of their results. The
+        results of the rest of the keys are waited for. Like `do`, keys
+        whose result is missing (or None) are not memoized.
+        """
+        own_keys = []
+        calls = {}
+        with self._lock:
+            for key in set(keys):
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = _Call()
+                    own_keys.append(key)
+                else:
+                    self.coalesced += 1
+                calls[key] = call
+
+        if own_keys:
+            succeeded = False
+            exc_info = None
+            try:
+                results = function(own_keys)
+                for key in own_keys:
+                    calls[key].result = results.get(key)
+                succeeded = True
+            except Exception:
+                exc_info = sys.exc_info()
+            finally:
+                with self._lock:
+                    for key in own_keys:
+                        calls[key].exc_info = exc_info
+                        if (not self.memoize or not succeeded or
+                                calls[key].result is None):
+                            del self._calls[key]
+                for key in own_keys:
+                    calls[key].done.set()
+
+        results = {}
+        for key, call in calls.items():
+            call.done.wait()
+            if call.exc_info is not None:
+                raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+            results[key] = call.result
+        return results
@@ -0,0 +1,111 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from tattle.cache import PersistentCache
+
+
+class PersistentCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.cache_dir, 'cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_get_and_set(self):
+        cache = PersistentCache(self.path, 'ns')
+        self.assertIsNone(cache.get('key'))
+        cache.set('key', {'etag': 'W/"1"'})
+        self.assertEqual(cache.get('key'), {'etag': 'W/"1"'})
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(len(cache), 1)
+
+    def test_persistence(self):
+        cache = PersistentCache(self.path, 'ns')
+        cache.set('key', 'value')
+        cache.close()
+
+        cache = PersistentCache(self.path, 'ns')
+        self.assertEqual(cache.get('key'), 'value')
+        self.assertEqual(len(cache), 1)
+
+    def test_namespaces_are_separate(self):
+        cache = PersistentCache(self.path, 'ns')
+        other_cache = PersistentCache(self.path, 'other_ns')
+        cache.set('key', 'value')
+        cache.flush()
+        self.assertIsNone(other_cache.get('key'))
+        self.assertEqual(len(other_cache), 0)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = PersistentCache(self.path, 'ns', max_entries=2)
+        cache.set('first', 1)
+        cache.set('second', 2)
+        cache.get('first')
+        cache.set('third', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('second'))
+        self.assertEqual(cache.get('first'), 1)
+        self.assertEqual(cache.get('third'), 3)
+
+    def test_overwrite_does_not_grow_the_cache(self):
+        cache = PersistentCache(self.path, 'ns', max_entries=1)
+        cache.set('key', 1)
+        cache.set('key', 2)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get('key'), 2)
+
+    def test_delete(self):
+        cache = PersistentCache(self.path, 'ns')
+        cache.set('key', 1)
+        cache.delete('key')
+        cache.delete('key')
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(len(cache), 0)
+
+    @mock.patch('tattle.cache.time.time')
+    def test_stale_entries_are_missing(self, mock_time):
+        mock_time.return_value = 1000.0
+        cache = PersistentCache(self.path, 'ns', ttl=60)
+        cache.set('key', 'value')
+        mock_time.return_value = 1060.0
+        self.assertEqual(cache.get('key'), 'value')
+        mock_time.return_value = 1061.0
+        self.assertIsNone(cache.get('key'))
+        # storing the entry again makes it fresh
+        cache.set('key', 'new value')
+        self.assertEqual(cache.get('key'), 'new value')
+
+    def test_caches_share_the_database_of_their_file(self):
+        first = PersistentCache(self.path, 'first')
+        second = PersistentCache(self.path, 'second')
+        # neither cache waits for the other's uncommitted writes
+        first.set('key', 1)
+        second.set('key', 2)
+        first.close()
+        self.assertEqual(second.get('key'), 2)
+        second.close()
+
+        reopened = PersistentCache(self.path, 'first')
+        self.assertEqual(reopened.get('key'), 1)
+        reopened.close()
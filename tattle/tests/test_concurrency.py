@@ -0,0 +1,90 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import threading
+import time
+import unittest
+
+from tattle import concurrency
+from tattle import metrics
+from tattle.concurrency import AdaptiveLimit
+
+
+class AdaptiveLimitTestCase(unittest.TestCase):
+    def send(self, limit, count, latency=1.0, congested=False):
+        for _ in range(count):
+            limit.release(limit.acquire(), latency, congested)
+
+    def test_limit_grows_while_requests_succeed(self):
+        limit = AdaptiveLimit('test', 2, 4)
+        self.send(limit, 2)
+        self.assertEqual(limit.limit, 3)
+        self.send(limit, 3)
+        self.assertEqual(limit.limit, 4)
+        self.send(limit, 100)
+        self.assertEqual(limit.limit, 4)
+        self.assertEqual(metrics.get_value('concurrency.test'), 4)
+        self.assertEqual(metrics.get_value('concurrency.test.peak'), 4)
+
+    def test_limit_is_halved_on_congestion(self):
+        limit = AdaptiveLimit('test', 8, 10)
+        decreases = metrics.get_value('concurrency.test.decreases')
+        self.send(limit, 1, congested=True)
+        self.assertEqual(limit.limit, 4)
+        self.send(limit, 5, congested=True)
+        self.assertEqual(limit.limit, 1)
+        self.assertEqual(
+                metrics.get_value('concurrency.test.decreases') - decreases,
+                3)
+
+    def test_requests_sent_before_a_decrease_do_not_decrease_again(self):
+        limit = AdaptiveLimit('test', 8, 10)
+        tickets = [limit.acquire() for _ in range(4)]
+        for ticket in tickets:
+            limit.release(ticket, congested=True)
+        self.assertEqual(limit.limit, 4)
+
+    def test_rising_latency_is_congestion(self):
+        limit = AdaptiveLimit('test', 30, 30)
+        self.send(limit, concurrency.MIN_LATENCY_SAMPLES, latency=1.0)
+        self.assertEqual(limit.limit, 30)
+        self.send(limit, 1, latency=10.0)
+        self.assertEqual(limit.limit, 15)
+
+    def test_jitter_of_fast_responses_is_not_congestion(self):
+        limit = AdaptiveLimit('test', 30, 30)
+        self.send(limit, concurrency.MIN_LATENCY_SAMPLES, latency=0.001)
+        self.send(limit, 5, latency=0.01)
+        self.assertEqual(limit.limit, 30)
+
+    def test_acquire_waits_for_the_limit(self):
+        limit = AdaptiveLimit('test', 1, 1)
+        ticket = limit.acquire()
+        acquired = threading.Event()
+        thread = threading.Thread(
+                target=lambda: (limit.acquire(), acquired.set()))
+        thread.start()
+        time.sleep(0.05)
+        self.assertFalse(acquired.is_set())
+        limit.release(ticket)
+        thread.join()
+        self.assertTrue(acquired.is_set())
+
+    def test_set_maximum(self):
+        limit = AdaptiveLimit('test', 8, 10)
+        limit.set_maximum(2)
+        self.assertEqual(limit.limit, 2)
+        limit.set_maximum(10)
+        self.assertEqual(limit.limit, 2)
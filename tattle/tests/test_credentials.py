@@ -0,0 +1,110 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import unittest
+
+import mock
+import requests
+
+from tattle import credentials
+from tattle import network
+from tattle import ratelimit
+from tattle.credentials import CredentialPool
+from tattle.credentials import TOKEN_PASSWORD
+from tattle.model import QueryConfig
+
+NOW = 1000.0
+
+
+def create_response(status_code=200, remaining=None, reset=NOW + 100,
+                    retry_after=None):
+    response = requests.Response()
+    response.status_code = status_code
+    if remaining is not None:
+        response.headers[ratelimit.RATE_LIMIT_REMAINING] = str(remaining)
+        response.headers[ratelimit.RATE_LIMIT_RESET] = str(reset)
+    if retry_after is not None:
+        response.headers[ratelimit.RETRY_AFTER] = str(retry_after)
+    return response
+
+
+@mock.patch('tattle.credentials.time.time', return_value=NOW)
+class CredentialPoolTestCase(unittest.TestCase):
+    def test_unknown_tokens_are_tried_first(self, *_):
+        pool = CredentialPool(['a', 'b'])
+        pool.update(pool.acquire(), create_response(remaining=10))
+        self.assertEqual(pool.acquire(), ('b', TOKEN_PASSWORD))
+
+    def test_token_with_most_headroom_is_used(self, *_):
+        pool = CredentialPool(['a', 'b', 'c'])
+        for token, remaining in [('a', 10), ('b', 30), ('c', 20)]:
+            pool.update((token, TOKEN_PASSWORD),
+                        create_response(remaining=remaining))
+        tokens = [pool.acquire()[0] for _ in range(33)]
+        # requests go to the fullest budget until the budgets are even
+        self.assertEqual(tokens[:10], ['b'] * 10)
+        self.assertEqual(sorted(tokens[10:30]), ['b'] * 10 + ['c'] * 10)
+        self.assertEqual(sorted(tokens[30:]), ['a', 'b', 'c'])
+
+    def test_exhausted_tokens_sit_out_until_reset(self, mock_time):
+        pool = CredentialPool(['a', 'b'])
+        pool.update(('a', TOKEN_PASSWORD),
+                    create_response(403, remaining=0, reset=NOW + 100))
+        pool.update(('b', TOKEN_PASSWORD),
+                    create_response(remaining=2, reset=NOW + 200))
+        self.assertEqual(pool.acquire()[0], 'b')
+        self.assertEqual(pool.acquire()[0], 'b')
+        pool.update(('b', TOKEN_PASSWORD),
+                    create_response(429, retry_after=200))
+        # once all of the tokens are exhausted, the token that is reset
+        # first is used
+        self.assertEqual(pool.acquire()[0], 'a')
+        mock_time.return_value = NOW + 101
+        pool.update(('a', TOKEN_PASSWORD),
+                    create_response(remaining=5000, reset=NOW + 3700))
+        self.assertEqual(pool.acquire()[0], 'a')
+
+    def test_get_credential_pool(self, *_):
+        pool = credentials.get_credential_pool(['a', 'b'])
+        self.assertIs(credentials.get_credential_pool(['a', 'b']), pool)
+        self.assertEqual(list(pool), ['a', 'b'])
+
+    @mock.patch.dict('os.environ', {'GITHUB_TOKENS': 'a, b',
+                                    'GITHUB_USER': 'u',
+                                    'GITHUB_PASS': 'p'})
+    def test_github_credentials(self, *_):
+        self.assertIs(QueryConfig.github_credentials(),
+                      credentials.get_credential_pool(['a', 'b']))
+
+
+class SendWithPoolTestCase(unittest.TestCase):
+    @mock.patch('tattle.network._scheduler')
+    @mock.patch('tattle.network.get_session')
+    def test_rate_limited_requests_move_to_another_token(self,
+                                                         mock_get_session,
+                                                         mock_scheduler):
+        pool = CredentialPool(['a', 'b'])
+        mock_get = mock_get_session.return_value.get
+        mock_get.side_effect = [
+            create_response(403, remaining=0, reset=2 ** 40),
+            create_response(remaining=100)]
+        mock_scheduler.update.side_effect = [True, False]
+
+        network.send(network.GITHUB, 'url', auth=pool)
+        self.assertEqual([call[1]['auth'] for call in mock_get.call_args_list],
+                         [('a', TOKEN_PASSWORD), ('b', TOKEN_PASSWORD)])
+        self.assertEqual(
+                [call[0][0] for call in mock_scheduler.wait.call_args_list],
+                [(network.GITHUB, 'a'), (network.GITHUB, 'b')])
@@ -0,0 +1,134 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import json
+import threading
+import time
+import unittest
+
+import mock
+import requests
+
+from tattle import metrics
+from tattle.daemon import QueryServer
+from tattle.daemon import QueryService
+from tattle.model import Branch
+from tattle.model import Organization
+from tattle.model import Repo
+
+
+def create_listing():
+    repo = Repo('cloudify-manager', Organization('cloudify-cosmo'))
+    return [[Branch(name, repo, sha=name)
+             for name in ['master', 'CFY-1-a', 'CFY-2-b']]]
+
+
+def create_config(*regular_expressions):
+    return {'query_config': {'data_type': 'branch',
+                             'github_org': 'cloudify-cosmo'},
+            'filters': [{'type': 'name',
+                         'precedence': 1,
+                         'regular_expressions': list(regular_expressions)}]}
+
+
+@mock.patch('tattle.model.Branch.get_committer_email',
+            lambda branch, **_: branch.name + '@b.com')
+@mock.patch('tattle.model.BranchQuery.list_org_branches')
+class QueryServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.service = QueryService(4, cache_path=None)
+        self.service.start()
+        self.addCleanup(self.service.stop)
+
+    def run_query(self, *regular_expressions):
+        query = self.service.create_query(create_config(*regular_expressions))
+        return self.service.run_query(query)
+
+    def test_queries_share_a_listing(self, mock_list_org_branches):
+        mock_list_org_branches.return_value = create_listing()
+
+        result = self.run_query('CFY')
+        self.assertEqual([branch.name for branch in result],
+                         ['CFY-1-a', 'CFY-2-b'])
+        self.assertEqual(result[0].committer_email, 'CFY-1-a@b.com')
+        result = self.run_query('master')
+        self.assertEqual([branch.name for branch in result], ['master'])
+        self.assertEqual(mock_list_org_branches.call_count, 1)
+        # the listing itself is never modified by the queries
+        listing = mock_list_org_branches.return_value
+        self.assertIsNone(listing[0][0].committer_email)
+
+    def test_missing_emails_are_fetched_again(self, mock_list_org_branches):
+        mock_list_org_branches.return_value = create_listing()
+        with mock.patch('tattle.model.Branch.get_committer_email',
+                        return_value=None):
+            result = self.run_query('CFY-1')
+        self.assertIsNone(result[0].committer_email)
+        result = self.run_query('CFY-1')
+        self.assertEqual(result[0].committer_email, 'CFY-1-a@b.com')
+
+    def test_stale_listing_is_refreshed(self, mock_list_org_branches):
+        mock_list_org_branches.return_value = create_listing()
+        self.service.listing_ttl = 0
+        self.run_query('CFY')
+        time.sleep(0.01)
+        self.run_query('CFY')
+        self.assertEqual(mock_list_org_branches.call_count, 2)
+
+    def test_concurrent_refreshes_are_coalesced(self,
+                                                mock_list_org_branches):
+        def list_org_branches():
+            time.sleep(0.1)
+            return create_listing()
+
+        mock_list_org_branches.side_effect = list_org_branches
+        results = []
+        threads = [threading.Thread(
+                target=lambda: results.append(self.run_query('CFY')))
+                for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 5)
+        self.assertEqual(mock_list_org_branches.call_count, 1)
+
+    def test_server(self, mock_list_org_branches):
+        mock_list_org_branches.return_value = create_listing()
+        server = QueryServer(self.service, ('127.0.0.1', 0))
+        self.addCleanup(server.server_close)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+        queries = metrics.get_value('daemon.queries')
+
+        response = requests.post(url + '/query',
+                                 data=json.dumps(create_config('CFY-1')))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(),
+                         [{'name': 'CFY-1-a',
+                           'repo': {'name': 'cloudify-manager',
+                                    'organization': {
+                                        'name': 'cloudify-cosmo'}},
+                           'jira_issue': None,
+                           'committer_email': 'CFY-1-a@b.com',
+                           'sha': 'CFY-1-a'}])
+
+        response = requests.post(url + '/query', data='{"filters": []}')
+        self.assertEqual(response.status_code, 400)
+        response = requests.get(url + '/metrics')
+        self.assertEqual(response.json()['daemon.queries'], queries + 1)
@@ -13,13 +13,17 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+import os
+import shutil
 import sys
+import tempfile
 import unittest
 
 import mock
 
 from tattle import engine
 from tattle.engine import enforce_github_env_variables
+from tattle.engine import get_queries_from_yaml
 from tattle.engine import parse_arguments
 
 
@@ -53,3 +57,73 @@ class ParseArgumentsTestCase(unittest.TestCase):
         args = parse_arguments()
         self.assertEqual(args.config_path, '/dir/config.yaml',
                          msg='parsed the wrong config file path.')
+
+
+class GetQueriesFromYamlTestCase(unittest.TestCase):
+    def write_config(self, contents):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        config_path = os.path.join(tmp_dir, 'config.yaml')
+        with open(config_path, 'w') as config_file:
+            config_file.write(contents)
+        return config_path
+
+    def test_single_query(self):
+        queries = get_queries_from_yaml(self.write_config(
+                'query_config:\n'
+                '  data_type: branch\n'
+                'filters:\n'
+                '  - type: name\n'
+                '    precedence: 1\n'
+                '    regular_expressions: [CFY]\n'))
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(queries[0].filters), 1)
+
+    def test_multiple_queries(self):
+        queries = get_queries_from_yaml(self.write_config(
+                'query_config:\n'
+                '  data_type: branch\n'
+                '  github_org: cloudify-cosmo\n'
+                'queries:\n'
+                '  - query_config:\n'
+                '      output_path: /tmp/a.json\n'
+                '    filters:\n'
+                '      - type: name\n'
+                '        precedence: 1\n'
+                '        regular_expressions: [CFY]\n'
+                '  - query_config:\n'
+                '      output_path: /tmp/b.json\n'
+                '    filters: []\n'))
+        self.assertEqual([query.config.output_path for query in queries],
+                         ['/tmp/a.json', '/tmp/b.json'])
+        self.assertEqual([query.config.github_org.name for query in queries],
+                         ['cloudify-cosmo'] * 2)
+        self.assertEqual([len(query.filters) for query in queries], [1, 0])
+
+
+class MainTestCase(unittest.TestCase):
+    CONFIG_PATH = '/dir/config.yaml'
+
+    def run_main(self, *args):
+        queries = [mock.Mock(), mock.Mock()]
+        for query in queries:
+            query.explain.return_value = 'plan'
+        argv = ['name', '--config-path=' + self.CONFIG_PATH] + list(args)
+        with mock.patch.object(sys, 'argv', new=argv), \
+                mock.patch('tattle.engine.get_queries_from_yaml',
+                           return_value=queries), \
+                mock.patch('tattle.engine.enforce_github_env_variables'), \
+                mock.patch('tattle.engine.print_performance'), \
+                mock.patch('tattle.engine.print_metrics'):
+            engine.main()
+        return queries
+
+    def test_explain_every_query(self):
+        for query in self.run_main('--explain'):
+            query.explain.assert_called_once_with()
+            self.assertFalse(query.run.called)
+
+    def test_refresh_the_index_of_every_query(self):
+        for query in self.run_main('--refresh-index'):
+            query.refresh_index.assert_called_once_with()
+            self.assertFalse(query.run.called)
@@ -0,0 +1,115 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import threading
+import time
+import unittest
+
+from tattle import executor
+from tattle.executor import DEFAULT_THREAD_LIMIT
+from tattle.executor import Executor
+
+
+class ExecutorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.executor = Executor(4)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_map(self):
+        self.assertEqual(self.executor.map(lambda n: n * 2, range(10)),
+                         [n * 2 for n in range(10)])
+        self.assertEqual(self.executor.map(lambda n: n, []), [])
+
+    def test_threads_are_bounded(self):
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+
+        def task(_):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+        self.executor.map(task, range(20))
+        self.assertLessEqual(peak[0], 4)
+
+    def test_nested_map_runs_in_worker(self):
+        single = Executor(1)
+        self.addCleanup(single.shutdown)
+
+        def outer(n):
+            self.assertTrue(single.in_worker())
+            return sum(single.map(lambda m: m, range(n)))
+
+        self.assertFalse(single.in_worker())
+        self.assertEqual(single.map(outer, [3, 4]), [3, 6])
+
+    def test_apply_async(self):
+        result = self.executor.apply_async(lambda a, b: a + b, (1, 2))
+        self.assertEqual(result.get(5), 3)
+
+    def test_shutdown(self):
+        self.executor.map(lambda n: n, range(10))
+        threads = threading.active_count()
+        self.executor.shutdown()
+        self.assertLess(threading.active_count(), threads)
+        # a shut down executor starts new threads when used again
+        self.assertEqual(self.executor.map(lambda n: n, range(3)), [0, 1, 2])
+
+    def test_exceptions_are_raised(self):
+        def fail(n):
+            raise ValueError(n)
+
+        self.assertRaises(ValueError, self.executor.map, fail, range(3))
+
+
+class SharedExecutorTestCase(unittest.TestCase):
+    def tearDown(self):
+        executor.shutdown_executor()
+
+    def test_get_executor(self):
+        shared = executor.get_executor()
+        self.assertIs(executor.get_executor(), shared)
+        self.assertEqual(shared.num_of_threads, DEFAULT_THREAD_LIMIT)
+
+    def test_configure_executor(self):
+        shared = executor.configure_executor(8)
+        self.assertIs(executor.get_executor(), shared)
+        self.assertEqual(shared.num_of_threads, 8)
+        self.assertIs(executor.configure_executor(8), shared)
+        self.assertIsNot(executor.configure_executor(2), shared)
+
+    def test_shutdown_executor(self):
+        shared = executor.configure_executor(8)
+        fetch = executor.get_fetch_executor()
+        executor.shutdown_executor()
+        self.assertIsNot(executor.get_executor(), shared)
+        self.assertIsNot(executor.get_fetch_executor(), fetch)
+
+    def test_fetch_executor_is_separate(self):
+        shared = executor.configure_executor(8)
+        fetch = executor.get_fetch_executor()
+        self.assertIsNot(fetch, shared)
+        self.assertIs(executor.get_fetch_executor(), fetch)
+        self.assertEqual(fetch.num_of_threads, 8)
+
+        def fan_out(n):
+            return executor.get_fetch_executor().in_worker()
+
+        # a worker of the shared executor fans out to other threads
+        self.assertEqual(shared.map(fan_out, range(2)), [False, False])
@@ -0,0 +1,169 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import json
+import threading
+import unittest
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+
+import mock
+
+from tattle import graphql
+from tattle.graphql import GraphQLError
+from tattle.model import Branch
+from tattle.model import BranchQuery
+from tattle.model import GRAPHQL_FETCH_MODE
+from tattle.model import NameFilter
+from tattle.model import Organization
+from tattle.model import QueryConfig
+from tattle.model import Repo
+
+ORG = 'cloudify-cosmo'
+# repo name -> branch names. 'cloudify-manager' has more branches than fit
+# a single page, so its branches are listed by a follow-up query.
+REPOS = {'cloudify-manager': ['master', 'CFY-1-a', 'CFY-2-b', 'CFY-3-c'],
+         'cloudify-ui': ['master', 'CFY-4-d'],
+         'tattle': ['master']}
+PER_PAGE = 2
+
+
+def page(items, cursor):
+    start = int(cursor) if cursor else 0
+    end = start + PER_PAGE
+    return {'pageInfo': {'hasNextPage': end < len(items),
+                         'endCursor': str(end)},
+            'nodes': items[start:end]}
+
+
+def refs(repo_name, cursor=None):
+    return page([{'name': name,
+                  'target': {'oid': 'sha',
+                             'author': {'email': name + '@example.com'}}}
+                 for name in REPOS[repo_name]],
+                cursor)
+
+
+class FakeGraphQLHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(
+                int(self.headers['Content-Length'])))
+        self.requests.append(body)
+        variables = body['variables']
+
+        if variables['org'] != ORG:
+            result = {'data': None,
+                      'errors': [{'message': 'Could not resolve to an '
+                                             'Organization'}]}
+        elif 'repo' in variables:
+            result = {'data': {'repository': {
+                'refs': refs(variables['repo'], variables['cursor'])}}}
+        else:
+            repositories = page(sorted(REPOS), variables['cursor'])
+            repositories['nodes'] = [{'name': name,
+                                      'owner': {'login': ORG},
+                                      'refs': refs(name)}
+                                     for name in repositories['nodes']]
+            result = {'data': {'organization': {
+                'repositories': repositories}}}
+
+        payload = json.dumps(result)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *_):
+        pass
+
+
+class GraphQLTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), FakeGraphQLHandler)
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever)
+        cls.server_thread.daemon = True
+        cls.server_thread.start()
+        cls.url = 'http://127.0.0.1:{0}/graphql'.format(
+                cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FakeGraphQLHandler.requests = []
+        patcher = mock.patch('tattle.graphql.GITHUB_GRAPHQL_URL', self.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_org_repositories(self):
+        pages = list(graphql.get_org_repositories(ORG))
+        self.assertEqual([[repo['name'] for repo in json_repos]
+                          for json_repos in pages],
+                         [['cloudify-manager', 'cloudify-ui'], ['tattle']])
+
+    def test_get_repository_refs(self):
+        json_repo = next(graphql.get_org_repositories(ORG))[0]
+        self.assertEqual([ref['name'] for ref in
+                          graphql.get_repository_refs(json_repo)],
+                         REPOS['cloudify-manager'])
+
+    def test_errors_are_raised(self):
+        self.assertRaises(GraphQLError, list,
+                          graphql.get_org_repositories('no-such-org'))
+
+    @mock.patch('tattle.network.configure_cache')
+    def test_query(self, *_):
+        config = QueryConfig('branch', 4, Organization(ORG), None,
+                             fetch_mode=GRAPHQL_FETCH_MODE)
+        bq = BranchQuery(config)
+        bq.attach_filters([NameFilter(1, ['CFY'])])
+        bq.query()
+
+        org = Organization(ORG)
+        expected_result = [
+            Branch(name, Repo(repo_name, org=org),
+                   committer_email=name + '@example.com', sha='sha')
+            for repo_name, name in [('cloudify-manager', 'CFY-1-a'),
+                                    ('cloudify-manager', 'CFY-2-b'),
+                                    ('cloudify-manager', 'CFY-3-c'),
+                                    ('cloudify-ui', 'CFY-4-d')]]
+        self.assertEqual(bq.result, expected_result)
+        # two pages of repos, and one more page of cloudify-manager's
+        # branches
+        self.assertEqual(len(FakeGraphQLHandler.requests), 3)
+
+
+class BranchFromGraphQLTestCase(unittest.TestCase):
+    def test_from_graphql(self):
+        repo = Repo('tattle', org=Organization(ORG))
+        json_ref = {'name': 'master',
+                    'target': {'oid': 'sha',
+                               'author': {'email': 'a@example.com'}}}
+        self.assertEqual(Branch.from_graphql(json_ref, repo),
+                         Branch('master', repo,
+                                committer_email='a@example.com',
+                                sha='sha'))
+
+    def test_from_graphql_without_author(self):
+        repo = Repo('tattle', org=Organization(ORG))
+        json_ref = {'name': 'master', 'target': {}}
+        self.assertEqual(Branch.from_graphql(json_ref, repo),
+                         Branch('master', repo))
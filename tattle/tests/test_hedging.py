@@ -0,0 +1,114 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import itertools
+import threading
+import time
+import unittest
+
+from tattle.executor import Executor
+from tattle.hedging import HedgeBudget
+from tattle.hedging import LatencyTracker
+from tattle.hedging import hedged_call
+
+
+class LatencyTrackerTestCase(unittest.TestCase):
+    def test_threshold(self):
+        tracker = LatencyTracker(percentile=90, window=100, min_samples=10)
+        for latency in range(9):
+            tracker.record('github', latency)
+        self.assertIsNone(tracker.threshold('github'))
+        tracker.record('github', 9)
+        self.assertEqual(tracker.threshold('github'), 9)
+        for latency in range(100):
+            tracker.record('github', latency)
+        self.assertEqual(tracker.threshold('github'), 90)
+        self.assertIsNone(tracker.threshold('jira'))
+
+
+class HedgeBudgetTestCase(unittest.TestCase):
+    def test_hedges_are_capped(self):
+        budget = HedgeBudget(max_ratio=0.1)
+        self.assertFalse(budget.try_hedge())
+        for _ in range(20):
+            budget.record_request()
+        self.assertTrue(budget.try_hedge())
+        self.assertTrue(budget.try_hedge())
+        self.assertFalse(budget.try_hedge())
+
+
+class HedgedCallTestCase(unittest.TestCase):
+    def setUp(self):
+        self.executor = Executor(4)
+        self.addCleanup(self.executor.shutdown, wait=False)
+        self.budget = HedgeBudget(max_ratio=1)
+        self.budget.record_request()
+        self.calls = itertools.count()
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def first_call_hangs(self, second_result=lambda: 'hedge'):
+        def function():
+            if next(self.calls) == 0:
+                self.release.wait(5)
+                return 'first'
+            return second_result()
+        return function
+
+    def test_hedge_wins(self):
+        self.assertEqual(hedged_call(self.first_call_hangs(), 0.01,
+                                     self.budget, self.executor),
+                         'hedge')
+        self.assertEqual(self.budget.hedges, 1)
+
+    def test_hedge_function(self):
+        def first():
+            self.release.wait(5)
+            return 'first'
+
+        self.assertEqual(hedged_call(first, 0.01, self.budget,
+                                     self.executor, hedge=lambda: 'hedge'),
+                         'hedge')
+
+    def test_fast_call_is_not_hedged(self):
+        self.assertEqual(hedged_call(lambda: 'first', 1, self.budget,
+                                     self.executor),
+                         'first')
+        self.assertEqual(self.budget.hedges, 0)
+
+    def test_no_hedge_without_budget(self):
+        budget = HedgeBudget(max_ratio=0)
+        threading.Timer(0.05, self.release.set).start()
+        start = time.time()
+        self.assertEqual(hedged_call(self.first_call_hangs(), 0.01, budget,
+                                     self.executor),
+                         'first')
+        self.assertGreaterEqual(time.time() - start, 0.05)
+
+    def test_failed_hedge_waits_for_the_first_call(self):
+        def fail():
+            threading.Timer(0.05, self.release.set).start()
+            raise ValueError()
+
+        self.assertEqual(hedged_call(self.first_call_hangs(fail), 0.01,
+                                     self.budget, self.executor),
+                         'first')
+
+    def test_errors_are_raised(self):
+        def fail():
+            raise ValueError()
+
+        self.assertRaises(ValueError, hedged_call, fail, 1, self.budget,
+                          self.executor)
@@ -0,0 +1,97 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tattle.index import BranchIndex
+from tattle.index import IssueCondition
+from tattle.index import NameCondition
+
+STAMP = ['2015-01-01T00:00:00Z', '2015-01-01T00:00:00Z']
+
+
+class BranchIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.index = BranchIndex(os.path.join(tmp_dir, 'index', 'index.db'))
+        self.addCleanup(self.index.close)
+        self.index.update_repo('org', 'repo-a', STAMP,
+                               [('master', '1'), ('CFY-1-a', '2')])
+        self.index.update_repo('org', 'repo-b', STAMP,
+                               [('CFY-2-b', '3'), ('CFY-1-a', '4')])
+        self.index.update_repo('other-org', 'repo-a', STAMP,
+                               [('CFY-1-a', '5')])
+
+    def branch_names(self, *args, **kwargs):
+        return [(row['name'], row['repo'])
+                for row in self.index.find_branches(*args, **kwargs)]
+
+    def test_find_branches(self):
+        self.assertEqual(self.branch_names('org'),
+                         [('CFY-1-a', 'repo-a'),
+                          ('CFY-1-a', 'repo-b'),
+                          ('CFY-2-b', 'repo-b'),
+                          ('master', 'repo-a')])
+        self.assertEqual(self.branch_names('org', repo_name='repo-a'),
+                         [('CFY-1-a', 'repo-a'), ('master', 'repo-a')])
+        self.assertEqual(self.branch_names('org', branch_name='master'),
+                         [('master', 'repo-a')])
+
+    def test_name_condition(self):
+        condition = NameCondition(lambda name: name.startswith('CFY-2'))
+        self.assertEqual(self.branch_names('org', [condition]),
+                         [('CFY-2-b', 'repo-b')])
+
+    def test_issue_condition(self):
+        self.index.update_issues('CFY', [('CFY-1', 'Closed'),
+                                         ('CFY-2', 'Open')])
+        condition = IssueCondition('CFY', lambda name: name[:5], ['Closed'])
+        rows = self.index.find_branches('org', [condition])
+        self.assertEqual([(row['name'], row['repo']) for row in rows],
+                         [('CFY-1-a', 'repo-a'), ('CFY-1-a', 'repo-b')])
+        self.assertEqual([(row['issue_key'], row['issue_status'])
+                          for row in rows], [('CFY-1', 'Closed')] * 2)
+        # issues of other teams are not joined
+        condition = IssueCondition('OTHER', lambda name: name[:5],
+                                   ['Closed'])
+        self.assertEqual(self.index.find_branches('org', [condition]), [])
+
+    def test_committer_email(self):
+        self.index.update_committer_email('org', 'repo-a', 'master',
+                                          'a@b.com')
+        self.assertEqual(self.branch_names('org', committer_email='a@b.com'),
+                         [('master', 'repo-a')])
+
+        # the email is kept as long as the head commit doesn't change
+        self.index.update_repo('org', 'repo-a', STAMP,
+                               [('master', '1'), ('CFY-1-a', '2')])
+        self.assertEqual(self.branch_names('org', committer_email='a@b.com'),
+                         [('master', 'repo-a')])
+        self.index.update_repo('org', 'repo-a', STAMP, [('master', '6')])
+        self.assertEqual(self.branch_names('org', committer_email='a@b.com'),
+                         [])
+        self.assertEqual(self.branch_names('org', repo_name='repo-a'),
+                         [('master', 'repo-a')])
+
+    def test_remove_missing_repos(self):
+        self.index.remove_missing_repos('org', ['repo-b'])
+        self.assertEqual(self.index.get_repo_names('org'), ['repo-b'])
+        self.assertEqual(self.branch_names('org'),
+                         [('CFY-1-a', 'repo-b'), ('CFY-2-b', 'repo-b')])
+        self.assertEqual(self.index.get_repo_names('other-org'), ['repo-a'])
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import re
+import unittest
+
+import mock
+
+from tattle.matcher import AhoCorasick
+from tattle.matcher import NameMatcher
+from tattle.matcher import is_literal
+
+NAMES = ['master', 'CFY-3223-allow-external-rabbitmq', 'CFY1002-feature2',
+         '3.2.0-build', 'revert-249-CFY-2504-fix', 'feature/she-said-hers',
+         'aaab', 'abab', u'CFY-100-ש', 'abx']
+
+
+class IsLiteralTestCase(unittest.TestCase):
+    def test_is_literal(self):
+        self.assertTrue(is_literal('CFY'))
+        self.assertTrue(is_literal('feature-1'))
+        self.assertTrue(is_literal(''))
+        self.assertFalse(is_literal('CFY-*'))
+        self.assertFalse(is_literal('3.2'))
+        self.assertFalse(is_literal('^master$'))
+
+
+class AhoCorasickTestCase(unittest.TestCase):
+    def test_search(self):
+        automaton = AhoCorasick(['he', 'she', 'his', 'hers'])
+        self.assertTrue(automaton.search('ushers'))
+        self.assertTrue(automaton.search('ahis'))
+        self.assertFalse(automaton.search('hi s'))
+        self.assertFalse(automaton.search(''))
+
+    def test_search_follows_failure_links(self):
+        automaton = AhoCorasick(['abc', 'bd'])
+        self.assertTrue(automaton.search('abd'))
+        self.assertFalse(automaton.search('abab'))
+
+    def test_search_without_keywords(self):
+        self.assertFalse(AhoCorasick([]).search('anything'))
+
+    def test_search_with_empty_keyword(self):
+        self.assertTrue(AhoCorasick(['']).search('anything'))
+
+
+class NameMatcherTestCase(unittest.TestCase):
+    def assert_same_as_re_search(self, patterns):
+        matcher = NameMatcher(patterns)
+        for name in NAMES:
+            expected = any(re.search(p, name) for p in patterns)
+            self.assertEqual(matcher.matches(name), expected,
+                             msg='{0!r} with {1!r}'.format(name, patterns))
+
+    def test_literals(self):
+        self.assert_same_as_re_search(['CFY'])
+        self.assert_same_as_re_search(['build', 'master'])
+
+    def test_many_literals(self):
+        self.assert_same_as_re_search(['CFY-{0}'.format(i)
+                                       for i in range(100)] + ['hers'])
+
+    def test_regexes(self):
+        self.assert_same_as_re_search([r'^CFY-\d+', r'build$'])
+        self.assert_same_as_re_search([r'CFY-*\d+', 'master', r'\d\.\d'])
+
+    def test_unmergeable_regexes(self):
+        self.assert_same_as_re_search([r'(a)\1', r'(b)a'])
+        self.assert_same_as_re_search([r'(?i)cfy', 'build'])
+        self.assert_same_as_re_search([r'(?P<x>a)(?P=x)b', r'xyz'])
+        self.assert_same_as_re_search([r'CFY-(?P<id>\d+)',
+                                       r'build-(?P<id>\d+)'])
+        self.assert_same_as_re_search([r'(b)a', r'(a)?(?(1)b|c)x'])
+
+    @mock.patch('tattle.matcher.UNMERGEABLE_PATTERN', re.compile('$^'))
+    def test_patterns_that_fail_to_merge_are_compiled_separately(self):
+        self.assert_same_as_re_search([r'CFY-(?P<id>\d+)',
+                                       r'build-(?P<id>\d+)'])
+
+    def test_patterns_with_more_than_100_groups(self):
+        patterns = [r'(feat|fix)-{0}.*'.format(n) for n in range(120)]
+        matcher = NameMatcher(patterns)
+        # the patterns are merged into as few regexes as the groups allow
+        self.assertEqual(len(matcher._regexes), 2)
+        self.assertTrue(matcher.matches('fix-119-a'))
+        self.assertFalse(matcher.matches('fix-a'))
+        self.assert_same_as_re_search(patterns + [r'CFY-(\d)'])
+
+    @mock.patch('tattle.matcher.MAX_MERGED_GROUPS', 1000)
+    def test_patterns_with_too_many_groups_are_compiled_separately(self):
+        patterns = [r'(feat|fix)-{0}.*'.format(n) for n in range(120)]
+        self.assertEqual(len(NameMatcher(patterns)._regexes), 120)
+        self.assert_same_as_re_search(patterns)
+
+    def test_no_patterns(self):
+        self.assert_same_as_re_search([])
+
+    def test_eq(self):
+        self.assertEqual(NameMatcher(['a', 'b']), NameMatcher(['a', 'b']))
+        self.assertNotEqual(NameMatcher(['a']), NameMatcher(['b']))
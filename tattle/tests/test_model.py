@@ -13,16 +13,28 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
 import mock
+import requests
 import yaml
 
 from mock import PropertyMock
 
+from tattle import executor
+from tattle import metrics
 from tattle import model
+from tattle import network
+from tattle.cache import PersistentCache
 
 from tattle.model import GitHubObject
+from tattle.model import InternTable
 from tattle.model import Organization
 from tattle.model import Repo
 from tattle.model import Branch
@@ -33,6 +45,7 @@ from tattle.model import IssueFilter
 from tattle.model import Transform
 from tattle.model import QueryConfig
 from tattle.model import Query
+from tattle.model import QueryBatch
 from tattle.model import BranchQuery
 
 
@@ -43,49 +56,133 @@ class GetJsonMethodsTestCase(unittest.TestCase):
             self.status_code = status_code
             self.text = text
 
-    @mock.patch('requests.get')
+    @mock.patch('tattle.network.get')
     def test_get_json_with_non_ok_status_code(self, mock_requests_get):
         mock_requests_get.return_value = self.StubResponse(199)
         self.assertEqual({}, model.get_json(''))
         mock_requests_get.return_value = self.StubResponse(300)
         self.assertEqual({}, model.get_json(''))
 
-    @mock.patch('requests.get')
+    @mock.patch('tattle.network.get')
     def test_get_json_with_ok_status_code_with_invalid_json(self,
                                                             mock_requests_get):
         mock_requests_get.return_value = self.StubResponse(200, '{')
         self.assertRaises(ValueError, model.get_json, 'dummy_url')
 
+    @mock.patch('tattle.network.get')
+    def test_concurrent_requests_are_coalesced(self, mock_requests_get):
+        url = 'https://api.github.com/repos/cloudify-cosmo/cloudify-manager' \
+              '/branches/master'
+        metric = 'coalesced.github.branches'
+        coalesced = metrics.get_value(metric)
+        release = threading.Event()
+
+        def get(*_, **__):
+            release.wait(5)
+            return self.StubResponse(200, '{"name": "master"}')
+
+        mock_requests_get.side_effect = get
+        results = []
+        threads = [threading.Thread(
+                target=lambda: results.append(model.get_json(url)))
+                for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        deadline = time.time() + 5
+        while (metrics.get_value(metric) - coalesced < 2 and
+               time.time() < deadline):
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [{'name': 'master'}] * 3)
+        self.assertEqual(mock_requests_get.call_count, 1)
+        self.assertEqual(metrics.get_value(metric) - coalesced, 2)
+        # requests that are sent later are not served the earlier response
+        model.get_json(url)
+        self.assertEqual(mock_requests_get.call_count, 2)
+
+    def test_get_endpoint(self):
+        for url, endpoint in [
+                ('https://api.github.com/orgs/cloudify-cosmo', 'orgs'),
+                ('https://api.github.com/orgs/cloudify-cosmo/repos?page=2',
+                 'repos'),
+                ('https://api.github.com/repos/cloudify-cosmo/'
+                 'cloudify-manager/commits/abc', 'commits'),
+                ('https://api.github.com/repos/cloudify-cosmo/'
+                 'cloudify-manager/git/commits/abc', 'commits'),
+                ('https://cloudifysource.atlassian.net/rest/api/2/issue/'
+                 'CFY-1/?fields=status', 'issue'),
+                ('https://cloudifysource.atlassian.net/rest/api/2/search'
+                 '?jql=key', 'search')]:
+            self.assertEqual(model.get_endpoint(url), endpoint)
+
+
+class PaginationTestCase(unittest.TestCase):
+    @staticmethod
+    def create_response(items, last_page=None):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(items)
+        if last_page is not None:
+            response.headers['Link'] = (
+                '<https://api.github.com/x?page=2&per_page=100>; rel="next", '
+                '<https://api.github.com/x?page={0}&per_page=100>; '
+                'rel="last"'.format(last_page))
+        return response
+
+    def test_get_num_of_pages(self):
+        self.assertEqual(model.get_num_of_pages(self.create_response([])), 1)
+        self.assertEqual(
+                model.get_num_of_pages(self.create_response([], 7)), 7)
+
+    @mock.patch('tattle.network.get')
+    def test_get_json_pages_with_a_single_page(self, mock_get):
+        mock_get.return_value = self.create_response([1, 2])
+        self.assertEqual(model.get_json_pages('url?page={0}'.format), [1, 2])
+        mock_get.assert_called_once_with('url?page=1', auth=None)
+
+    @mock.patch('tattle.network.get')
+    def test_get_json_pages(self, mock_get):
+        def get(url, auth=None, cache=True):
+            page_number = int(url[-1])
+            items = [page_number * 10, page_number * 10 + 1]
+            return self.create_response(items,
+                                        3 if page_number == 1 else None)
+
+        mock_get.side_effect = get
+        self.assertEqual(model.get_json_pages('url?page={0}'.format),
+                         [10, 11, 20, 21, 30, 31])
+        self.assertEqual(mock_get.call_count, 3)
+
+    @mock.patch('tattle.network.get')
+    def test_pages_are_fetched_concurrently_from_a_worker(self, mock_get):
+        lock = threading.Lock()
+        in_flight = [0]
+        peak = [0]
+
+        def get(url, auth=None, cache=True):
+            page_number = int(url.split('=')[-1])
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            time.sleep(0.02)
+            with lock:
+                in_flight[0] -= 1
+            return self.create_response([page_number],
+                                        20 if page_number == 1 else None)
+
+        mock_get.side_effect = get
+        shared = executor.configure_executor(4)
+        self.addCleanup(executor.shutdown_executor)
+        pages = shared.map(lambda n: model.get_json_pages(
+                'url{0}?page={{0}}'.format(n).format), range(2))
+        self.assertEqual(pages, [range(1, 21)] * 2)
+        # each listing fans its pages out beyond its own worker
+        self.assertGreater(peak[0], 2)
 
-class GitHubApiUrlTestCase(unittest.TestCase):
-    def test_determine_number_of_threads_without_per_page(self):
-        self.assertEqual(model.determine_num_of_threads(10, 10), 10)
-        self.assertEqual(model.determine_num_of_threads(10, 9), 9)
-        self.assertEqual(model.determine_num_of_threads(9, 10), 9)
-        self.assertEqual(model.determine_num_of_threads(0, 10), 0)
-        self.assertEqual(model.determine_num_of_threads(10, 0), 0)
-        self.assertEqual(model.determine_num_of_threads(0, 0), 0)
-
-    def test_determine_number_of_threads_with_per_page(self):
-        self.assertEqual(model.determine_num_of_threads(10, 10, per_page=1),
-                         10)
-        self.assertEqual(model.determine_num_of_threads(10, 10, per_page=3),
-                         4)
-        self.assertEqual(model.determine_num_of_threads(10, 10, per_page=10),
-                         1)
-        self.assertEqual(model.determine_num_of_threads(10, 10, per_page=11),
-                         1)
-        self.assertEqual(model.determine_num_of_threads(0, 10, per_page=1),
-                         0)
-
-        self.assertRaises(ZeroDivisionError, model.determine_num_of_threads,
-                          thread_limit=10, num_of_items=10, per_page=0)
-
-    @mock.patch('tattle.model.ThreadPool')
-    def test_create_thread_pool(self, mock_pool):
-        model.create_thread_pool(1)
-        self.assertTrue(mock_pool.called)
 
+class GitHubApiUrlTestCase(unittest.TestCase):
     def test_pagination_format(self):
         pagination_string = '?page=1&per_page=100'
         self.assertEqual(pagination_string, model.pagination_format(1))
@@ -110,6 +207,16 @@ class GitHubApiUrlTestCase(unittest.TestCase):
                                               ),
                 url)
 
+    def test_generate_github_api_url_with_paginated_list_branches(self):
+        url = ('https://api.github.com/repos/cloudify-cosmo/'
+               'cloudify-manager/branches?page=2&per_page=100')
+        self.assertEqual(
+                model.generate_github_api_url('list_branches',
+                                              org_name='cloudify-cosmo',
+                                              repo_name='cloudify-manager',
+                                              page_number=2),
+                url)
+
     def test_generate_github_api_url_with_list_branches(self):
         url = ('https://api.github.com/repos/cloudify-cosmo/'
                'cloudify-manager/branches')
@@ -145,35 +252,6 @@ class OrganizationTest(unittest.TestCase):
         self.assertEqual(str(Organization('org_name')), 'org_name')
         self.assertNotEqual(str(Organization('org_name')), 'another_org_name')
 
-    @mock.patch('os.environ')
-    @mock.patch('tattle.model.get_json')
-    def test_get_num_of_repos(self, mock_get_json, *_):
-        org = Organization('org_name')
-
-        mock_get_json.return_value = {model.PUBLIC_REPOS: 2,
-                                      model.TOTAL_PRIVATE_REPOS: 3}
-
-        self.assertEqual(Organization.get_num_of_repos(org), 5)
-
-    @mock.patch('os.environ')
-    @mock.patch('tattle.model.get_json')
-    def test_get_num_of_repos_no_public_repos(self, mock_get_json, *_):
-        org = Organization('org_name')
-
-        mock_get_json.return_value = {model.TOTAL_PRIVATE_REPOS: 3}
-
-        self.assertEqual(Organization.get_num_of_repos(org), 3)
-
-    @mock.patch('os.environ')
-    @mock.patch('tattle.model.get_json')
-    def test_get_num_of_repos_no_private_repos(self, mock_get_json, *_):
-
-        org = Organization('org_name')
-
-        mock_get_json.return_value = {model.PUBLIC_REPOS: 2}
-
-        self.assertEqual(Organization.get_num_of_repos(org), 2)
-
 
 class RepoTest(unittest.TestCase):
     def test_str(self):
@@ -195,21 +273,19 @@ class RepoTest(unittest.TestCase):
 
         self.assertEqual(repo, Repo.from_json(json_repo))
 
-    @mock.patch('tattle.model.logging.Logger.info')
-    @mock.patch('tattle.model.Organization.get_num_of_repos', return_value=1)
-    @mock.patch('multiprocessing.pool.ThreadPool.map')
-    def test_get_repos(self, mock_map, *_):
-        mock_map.return_value = \
-            [[{'name': 'cloudify-manager',
-               'owner': {'login': 'cloudify-cosmo'}}],
-             [{'name': 'cloudify-ui',
-               'owner': {'login': 'cloudify-cosmo'}}]]
+    def test_from_json_with_intern_table(self):
+        org = Organization('org_name')
+        intern_table = InternTable([org])
+        json_repo = {'name': 'repo_name',
+                     'owner': {'login': 'org_name'}
+                     }
+        repo = Repo.from_json(json_repo, intern_table=intern_table)
+
+        self.assertEqual(repo, Repo('repo_name', org))
+        self.assertIs(repo.organization, org)
+        self.assertIs(Repo.from_json(json_repo, intern_table=intern_table),
+                      repo)
 
-        org = Organization('cloudify-cosmo')
-        expected_result = [Repo('cloudify-manager', org=org),
-                           Repo('cloudify-ui', org=org)]
-        result = Repo.get_repos(org)
-        self.assertEqual(result, expected_result)
 
 
 class BranchTestCase(unittest.TestCase):
@@ -235,6 +311,54 @@ class BranchTestCase(unittest.TestCase):
 
         self.assertEqual(model.Branch.from_json(json_branch), expected_branch)
 
+    def test_from_json_with_repo(self):
+        repo = Repo('getcloudify.org', org=Organization('cloudify-cosmo'))
+        json_branch = {u'commit': {u'url': u'unparsable'},
+                       u'name': u'master'}
+        branch = model.Branch.from_json(json_branch, repo=repo)
+        self.assertEqual(branch, Branch('master', repo))
+        self.assertIs(branch.repo, repo)
+
+    def test_slots(self):
+        branch = Branch('master', Repo('cloudify-manager'))
+        self.assertFalse(hasattr(branch, '__dict__'))
+        self.assertEqual(Branch.fields(), ('name', 'repo', 'jira_issue',
+                                           'committer_email', 'sha'))
+
+    def test_eq(self):
+        repo = Repo('cloudify-manager', org=Organization('cloudify-cosmo'))
+        self.assertEqual(Branch('master', repo),
+                         Branch('master',
+                                Repo('cloudify-manager',
+                                     org=Organization('cloudify-cosmo'))))
+        self.assertNotEqual(Branch('master', repo),
+                            Branch('master', repo, committer_email='a@b'))
+        self.assertNotEqual(Branch('master', repo),
+                            Repo('master', org=Organization('x')))
+
+    def test_to_dict(self):
+        branch = Branch('master',
+                        Repo('cloudify-manager',
+                             org=Organization('cloudify-cosmo')),
+                        jira_issue=Issue('CFY-1', 'Closed'))
+        self.assertEqual(json.loads(json.dumps(branch.to_dict(),
+                                               default=lambda x: x.to_dict())),
+                         {'name': 'master',
+                          'repo': {'name': 'cloudify-manager',
+                                   'organization': {'name': 'cloudify-cosmo'}},
+                          'jira_issue': {'key': 'CFY-1', 'status': 'Closed'},
+                          'committer_email': None,
+                          'sha': None})
+
+    def test_sort_key(self):
+        org = Organization('cloudify-cosmo')
+        branches = [Branch('master', Repo('b', org=org)),
+                    Branch('CFY-1', Repo('c', org=org)),
+                    Branch('master', Repo('a', org=org))]
+        self.assertEqual([(b.name, b.repo.name)
+                          for b in sorted(branches, key=Branch.sort_key)],
+                         [('CFY-1', 'c'), ('master', 'a'), ('master', 'b')])
+
     def test_extract_repo_data(self):
         branch_url = ('https://api.github.com/repos/cloudify-cosmo/'
                       'getcloudify.org/commits/'
@@ -244,52 +368,6 @@ class BranchTestCase(unittest.TestCase):
         self.assertEqual(model.Branch.extract_repo_data(branch_url),
                          expected_extraction)
 
-    @mock.patch('tattle.model.logging.Logger.info')
-    @mock.patch('multiprocessing.pool.ThreadPool.map')
-    def test_get_org_branches(self, mock_map, *_):
-        self.maxDiff = None
-        mock_map.return_value = [
-            [{u'commit': {u'url': u'https://api.github.com/repos/'
-                                  u'cloudify-cosmo/getcloudify.org/'
-                                  u'commits/d87100f060e2f69f2f3702a'
-                                  u'993a2a4176b1c0493'},
-              u'name': u'CFY-2239-vcloud-plugin-docs'},
-             {u'commit': {u'url': u'https://api.github.com/repos/'
-                                  u'cloudify-cosmo/getcloudify.org/'
-                                  u'commits/955c56daf6e43809886d1ce'
-                                  u'e2516a9d7c1d1f5fc'},
-              u'name': u'agent-refactoring-project'}
-             ],
-            [{u'commit': {u'url': u'https://api.github.com/repos/'
-                                  u'cloudify-cosmo/gs-ui-infra/'
-                                  u'commits/b66e74f1de35334ae6519f4'
-                                  u'f3b26022fb6e38557'},
-              u'name': u'3.2.0-build'},
-             {u'commit': {u'url': u'https://api.github.com/repos/'
-                                  u'cloudify-cosmo/gs-ui-infra/'
-                                  u'commits/0095ef1cdaf9df8fa24cef2'
-                                  u'51bbfbc60acd54818'},
-              u'name': u'3.3rc1-build'}
-             ]
-        ]
-        expected_result = [Branch(u'3.2.0-build',
-                                  Repo(u'gs-ui-infra',
-                                       org=Organization(u'cloudify-cosmo'))),
-                           Branch(u'3.3rc1-build',
-                                  Repo(u'gs-ui-infra',
-                                       org=Organization(u'cloudify-cosmo'))),
-                           Branch(u'CFY-2239-vcloud-plugin-docs',
-                                  Repo(u'getcloudify.org',
-                                       org=Organization(u'cloudify-cosmo'))),
-                           Branch(u'agent-refactoring-project',
-                                  Repo(u'getcloudify.org',
-                                       org=Organization(u'cloudify-cosmo')))
-                           ]
-        org = Organization('org_name')
-        repos = [Repo('repo_name')]
-        self.assertEqual(model.Branch.get_org_branches(repos, org),
-                         expected_result)
-
     def test_update_branches_with_issues(self):
         branches = [Branch(u'CFY-3223-allow-external-rabbitmq',
                            Repo(u'cloudify-manager',
@@ -337,35 +415,89 @@ class BranchTestCase(unittest.TestCase):
         Branch.update_branches_with_issues(branches, issues)
         self.assertEqual(branches, expected_branches)
 
-    def test_update_details_with_correctly_formatted_details(self):
-        branch = Branch(u'CFY-3223-allow-external-rabbitmq',
-                        Repo(u'cloudify-manager',
-                             org=Organization(u'cloudify-cosmo')))
-
-        details = {'commit': {
-            'commit': {
-                'author': {
-                    'email': 'avia@gigaspaces.com'
-                }}}}
-        expected_branch = Branch(u'CFY-3223-allow-external-rabbitmq',
-                                 Repo(u'cloudify-manager',
-                                      org=Organization(u'cloudify-cosmo')),
-                                 committer_email='avia@gigaspaces.com')
-        Branch.update_details(branch, details)
-        self.assertEqual(branch, expected_branch)
-
-    def test_update_details_with_incorrectly_formatted_details(self):
-        branch = Branch(u'CFY-3223-allow-external-rabbitmq',
-                        Repo(u'cloudify-manager',
-                             org=Organization(u'cloudify-cosmo')))
-
-        details = {'commit': {
-            'commit': {
-                'author': {
-                    'not_email': 'no_email'
-                }}}}
-
-        self.assertRaises(KeyError, Branch.update_details, branch, details)
+
+class CommitCacheTestCase(unittest.TestCase):
+    JSON_COMMIT = {'author': {'email': 'a@example.com'}}
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.cache = PersistentCache(os.path.join(self.cache_dir, 'cache.db'),
+                                     model.COMMITS_NAMESPACE)
+        self.addCleanup(self.cache.close)
+        self.repo = Repo('cloudify-manager',
+                         org=Organization('cloudify-cosmo'))
+
+    def test_generate_commit_url(self):
+        self.assertEqual(model.generate_github_api_url(
+                'commit', org_name='cloudify-cosmo',
+                repo_name='cloudify-manager', sha='abc'),
+                'https://api.github.com/repos/cloudify-cosmo/'
+                'cloudify-manager/git/commits/abc')
+
+    def test_from_json_keeps_sha(self):
+        json_branch = {'name': 'master',
+                       'commit': {'sha': 'abc', 'url': 'unused'}}
+        self.assertEqual(Branch.from_json(json_branch, repo=self.repo).sha,
+                         'abc')
+
+    @mock.patch('tattle.model.Branch.fetch_commit')
+    def test_committer_email_is_cached_by_sha(self, mock_fetch_commit):
+        mock_fetch_commit.return_value = self.JSON_COMMIT
+        branch = Branch('master', self.repo, sha='abc')
+        other_branch = Branch('CFY-1', self.repo, sha='abc')
+
+        for b in (branch, other_branch):
+            self.assertEqual(Branch.get_committer_email(
+                    b, commit_cache=self.cache), 'a@example.com')
+        self.assertEqual(mock_fetch_commit.call_count, 1)
+        self.assertEqual(self.cache.get('abc'),
+                         {'committer_email': 'a@example.com'})
+
+    @mock.patch('tattle.model.Branch.fetch_commit')
+    def test_failed_lookups_are_not_cached(self, mock_fetch_commit):
+        mock_fetch_commit.return_value = {}
+        branch = Branch('master', self.repo, sha='abc')
+        self.assertIsNone(Branch.get_committer_email(
+                branch, commit_cache=self.cache))
+        self.assertIsNone(self.cache.get('abc'))
+
+    @mock.patch('tattle.model.Branch.fetch_commit')
+    @mock.patch('tattle.model.Branch.fetch_details')
+    def test_branch_without_sha(self, mock_fetch_details, mock_fetch_commit):
+        mock_fetch_details.return_value = {
+            'commit': {'commit': self.JSON_COMMIT}}
+        branch = Branch('master', self.repo)
+        self.assertEqual(Branch.get_committer_email(
+                branch, commit_cache=self.cache), 'a@example.com')
+        self.assertFalse(mock_fetch_commit.called)
+        self.assertEqual(len(self.cache), 0)
+
+    @mock.patch('tattle.model.Branch.fetch_commit')
+    def test_concurrent_lookups_are_coalesced(self, mock_fetch_commit):
+        release = threading.Event()
+
+        def fetch_commit(_):
+            release.wait(5)
+            return self.JSON_COMMIT
+
+        mock_fetch_commit.side_effect = fetch_commit
+        bq = BranchQuery(QueryConfig('branch', 4, None, None))
+        branches = [Branch('b{0}'.format(i), self.repo, sha='abc')
+                    for i in range(4)]
+        threads = [threading.Thread(target=bq.get_committer_email,
+                                    args=(b,))
+                   for b in branches]
+        with mock.patch('tattle.network.get_cache',
+                        return_value=self.cache):
+            for thread in threads:
+                thread.start()
+            release.set()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(bq.get_committer_email(branches[0]),
+                             'a@example.com')
+        self.assertEqual(mock_fetch_commit.call_count, 1)
 
 
 class IssueTestCase(unittest.TestCase):
@@ -385,8 +517,123 @@ class IssueTestCase(unittest.TestCase):
         expected_string = 'key: CFY-3223, status: Closed'
         self.assertEqual(str(issue), expected_string)
 
-    def test_get_json_issue(self):
-        self.assertIsNone(Issue.get_json_issue(None, 'jira_team_name'))
+    @staticmethod
+    def create_response(status_code, body=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps(body) if body is not None else ''
+        return response
+
+    @mock.patch('tattle.network.get')
+    def test_get_json_issues(self, mock_get):
+        mock_get.return_value = self.create_response(200, {
+            'total': 2,
+            'issues': [
+                {'key': 'CFY-1', 'fields': {'status': {'name': 'Open'}}},
+                {'key': 'CFY-2', 'fields': {'status': {'name': 'Done'}}}],
+            'warningMessages': ["An issue with key 'CFY-3' does not exist"]})
+
+        json_issues = Issue.get_json_issues(
+                ['CFY-2', 'CFY-1', None, 'CFY-2', 'CFY-3'], 'team')
+
+        self.assertEqual([Issue.from_json(j) for j in json_issues],
+                         [Issue('CFY-2', 'Done'), Issue('CFY-1', 'Open'),
+                          None, Issue('CFY-2', 'Done'), None])
+        # the three unique keys are resolved by a single search request
+        self.assertEqual(mock_get.call_count, 1)
+
+    @mock.patch('tattle.model.Issue.search_json_issues', return_value=[])
+    def test_get_json_issues_in_batches(self, mock_search_json_issues):
+        keys = ['CFY-{0}'.format(i) for i in range(5)]
+        Issue.get_json_issues(keys, 'team', batch_size=2)
+        searched_keys = sorted(call[0][0] for call in
+                               mock_search_json_issues.call_args_list)
+        self.assertEqual(searched_keys, [['CFY-0', 'CFY-1'],
+                                         ['CFY-2', 'CFY-3'],
+                                         ['CFY-4']])
+
+    @mock.patch('tattle.model.Issue.get_json_issues')
+    def test_lookup_json_issues_with_cache(self, mock_get_json_issues):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        issue_cache = PersistentCache(os.path.join(cache_dir, 'cache.db'),
+                                      model.ISSUES_NAMESPACE, ttl=60)
+        self.addCleanup(issue_cache.close)
+        json_issue = {'key': 'CFY-1', 'fields': {'status': {'name': 'Open'}}}
+        mock_get_json_issues.return_value = [json_issue, None]
+
+        self.assertEqual(Issue.lookup_json_issues(['CFY-1', 'CFY-2'], 'team',
+                                                  issue_cache=issue_cache),
+                         {'CFY-1': json_issue, 'CFY-2': None})
+        self.assertEqual(issue_cache.get('team/CFY-1'),
+                         {'json_issue': json_issue})
+        # keys that were not found are not cached
+        self.assertIsNone(issue_cache.get('team/CFY-2'))
+
+        mock_get_json_issues.reset_mock()
+        mock_get_json_issues.return_value = [None]
+        self.assertEqual(Issue.lookup_json_issues(['CFY-1', 'CFY-2'], 'team',
+                                                  issue_cache=issue_cache),
+                         {'CFY-1': json_issue, 'CFY-2': None})
+        mock_get_json_issues.assert_called_once_with(
+                ['CFY-2'], 'team', batch_size=model.DEFAULT_JIRA_BATCH_SIZE)
+
+        mock_get_json_issues.reset_mock()
+        mock_get_json_issues.return_value = [None]
+        Issue.lookup_json_issues(['CFY-1'], 'team', issue_cache=issue_cache,
+                                 refresh=True)
+        mock_get_json_issues.assert_called_once_with(
+                ['CFY-1'], 'team', batch_size=model.DEFAULT_JIRA_BATCH_SIZE)
+
+    @mock.patch('tattle.network.get')
+    def test_search_json_issues_url(self, mock_get):
+        mock_get.return_value = self.create_response(200, {'total': 0,
+                                                           'issues': []})
+        Issue.search_json_issues(['CFY-1', 'CFY-2'], 'team')
+        mock_get.assert_called_once_with(
+                'https://team.atlassian.net/rest/api/2/search?'
+                'jql=key+in+%28%22CFY-1%22%2C+%22CFY-2%22%29&fields=status&'
+                'startAt=0&maxResults=2&validateQuery=warn')
+
+    @mock.patch('tattle.network.get')
+    def test_search_json_issues_splits_invalid_batches(self, mock_get):
+        def get(url):
+            if 'BAD' in url:
+                return self.create_response(model.INVALID_QUERY)
+            issues = [{'key': 'CFY-1'}] if 'CFY-1' in url else []
+            return self.create_response(200, {'total': len(issues),
+                                              'issues': issues})
+
+        mock_get.side_effect = get
+        self.assertEqual(Issue.search_json_issues(['CFY-1', 'BAD-1', 'CFY-2'],
+                                                  'team'),
+                         [{'key': 'CFY-1'}])
+
+    @mock.patch('tattle.network.get')
+    def test_search_json_issues_fails_on_other_errors(self, mock_get):
+        mock_get.return_value = self.create_response(401)
+        self.assertRaises(model.JiraSearchError, Issue.search_json_issues,
+                          ['CFY-{0}'.format(i) for i in range(8)], 'team')
+        # a search that can't succeed is not split
+        self.assertEqual(mock_get.call_count, 1)
+
+    @mock.patch('tattle.network.get')
+    def test_search_json_issues_fetches_truncated_results(self, mock_get):
+        keys = ['CFY-{0}'.format(i) for i in range(5)]
+
+        def get(url):
+            # JIRA answers with 2 issues at most
+            start_at = int(url.split('startAt=')[1].split('&')[0])
+            return self.create_response(200, {
+                'startAt': start_at,
+                'total': len(keys),
+                'issues': [{'key': key} for key in
+                           keys[start_at:start_at + 2]]})
+
+        mock_get.side_effect = get
+        self.assertEqual(Issue.search_json_issues(keys, 'team'),
+                         [{'key': key} for key in keys])
+        self.assertEqual(mock_get.call_count, 3)
 
     def test_from_json(self):
         json_issue = {
@@ -494,6 +741,12 @@ class IssueFilterTestCase(unittest.TestCase):
                                       )
         self.assertEqual(IssueFilter.from_yaml(yaml_if), expected_filter)
 
+    @mock.patch('tattle.model.Transform.from_yaml')
+    def test_from_yaml_with_batch_size(self, *_):
+        yaml_if = yaml.load('jira_team_name: cloudifysource\n'
+                            'batch_size: 20\n')
+        self.assertEqual(IssueFilter.from_yaml(yaml_if).batch_size, 20)
+
     def test_legal(self):
         issue_filter = IssueFilter(1,
                                    'cloudifysource',
@@ -599,40 +852,342 @@ class QueryTestCase(unittest.TestCase):
         q.attach_filters(unsorted_filters)
         self.assertEqual(q.filters, sorted_filters)
 
+    def test_attach_filters_applies_local_filters_first(self):
+        issue_filter = IssueFilter(1, None, None, None)
+        name_filter = NameFilter(2, ['CFY'])
+        another_name_filter = NameFilter(2, ['build'])
+        q = Query(None)
+        q.attach_filters([issue_filter, name_filter, another_name_filter])
+        self.assertEqual(q.filters,
+                         [name_filter, another_name_filter, issue_filter])
+
+    def test_attach_filters_more_than_once(self):
+        q = Query(None)
+        q.attach_filters([IssueFilter(1, None, None, None)])
+        q.attach_filters([NameFilter(3, None)])
+        self.assertEqual(q.filters, [NameFilter(3, None),
+                                     IssueFilter(1, None, None, None)])
+
 
 class BranchQueryTestCase(unittest.TestCase):
-    @mock.patch('tattle.model.NameFilter.filter')
-    @mock.patch('tattle.model.IssueFilter.filter')
-    @mock.patch('tattle.model.Branch.update_branches_with_issues')
+    @mock.patch('tattle.network.configure_retries')
+    @mock.patch('tattle.model.BranchQuery.list_org_branches')
+    def test_explain(self, mock_list_org_branches, mock_configure_retries):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.addCleanup(network.close_cache)
+        config = QueryConfig('branch', 1, Organization('cloudify-cosmo'),
+                             None, cache_path=os.path.join(cache_dir,
+                                                           'cache.db'))
+        bq = BranchQuery(config)
+        bq.attach_filters([IssueFilter(1, 'team', ['Closed'],
+                                       Transform.from_args(), batch_size=2),
+                           NameFilter(2, ['CFY'])])
+
+        def list_org_branches():
+            # the listing sees the query's cache
+            network.get_cache(model.ISSUES_NAMESPACE).set(
+                    'team/CFY-1', {'json_issue': {}})
+            network.get_cache(model.COMMITS_NAMESPACE).set(
+                    'x', {'committer_email': 'a@b.com'})
+            metrics.increment('requests.github', 3)
+            return [[Branch(name, Repo('a'), sha=sha) for name, sha in
+                     [('master', 'm'), ('CFY-1-a', 'x'), ('CFY-1-b', 'x')]],
+                    [Branch(name, Repo('b'), sha=sha) for name, sha in
+                     [('CFY-2-a', 'y'), ('CFY3-c', 'z')]]]
+
+        mock_list_org_branches.side_effect = list_org_branches
+
+        # the cached issue and commit are not looked up, and the keys of
+        # the two repos don't fit in a single batch
+        self.assertEqual(
+                bq.explain(),
+                'query plan for 5 branches in 2 repos of the cloudify-cosmo '
+                'organization:\n'
+                '  1. list branches: 3 requests\n'
+                '  2. name filter (local, precedence 2): 0 requests, '
+                '4 branches remain\n'
+                '  3. issue filter (remote, precedence 1): 1 requests, '
+                'at most 4 branches remain\n'
+                '  4. fetch branch details: at most 2 requests\n'
+                'estimated requests: at most 6')
+        mock_configure_retries.assert_called_once_with(
+                config.request_timeout, config.max_retries)
+
+    def test_estimate_issue_requests(self):
+        issue_filter = IssueFilter(1, 'team', ['Closed'],
+                                   Transform.from_args(), batch_size=3)
+        chunks = [[Branch('CFY-{0}-a'.format(n), None)] for n in range(7)]
+        # the keys of several repos are searched together
+        self.assertEqual(issue_filter.estimate_requests(chunks), 3)
+        self.assertEqual(issue_filter.estimate_requests(
+                chunks, frozenset(['CFY-0', 'CFY-1', 'CFY-2'])), 2)
+
+    @mock.patch('tattle.model.Branch.fetch_commit')
+    @mock.patch('tattle.model.Branch.get_json_branches')
+    @mock.patch('tattle.model.Repo.get_json_repos')
+    @mock.patch('tattle.model.get_first_json_page')
+    def test_incremental_query(self, mock_get_first_json_page,
+                               mock_get_json_repos, mock_get_json_branches,
+                               mock_fetch_commit):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.addCleanup(network.close_cache)
+        pushed_at = {'cloudify-manager': '2015-01-01T00:00:00Z',
+                     'cloudify-ui': '2015-01-01T00:00:00Z'}
+
+        def json_repo(name):
+            return {'name': name, 'owner': {'login': 'cloudify-cosmo'},
+                    'pushed_at': pushed_at[name],
+                    'updated_at': '2015-01-01T00:00:00Z'}
+
+        mock_get_first_json_page.side_effect = lambda *_, **__: (
+            [json_repo('cloudify-manager')], 2)
+        mock_get_json_repos.side_effect = lambda *_: [
+            json_repo('cloudify-ui')]
+        mock_get_json_branches.side_effect = lambda repo: [
+            {'name': name, 'commit': {'sha': repo.name + name}}
+            for name in ['master', 'CFY-1-' + repo.name]]
+        mock_fetch_commit.return_value = {'author': {'email': 'a@b.com'}}
+
+        def run_query(full_refresh=False):
+            config = QueryConfig('branch', 2,
+                                 Organization('cloudify-cosmo'), None,
+                                 cache_path=os.path.join(cache_dir,
+                                                         'cache.db'),
+                                 full_refresh=full_refresh)
+            bq = BranchQuery(config)
+            bq.attach_filters([NameFilter(1, ['CFY'])])
+            mock_get_json_branches.reset_mock()
+            bq.query()
+            return bq.result, sorted(
+                    call[0][0].name
+                    for call in mock_get_json_branches.call_args_list)
+
+        first_result, listed_repos = run_query()
+        self.assertEqual(listed_repos, ['cloudify-manager', 'cloudify-ui'])
+        self.assertEqual(len(first_result), 2)
+
+        pushed_at['cloudify-ui'] = '2015-01-02T00:00:00Z'
+        result, listed_repos = run_query()
+        self.assertEqual(listed_repos, ['cloudify-ui'])
+        self.assertEqual(result, first_result)
+        # the emails of the reused branches come from the commit cache
+        self.assertEqual(mock_fetch_commit.call_count, 2)
+
+        result, listed_repos = run_query(full_refresh=True)
+        self.assertEqual(listed_repos, ['cloudify-manager', 'cloudify-ui'])
+        self.assertEqual(result, first_result)
+
     @mock.patch('tattle.model.Issue.get_json_issues')
-    @mock.patch('tattle.model.Issue.generate_issue_keys')
-    def test_filter_with_issue_filter(self,
-                                      mock_generate_issue_keys,
-                                      mock_get_json_issues,
-                                      mock_update_branches_with_issues,
-                                      *_
-                                      ):
-        bq = BranchQuery(QueryConfig(None, None, None, None))
-        bq.filters = [IssueFilter(None, None, None, None)]
-        bq.filter(None)
-        self.assertTrue(mock_generate_issue_keys.called)
-        self.assertTrue(mock_get_json_issues.called)
-        self.assertTrue(mock_update_branches_with_issues.called)
+    @mock.patch('tattle.model.Branch.fetch_commit')
+    @mock.patch('tattle.model.Branch.get_json_branches')
+    @mock.patch('tattle.model.Repo.get_json_repos')
+    @mock.patch('tattle.model.get_first_json_page')
+    def test_offline_query(self, mock_get_first_json_page,
+                           mock_get_json_repos, mock_get_json_branches,
+                           mock_fetch_commit, mock_get_json_issues):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.addCleanup(network.close_cache)
+
+        def json_repo(name):
+            return {'name': name, 'owner': {'login': 'cloudify-cosmo'},
+                    'pushed_at': '2015-01-01T00:00:00Z',
+                    'updated_at': '2015-01-01T00:00:00Z'}
+
+        mock_get_first_json_page.side_effect = lambda *_, **__: (
+            [json_repo('cloudify-manager')], 2)
+        mock_get_json_repos.side_effect = lambda *_: [
+            json_repo('cloudify-ui')]
+        mock_get_json_branches.side_effect = lambda repo: [
+            {'name': name, 'commit': {'sha': repo.name + name}}
+            for name in ['master', 'CFY-1-a', 'CFY-2-b']]
+        mock_fetch_commit.return_value = {'author': {'email': 'a@b.com'}}
+        statuses = {'CFY-1': 'Closed', 'CFY-2': 'Open'}
+        mock_get_json_issues.side_effect = lambda keys, *_, **__: [
+            {'key': key, 'fields': {'status': {'name': statuses[key]}}}
+            if key in statuses else None
+            for key in keys]
+
+        def create_query(offline):
+            config = QueryConfig('branch', 2,
+                                 Organization('cloudify-cosmo'), None,
+                                 cache_path=None,
+                                 index_path=os.path.join(tmp_dir,
+                                                         'index.db'),
+                                 offline=offline)
+            bq = BranchQuery(config)
+            bq.attach_filters([
+                NameFilter(1, ['CFY']),
+                IssueFilter(2, 'CFY', ['Closed'],
+                            Transform('CFY-\d+', '', None, None))])
+            return bq
+
+        online = create_query(offline=False)
+        online.query()
+        create_query(offline=False).refresh_index()
+
+        requests_made = (mock_get_json_branches.call_count,
+                         mock_fetch_commit.call_count,
+                         mock_get_json_issues.call_count)
+        offline = create_query(offline=True)
+        offline.query()
+        self.assertEqual(len(online.result), 2)
+        self.assertEqual(offline.result, online.result)
+        self.assertEqual([branch.jira_issue for branch in offline.result],
+                         [Issue('CFY-1', 'Closed')] * 2)
+        self.assertEqual((mock_get_json_branches.call_count,
+                          mock_fetch_commit.call_count,
+                          mock_get_json_issues.call_count),
+                         requests_made)
+
+    @mock.patch('tattle.model.Issue.get_json_issues')
+    @mock.patch('tattle.model.Branch.fetch_commit')
+    @mock.patch('tattle.model.Branch.get_json_branches')
+    @mock.patch('tattle.model.get_first_json_page')
+    def test_query_batch(self, mock_get_first_json_page,
+                         mock_get_json_branches, mock_fetch_commit,
+                         mock_get_json_issues):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        mock_get_first_json_page.return_value = (
+            [{'name': 'cloudify-manager',
+              'owner': {'login': 'cloudify-cosmo'}}], 1)
+        mock_get_json_branches.return_value = [
+            {'name': name, 'commit': {'sha': name}}
+            for name in ['master', 'CFY-1-a', 'CFY-1-b', 'CFY-2-c']]
+        mock_fetch_commit.return_value = {'author': {'email': 'a@b.com'}}
+        mock_get_json_issues.side_effect = lambda keys, *_, **__: [
+            {'key': key, 'fields': {'status': {'name': 'Closed'}}}
+            for key in keys]
+
+        def create_query(name, filters):
+            config = QueryConfig('branch', 2,
+                                 Organization('cloudify-cosmo'),
+                                 os.path.join(tmp_dir, name + '.json'),
+                                 cache_path=None)
+            query = BranchQuery(config)
+            query.attach_filters(filters)
+            return query
+
+        transform = Transform('CFY-\d+', '', None, None)
+        queries = [create_query('all-cfy', [NameFilter(1, ['CFY'])]),
+                   create_query('cfy-1', [NameFilter(1, ['CFY-1'])]),
+                   create_query('closed', [
+                       NameFilter(1, ['CFY']),
+                       IssueFilter(2, 'CFY', ['Closed'], transform)]),
+                   create_query('closed-cfy-1', [
+                       NameFilter(1, ['CFY-1']),
+                       IssueFilter(2, 'CFY', ['Closed'], transform)])]
+        QueryBatch(queries).run()
+
+        self.assertEqual([len(query.result) for query in queries],
+                         [3, 2, 3, 2])
+        for query in queries:
+            with open(query.config.output_path) as report:
+                self.assertEqual(len(json.load(report)), len(query.result))
+        # the branches are listed once, and every commit and issue is
+        # looked up once
+        self.assertEqual(mock_get_json_branches.call_count, 1)
+        self.assertEqual(mock_fetch_commit.call_count, 3)
+        self.assertEqual(sorted(key for call in
+                                mock_get_json_issues.call_args_list
+                                for key in call[0][0]),
+                         ['CFY-1', 'CFY-2'])
+
+    @mock.patch('tattle.network.configure_cache')
+    @mock.patch('tattle.model.Issue.search_json_issues')
+    @mock.patch('tattle.model.Branch.fetch_commit')
+    @mock.patch('tattle.model.Branch.get_json_branches')
+    @mock.patch('tattle.model.get_first_json_page')
+    def test_issue_keys_are_batched_across_repos(self,
+                                                 mock_get_first_json_page,
+                                                 mock_get_json_branches,
+                                                 mock_fetch_commit,
+                                                 mock_search_json_issues,
+                                                 _):
+        mock_get_first_json_page.return_value = (
+            [{'name': 'repo-{0}'.format(n),
+              'owner': {'login': 'cloudify-cosmo'}} for n in range(5)], 1)
+        mock_get_json_branches.side_effect = lambda repo: [
+            {'name': 'CFY-{0}{1}-a'.format(repo.name[-1], n),
+             'commit': {'sha': repo.name + str(n)}}
+            for n in range(2)]
+        mock_fetch_commit.return_value = {'author': {'email': 'a@b.com'}}
+        mock_search_json_issues.side_effect = lambda keys, **_: [
+            {'key': key, 'fields': {'status': {'name': 'Closed'}}}
+            for key in keys]
+
+        bq = BranchQuery(QueryConfig('branch', 2,
+                                     Organization('cloudify-cosmo'), None,
+                                     cache_path=None))
+        bq.attach_filters([IssueFilter(1, 'CFY', ['Closed'],
+                                       Transform('CFY-\d+', '', None, None),
+                                       batch_size=4)])
+        bq.query()
+
+        self.assertEqual(len(bq.result), 10)
+        batches = [call[0][0] for call in
+                   mock_search_json_issues.call_args_list]
+        # the 10 keys of the 5 repos fill 3 searches, rather than 5
+        self.assertEqual(len(batches), 3)
+        self.assertEqual(len(set(key for batch in batches
+                                 for key in batch)), 10)
 
-    @mock.patch('tattle.model.NameFilter.filter')
-    @mock.patch('tattle.model.IssueFilter.filter')
     @mock.patch('tattle.model.Branch.update_branches_with_issues')
     @mock.patch('tattle.model.Issue.get_json_issues')
     @mock.patch('tattle.model.Issue.generate_issue_keys')
-    def test_filter_without_issue_filter(self,
-                                         mock_generate_issue_keys,
-                                         mock_get_json_issues,
-                                         mock_update_branches_with_issues,
-                                         *_
-                                         ):
+    def test_lookup_issues(self,
+                           mock_generate_issue_keys,
+                           mock_get_json_issues,
+                           mock_update_branches_with_issues):
+        mock_generate_issue_keys.return_value = ['CFY-1', 'CFY-1', None]
+        mock_get_json_issues.return_value = [None]
         bq = BranchQuery(QueryConfig(None, None, None, None))
-        bq.filters = [NameFilter(None, None)]
-        bq.filter(None)
-        self.assertFalse(mock_generate_issue_keys.called)
-        self.assertFalse(mock_get_json_issues.called)
-        self.assertFalse(mock_update_branches_with_issues.called)
+        bq.lookup_issues(None, IssueFilter(None, 'team', None, None))
+        # every key is looked up once
+        mock_get_json_issues.assert_called_once_with(
+                ['CFY-1'], 'team', batch_size=model.DEFAULT_JIRA_BATCH_SIZE)
+        self.assertTrue(mock_update_branches_with_issues.called)
+
+    @mock.patch('tattle.network.flush_cache')
+    @mock.patch('tattle.network.configure_cache')
+    @mock.patch('tattle.model.Branch.fetch_details')
+    @mock.patch('tattle.model.Branch.get_json_branches')
+    @mock.patch('tattle.model.Repo.get_json_repos')
+    @mock.patch('tattle.model.get_first_json_page')
+    def test_query(self, mock_get_first_json_page, mock_get_json_repos,
+                   mock_get_json_branches, mock_fetch_details, *_):
+        mock_get_first_json_page.return_value = (
+            [{'name': 'cloudify-manager',
+              'owner': {'login': 'cloudify-cosmo'}}],
+            2)
+        mock_get_json_repos.return_value = [
+            {'name': 'cloudify-ui', 'owner': {'login': 'cloudify-cosmo'}}]
+
+        def get_json_branches(repo):
+            return [{'name': name,
+                     'commit': {'url': 'https://api.github.com/repos/'
+                                       'cloudify-cosmo/{0}/commits/sha'
+                                       .format(repo.name)}}
+                    for name in ['master', 'CFY-1-' + repo.name]]
+
+        mock_get_json_branches.side_effect = get_json_branches
+        mock_fetch_details.return_value = {
+            'commit': {'commit': {'author': {'email': 'a@b.com'}}}}
+
+        bq = BranchQuery(QueryConfig('branch', 2,
+                                     Organization('cloudify-cosmo'), None))
+        bq.attach_filters([NameFilter(1, ['CFY'])])
+        bq.query()
+
+        org = Organization(u'cloudify-cosmo')
+        self.assertEqual(bq.result,
+                         [Branch('CFY-1-cloudify-manager',
+                                 Repo('cloudify-manager', org=org),
+                                 committer_email='a@b.com'),
+                          Branch('CFY-1-cloudify-ui',
+                                 Repo('cloudify-ui', org=org),
+                                 committer_email='a@b.com')])
+        self.assertEqual(mock_fetch_details.call_count, 2)
@@ -0,0 +1,325 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+import requests
+
+from tattle import metrics
+from tattle import network
+from tattle.concurrency import AdaptiveLimit
+
+
+class SessionsTestCase(unittest.TestCase):
+    def tearDown(self):
+        network.close_sessions()
+
+    def test_determine_pool_size(self):
+        self.assertEqual(network.determine_pool_size(None),
+                         network.DEFAULT_POOL_SIZE)
+        self.assertEqual(network.determine_pool_size(1), 1)
+        self.assertEqual(network.determine_pool_size(20), 20)
+        self.assertEqual(network.determine_pool_size(10 ** 6),
+                         network.MAX_POOL_SIZE)
+
+    def test_backend_for_url(self):
+        self.assertEqual(network.backend_for_url(
+                'https://api.github.com/orgs/cloudify-cosmo'),
+                network.GITHUB)
+        self.assertEqual(network.backend_for_url(
+                'https://cloudifysource.atlassian.net/rest/api/2/issue/'),
+                network.JIRA)
+
+    def test_get_session_is_shared_per_backend(self):
+        github_session = network.get_session(network.GITHUB)
+        self.assertIs(github_session, network.get_session(network.GITHUB))
+        self.assertIsNot(github_session, network.get_session(network.JIRA))
+
+    def test_configure_sessions_recreates_resized_sessions(self):
+        network.configure_sessions(network.DEFAULT_POOL_SIZE)
+        session = network.get_session(network.GITHUB)
+        network.configure_sessions(network.DEFAULT_POOL_SIZE)
+        self.assertIs(session, network.get_session(network.GITHUB))
+        network.configure_sessions(network.DEFAULT_POOL_SIZE + 1)
+        self.assertIsNot(session, network.get_session(network.GITHUB))
+        network.configure_sessions(network.DEFAULT_POOL_SIZE)
+
+    def test_determine_concurrency(self):
+        github_limit = network.MAX_CONCURRENT_REQUESTS[network.GITHUB]
+        self.assertEqual(network.determine_concurrency(network.GITHUB, None),
+                         github_limit)
+        self.assertEqual(network.determine_concurrency(network.GITHUB, 2), 2)
+        self.assertEqual(network.determine_concurrency(network.JIRA, 10 ** 6),
+                         network.MAX_CONCURRENT_REQUESTS[network.JIRA])
+
+    @mock.patch('tattle.network.get_session')
+    def test_concurrency_is_capped_per_backend(self, mock_get_session):
+        network.configure_sessions(2)
+        self.addCleanup(network.configure_sessions, None)
+        lock = threading.Lock()
+        in_flight = [0]
+        peak = [0]
+
+        def get(*_, **__):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+            return mock.Mock(status_code=200, headers={})
+
+        mock_get_session.return_value.get.side_effect = get
+        threads = [threading.Thread(target=network.send,
+                                    args=(network.JIRA, 'url'))
+                   for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(peak[0], 2)
+
+    @mock.patch('tattle.network.time.sleep')
+    @mock.patch('tattle.network.get_request_slots')
+    @mock.patch('tattle.network.get_session')
+    def test_congestion_lowers_the_concurrency(self, mock_get_session,
+                                               mock_get_request_slots, _):
+        slots = mock_get_request_slots.return_value = AdaptiveLimit(
+                'test', 8, 8)
+        mock_get_session.return_value.get.side_effect = [
+            mock.Mock(status_code=503, headers={}),
+            mock.Mock(status_code=404, headers={})]
+        network.send(network.GITHUB, 'url')
+        self.assertEqual(slots.limit, 4)
+        self.assertEqual(slots.in_flight, 0)
+
+    @mock.patch('tattle.network.get_session')
+    def test_get_uses_the_backend_session(self, mock_get_session):
+        network.get('https://api.github.com/orgs/cloudify-cosmo',
+                    auth=('u', 'p'))
+        mock_get_session.assert_called_once_with(network.GITHUB)
+        mock_get_session.return_value.get.assert_called_once_with(
+                'https://api.github.com/orgs/cloudify-cosmo', auth=('u', 'p'),
+                headers={}, timeout=network.DEFAULT_REQUEST_TIMEOUT)
+
+
+class HedgingTestCase(unittest.TestCase):
+    def setUp(self):
+        network.configure_hedging(True)
+        self.addCleanup(network.configure_hedging, False)
+
+    @mock.patch('tattle.network._hedge_budget')
+    @mock.patch('tattle.network._latencies')
+    @mock.patch('tattle.network._scheduler')
+    @mock.patch('tattle.network.get_request_slots')
+    @mock.patch('tattle.network.get_session')
+    def test_hedges_are_paced_and_recorded(self, mock_get_session,
+                                           mock_get_request_slots,
+                                           mock_scheduler, mock_latencies,
+                                           mock_hedge_budget):
+        slots = mock_get_request_slots.return_value = AdaptiveLimit(
+                'test', 8, 8)
+        mock_latencies.threshold.return_value = 0.01
+        mock_hedge_budget.try_hedge.return_value = True
+        mock_scheduler.update.return_value = False
+        first = mock.Mock(status_code=200, headers={})
+        hedge = mock.Mock(status_code=200, headers={})
+        hedge_recorded = threading.Event()
+        calls = []
+
+        def get(*_, **__):
+            calls.append(True)
+            if len(calls) == 1:
+                time.sleep(0.05)
+                return first
+            # the hedge loses
+            time.sleep(0.2)
+            return hedge
+
+        def update(_, response):
+            if response is hedge:
+                hedge_recorded.set()
+            return False
+
+        mock_get_session.return_value.get.side_effect = get
+        mock_scheduler.update.side_effect = update
+        sent_requests = metrics.get_value('requests.github')
+
+        self.assertIs(network.send(network.GITHUB, 'url'), first)
+        self.assertTrue(hedge_recorded.wait(5))
+        # the hedge waited for the rate limit and took a slot of its own
+        self.assertEqual(mock_scheduler.wait.call_count, 2)
+        self.assertEqual(metrics.get_value('requests.github') - sent_requests,
+                         2)
+        self.assertEqual(slots.in_flight, 0)
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    URL = 'https://api.github.com/orgs/cloudify-cosmo/repos'
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        network.configure_cache(os.path.join(self.cache_dir, 'cache.db'),
+                                100)
+        metrics.reset()
+
+    def tearDown(self):
+        network.close_cache()
+        shutil.rmtree(self.cache_dir)
+        metrics.reset()
+
+    @staticmethod
+    def create_response(status_code, text='', headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = text
+        response.headers.update(headers or {})
+        return response
+
+    def test_get_cache(self):
+        cache = network.get_cache('commits')
+        self.assertIs(network.get_cache('commits'), cache)
+        self.assertEqual(cache.path, os.path.join(self.cache_dir, 'cache.db'))
+        self.assertEqual(cache.namespace, 'commits')
+        network.close_cache()
+        self.assertIsNone(network.get_cache('commits'))
+
+    def test_generate_cache_key(self):
+        key = network.generate_cache_key(self.URL, ('u', 'p'))
+        self.assertEqual(key, network.generate_cache_key(self.URL,
+                                                         (u'u', u'p')))
+        self.assertNotEqual(key, network.generate_cache_key(self.URL, None))
+        self.assertNotEqual(key, network.generate_cache_key(self.URL,
+                                                            ('u', 'q')))
+
+    @mock.patch('tattle.network.get_session')
+    def test_not_modified_response_is_served_from_cache(self,
+                                                        mock_get_session):
+        session_get = mock_get_session.return_value.get
+        session_get.return_value = self.create_response(
+                200, '[1]', {'ETag': '"abc"', 'Link': '<next>; rel="next"'})
+
+        self.assertEqual(network.get(self.URL).text, '[1]')
+        session_get.assert_called_once_with(
+                self.URL, auth=None, headers={},
+                timeout=network.DEFAULT_REQUEST_TIMEOUT)
+
+        session_get.return_value = self.create_response(304)
+        response = network.get(self.URL)
+        session_get.assert_called_with(
+                self.URL, auth=None, headers={'If-None-Match': '"abc"'},
+                timeout=network.DEFAULT_REQUEST_TIMEOUT)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, '[1]')
+        self.assertEqual(response.headers['Link'], '<next>; rel="next"')
+        self.assertEqual(metrics.get_value('response_cache.hits'), 1)
+        self.assertEqual(metrics.get_value('response_cache.misses'), 1)
+
+    @mock.patch('tattle.network.get_session')
+    def test_responses_without_validators_are_not_cached(self,
+                                                         mock_get_session):
+        session_get = mock_get_session.return_value.get
+        session_get.return_value = self.create_response(200, '[1]')
+        network.get(self.URL)
+        network.get(self.URL)
+        session_get.assert_called_with(
+                self.URL, auth=None, headers={},
+                timeout=network.DEFAULT_REQUEST_TIMEOUT)
+
+    @mock.patch('tattle.network.get_session')
+    def test_uncached_requests_bypass_the_cache(self, mock_get_session):
+        session_get = mock_get_session.return_value.get
+        session_get.return_value = self.create_response(
+                200, '[1]', {'ETag': '"abc"'})
+        network.get(self.URL, cache=False)
+        network.get(self.URL)
+        session_get.assert_called_with(
+                self.URL, auth=None, headers={},
+                timeout=network.DEFAULT_REQUEST_TIMEOUT)
+        self.assertEqual(metrics.get_value('response_cache.misses'), 1)
+
+    @mock.patch('tattle.network.get_session')
+    def test_jira_requests_are_not_cached(self, mock_get_session):
+        url = 'https://cloudifysource.atlassian.net/rest/api/2/issue/CFY-1'
+        network.get(url)
+        mock_get_session.return_value.get.assert_called_once_with(
+                url, auth=None, headers={},
+                timeout=network.DEFAULT_REQUEST_TIMEOUT)
+
+
+@mock.patch('tattle.network.time.sleep')
+@mock.patch('tattle.network._scheduler', mock.Mock(**{'update.return_value':
+                                                      False}))
+@mock.patch('tattle.network.get_session')
+class RetriesTestCase(unittest.TestCase):
+    URL = 'https://api.github.com/orgs/cloudify-cosmo'
+
+    def tearDown(self):
+        network.configure_retries()
+
+    @staticmethod
+    def create_response(status_code):
+        response = requests.Response()
+        response.status_code = status_code
+        return response
+
+    def test_failed_requests_are_sent_again(self, mock_get_session,
+                                            mock_sleep):
+        session_get = mock_get_session.return_value.get
+        session_get.side_effect = [requests.exceptions.Timeout(),
+                                   self.create_response(502),
+                                   requests.exceptions.ConnectionError(),
+                                   self.create_response(200)]
+        sent_requests = metrics.get_value('requests.github')
+        self.assertEqual(network.send(network.GITHUB, self.URL).status_code,
+                         200)
+        self.assertEqual(session_get.call_count, 4)
+        self.assertEqual(mock_sleep.call_count, 3)
+        # every attempt is counted
+        self.assertEqual(metrics.get_value('requests.github') - sent_requests,
+                         4)
+
+    def test_client_errors_are_not_retried(self, mock_get_session,
+                                           mock_sleep):
+        session_get = mock_get_session.return_value.get
+        session_get.return_value = self.create_response(404)
+        self.assertEqual(network.send(network.GITHUB, self.URL).status_code,
+                         404)
+        self.assertEqual(session_get.call_count, 1)
+        self.assertFalse(mock_sleep.called)
+
+    def test_retries_are_exhausted(self, mock_get_session, mock_sleep):
+        network.configure_retries(request_timeout=5, max_retries=2)
+        session_get = mock_get_session.return_value.get
+        session_get.return_value = self.create_response(503)
+        with self.assertRaisesRegexp(network.RetriesExhaustedError,
+                                     'after 3 failed attempts.*503'):
+            network.send(network.GITHUB, self.URL)
+        self.assertEqual(session_get.call_count, 3)
+        self.assertEqual(session_get.call_args[1]['timeout'], 5)
+
+    def test_backoff_delay(self, *_):
+        for attempt in range(1, 10):
+            delay = network.backoff_delay(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(network.MAX_BACKOFF,
+                                            network.BACKOFF_BASE *
+                                            2 ** attempt))
@@ -0,0 +1,125 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import threading
+import unittest
+
+from tattle.executor import Executor
+from tattle.pipeline import Pipeline
+from tattle.pipeline import Stage
+
+
+class PipelineTestCase(unittest.TestCase):
+    def test_run(self):
+        pipeline = Pipeline([Stage('split', lambda n: range(n), 2),
+                             Stage('double', lambda n: [n * 2], 3)])
+        self.assertEqual(sorted(pipeline.run([1, 2, 3])),
+                         [0, 0, 0, 2, 2, 4])
+
+    def test_run_without_items(self):
+        pipeline = Pipeline([Stage('identity', lambda n: [n], 1)])
+        self.assertEqual(list(pipeline.run([])), [])
+
+    def test_items_are_dropped_by_empty_outputs(self):
+        pipeline = Pipeline([Stage('odd', lambda n: [n] if n % 2 else [], 2),
+                             Stage('identity', lambda n: [n], 2)])
+        self.assertEqual(sorted(pipeline.run(range(10))), [1, 3, 5, 7, 9])
+
+    def test_items_do_not_wait_for_slow_items_of_previous_stage(self):
+        release = threading.Event()
+
+        def first_stage(n):
+            if n == 0:
+                release.wait(5)
+            return [n]
+
+        pipeline = Pipeline([Stage('first', first_stage, 2),
+                             Stage('second', lambda n: [n], 1)])
+        outputs = pipeline.run([0, 1])
+        # item 1 leaves the pipeline while item 0 is still being processed
+        self.assertEqual(next(outputs), 1)
+        release.set()
+        self.assertEqual(list(outputs), [0])
+
+    def test_queues_are_bounded(self):
+        consumed = []
+
+        def source():
+            for n in range(100):
+                consumed.append(n)
+                yield n
+
+        pipeline = Pipeline([Stage('identity', lambda n: [n], 1,
+                                   queue_size=5)])
+        outputs = pipeline.run(source())
+        next(outputs)
+        self.assertLess(len(consumed), 10)
+        self.assertEqual(len(list(outputs)), 99)
+
+    def test_exceptions_are_raised(self):
+        def fail(n):
+            raise ValueError(n)
+
+        pipeline = Pipeline([Stage('fail', fail, 1)])
+        self.assertRaises(ValueError, list, pipeline.run([1]))
+
+    def test_run_on_shared_executor(self):
+        executor = Executor(1)
+        self.addCleanup(executor.shutdown)
+
+        def split(n):
+            # a nested map on the executor's only thread must not wait for
+            # a free thread
+            return executor.map(lambda m: m * 10, range(n))
+
+        pipeline = Pipeline([Stage('split', split, 2),
+                             Stage('identity', lambda n: [n], 2)],
+                            executor=executor)
+        self.assertEqual(sorted(pipeline.run([1, 2])), [0, 0, 10])
+
+    def test_batches(self):
+        batches = []
+
+        def record(batch):
+            batches.append(batch)
+            return batch
+
+        pipeline = Pipeline([Stage('identity', lambda n: [n], 2),
+                             Stage('batch', record, 1, batch_size=5,
+                                   weigh=lambda n: n)])
+        self.assertEqual(sorted(pipeline.run([2, 3, 4, 1, 6, 1])),
+                         [1, 1, 2, 3, 4, 6])
+        # batches are as heavy as the batch size allows, items heavier than
+        # it are processed alone, and the last items are not held back
+        for batch in batches:
+            self.assertTrue(sum(batch) <= 5 or len(batch) == 1)
+        self.assertLess(len(batches), 6)
+        self.assertEqual(sorted(n for batch in batches for n in batch),
+                         [1, 1, 2, 3, 4, 6])
+
+    def test_full_batches_are_not_held_back(self):
+        consumed = []
+
+        def source():
+            for n in range(100):
+                consumed.append(n)
+                yield n
+
+        pipeline = Pipeline([Stage('batch', lambda batch: [batch], 1,
+                                   queue_size=5, batch_size=3)])
+        outputs = pipeline.run(source())
+        self.assertEqual(next(outputs), [0, 1, 2])
+        self.assertLess(len(consumed), 10)
+        self.assertEqual(len(list(outputs)), 33)
@@ -0,0 +1,124 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import unittest
+
+import mock
+import requests
+
+from tattle import network
+from tattle import ratelimit
+from tattle.ratelimit import RateLimitScheduler
+
+KEY = ('github', 'user')
+NOW = 1000.0
+
+
+def create_response(status_code, remaining=None, limit=5000, reset=None,
+                    retry_after=None):
+    response = requests.Response()
+    response.status_code = status_code
+    if remaining is not None:
+        response.headers[ratelimit.RATE_LIMIT_REMAINING] = str(remaining)
+        response.headers[ratelimit.RATE_LIMIT_LIMIT] = str(limit)
+    if reset is not None:
+        response.headers[ratelimit.RATE_LIMIT_RESET] = str(reset)
+    if retry_after is not None:
+        response.headers[ratelimit.RETRY_AFTER] = str(retry_after)
+    return response
+
+
+@mock.patch('tattle.ratelimit.time.time', return_value=NOW)
+class RateLimitSchedulerTestCase(unittest.TestCase):
+    def test_no_delay_without_rate_limit_headers(self, *_):
+        scheduler = RateLimitScheduler()
+        self.assertEqual(scheduler.delay(KEY), 0)
+        scheduler.update(KEY, create_response(200))
+        self.assertEqual(scheduler.delay(KEY), 0)
+
+    def test_no_delay_while_the_budget_is_large(self, *_):
+        scheduler = RateLimitScheduler()
+        scheduler.update(KEY, create_response(200, remaining=4000,
+                                              reset=NOW + 100))
+        self.assertEqual(scheduler.delay(KEY), 0)
+        self.assertEqual(scheduler.delay(KEY), 0)
+        self.assertEqual(scheduler.remaining(KEY), 3998)
+
+    def test_small_budget_is_spread_until_reset(self, *_):
+        scheduler = RateLimitScheduler()
+        scheduler.update(KEY, create_response(200, remaining=10,
+                                              reset=NOW + 100))
+        self.assertEqual(scheduler.delay(KEY), 0)
+        self.assertEqual(scheduler.delay(KEY), 10)
+        self.assertAlmostEqual(scheduler.delay(KEY), 10 + 90 / 9.0)
+
+    def test_exhausted_budget_waits_for_reset(self, *_):
+        scheduler = RateLimitScheduler()
+        scheduler.update(KEY, create_response(200, remaining=0,
+                                              reset=NOW + 30))
+        self.assertEqual(scheduler.delay(KEY), 30)
+
+    def test_budgets_are_tracked_per_key(self, *_):
+        scheduler = RateLimitScheduler()
+        scheduler.update(KEY, create_response(200, remaining=0,
+                                              reset=NOW + 30))
+        self.assertEqual(scheduler.delay(('github', 'another_user')), 0)
+
+    def test_update_with_rate_limited_response(self, *_):
+        scheduler = RateLimitScheduler()
+        self.assertTrue(scheduler.update(
+                KEY, create_response(403, remaining=0, reset=NOW + 50)))
+        self.assertEqual(scheduler.delay(KEY), 50)
+
+    def test_update_with_retry_after(self, *_):
+        scheduler = RateLimitScheduler()
+        self.assertTrue(scheduler.update(
+                KEY, create_response(429, retry_after=20)))
+        self.assertEqual(scheduler.delay(KEY), 20)
+
+    def test_update_with_forbidden_response(self, *_):
+        scheduler = RateLimitScheduler()
+        self.assertFalse(scheduler.update(
+                KEY, create_response(403, remaining=100, reset=NOW + 50)))
+        self.assertEqual(scheduler.delay(KEY), 0)
+
+
+class SendTestCase(unittest.TestCase):
+    @mock.patch('tattle.network._scheduler')
+    @mock.patch('tattle.network.get_session')
+    def test_rate_limited_requests_are_sent_again(self, mock_get_session,
+                                                  mock_scheduler):
+        mock_scheduler.update.side_effect = [True, True, False]
+        network.send(network.GITHUB, 'url', auth=('user', 'pass'))
+        self.assertEqual(mock_get_session.return_value.get.call_count, 3)
+        mock_scheduler.wait.assert_called_with((network.GITHUB, 'user'))
+
+    @mock.patch('tattle.network._scheduler')
+    @mock.patch('tattle.network.get_session')
+    def test_send_gives_up_eventually(self, mock_get_session,
+                                      mock_scheduler):
+        mock_scheduler.update.return_value = True
+        self.assertRaises(network.RetriesExhaustedError,
+                          network.send, network.GITHUB, 'url')
+        self.assertEqual(mock_get_session.return_value.get.call_count,
+                         network.MAX_RATE_LIMIT_RETRIES + 1)
+
+    def test_secondary_rate_limit_without_retry_after(self, *_):
+        response = create_response(403)
+        response._content = '{"message": "You have exceeded a secondary ' \
+                            'rate limit. Please wait a few minutes."}'
+        self.assertTrue(RateLimitScheduler.is_rate_limited(response))
+        response._content = '{"message": "Resource not accessible"}'
+        self.assertFalse(RateLimitScheduler.is_rate_limited(response))
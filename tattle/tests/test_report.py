@@ -0,0 +1,158 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tattle import report
+from tattle.model import Branch
+from tattle.model import BranchQuery
+from tattle.model import Issue
+from tattle.model import Organization
+from tattle.model import QueryConfig
+from tattle.model import Repo
+from tattle.report import JsonReportWriter
+from tattle.report import NdjsonReportWriter
+from tattle.report import ReportWriter
+
+BRANCHES = [Branch('CFY-1-a', Repo('cloudify-manager',
+                                   org=Organization('cloudify-cosmo')),
+                   jira_issue=Issue('CFY-1', 'Closed'),
+                   committer_email='a@example.com'),
+            Branch('CFY-2-b', Repo('cloudify-ui',
+                                   org=Organization('cloudify-cosmo')))]
+EXPECTED_ITEMS = [
+    {'name': 'CFY-1-a',
+     'repo': {'name': 'cloudify-manager',
+              'organization': {'name': 'cloudify-cosmo'}},
+     'jira_issue': {'key': 'CFY-1', 'status': 'Closed'},
+     'committer_email': 'a@example.com',
+     'sha': None},
+    {'name': 'CFY-2-b',
+     'repo': {'name': 'cloudify-ui',
+              'organization': {'name': 'cloudify-cosmo'}},
+     'jira_issue': None,
+     'committer_email': None,
+     'sha': None}]
+
+
+class ReportWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def path(self, name):
+        return os.path.join(self.output_dir, 'reports', name)
+
+    def test_get_writer_class(self):
+        self.assertEqual(ReportWriter.get_writer_class('json'),
+                         JsonReportWriter)
+        self.assertEqual(ReportWriter.get_writer_class('ndjson'),
+                         NdjsonReportWriter)
+        self.assertRaises(KeyError, ReportWriter.get_writer_class, 'xml')
+
+    def test_json_report(self):
+        path = self.path('report.json')
+        with JsonReportWriter(path) as writer:
+            for branch in BRANCHES:
+                writer.write(branch)
+        with open(path) as report_file:
+            self.assertEqual(json.load(report_file), EXPECTED_ITEMS)
+
+    def test_empty_json_report(self):
+        path = self.path('report.json')
+        with JsonReportWriter(path):
+            pass
+        with open(path) as report_file:
+            self.assertEqual(json.load(report_file), [])
+
+    def test_ndjson_report_is_streamed_to_partial_file(self):
+        path = self.path('report.ndjson')
+        with NdjsonReportWriter(path) as writer:
+            writer.write(BRANCHES[0])
+            self.assertFalse(os.path.exists(path))
+            with open(path + report.PARTIAL_SUFFIX) as partial_file:
+                self.assertEqual(json.loads(partial_file.readline()),
+                                 EXPECTED_ITEMS[0])
+            writer.write(BRANCHES[1])
+
+        self.assertFalse(os.path.exists(path + report.PARTIAL_SUFFIX))
+        with open(path) as report_file:
+            self.assertEqual([json.loads(line) for line in report_file],
+                             EXPECTED_ITEMS)
+
+    def test_compressed_ndjson_report(self):
+        path = self.path('report.ndjson.gz')
+        with NdjsonReportWriter(path) as writer:
+            for branch in BRANCHES:
+                writer.write(branch)
+        report_file = gzip.open(path)
+        try:
+            self.assertEqual([json.loads(line) for line in report_file],
+                             EXPECTED_ITEMS)
+        finally:
+            report_file.close()
+
+    def test_report_is_discarded_on_error(self):
+        path = self.path('report.json')
+        try:
+            with JsonReportWriter(path) as writer:
+                writer.write(BRANCHES[0])
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(path + report.PARTIAL_SUFFIX))
+
+
+class QueryRunTestCase(unittest.TestCase):
+    class StubBranchQuery(BranchQuery):
+        def query(self, on_result=None):
+            self.streamed = on_result is not None
+            for branch in BRANCHES:
+                if on_result is not None:
+                    on_result(branch)
+            self.result = BRANCHES
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def run_query(self, output_format):
+        path = os.path.join(self.output_dir, 'report')
+        query = self.StubBranchQuery(QueryConfig('branch', 1, None, path,
+                                                 output_format=output_format))
+        query.run()
+        with open(path) as report_file:
+            return query.streamed, report_file.read()
+
+    def test_run_with_json_format(self):
+        streamed, contents = self.run_query('json')
+        self.assertFalse(streamed)
+        self.assertEqual(json.loads(contents), EXPECTED_ITEMS)
+
+    def test_run_with_ndjson_format(self):
+        streamed, contents = self.run_query('ndjson')
+        self.assertTrue(streamed)
+        self.assertEqual([json.loads(line) for line in contents.splitlines()],
+                         EXPECTED_ITEMS)
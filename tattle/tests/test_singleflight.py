@@ -0,0 +1,132 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import threading
+import time
+import unittest
+
+from tattle.singleflight import SingleFlight
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    def run_concurrently(self, single_flight, function, num_of_callers):
+        results = []
+        threads = [threading.Thread(
+                target=lambda: results.append(single_flight.do('key',
+                                                               function)))
+                   for _ in range(num_of_callers)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def test_concurrent_calls_are_coalesced(self):
+        release = threading.Event()
+        calls = []
+
+        def function():
+            calls.append(None)
+            release.wait(5)
+            return 'result'
+
+        single_flight = SingleFlight()
+        threads, results = self.run_concurrently(single_flight, function, 5)
+        while single_flight.coalesced < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['result'] * 5)
+        # once the call is complete, the function is called again
+        self.assertEqual(single_flight.do('key', function), 'result')
+        self.assertEqual(len(calls), 2)
+
+    def test_memoize(self):
+        calls = []
+        single_flight = SingleFlight(memoize=True)
+        for _ in range(3):
+            single_flight.do('key', lambda: calls.append(None) or 'result')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(single_flight.coalesced, 2)
+
+    def test_exceptions_are_raised_and_not_memoized(self):
+        single_flight = SingleFlight(memoize=True)
+
+        def fail():
+            raise ValueError()
+
+        self.assertRaises(ValueError, single_flight.do, 'key', fail)
+        self.assertEqual(single_flight.do('key', lambda: 'result'), 'result')
+
+    def test_none_is_not_memoized(self):
+        single_flight = SingleFlight(memoize=True)
+        self.assertIsNone(single_flight.do('key', lambda: None))
+        self.assertEqual(single_flight.do('key', lambda: 'result'), 'result')
+
+    def test_keys_are_independent(self):
+        single_flight = SingleFlight(memoize=True)
+        self.assertEqual(single_flight.do('a', lambda: 1), 1)
+        self.assertEqual(single_flight.do('b', lambda: 2), 2)
+
+    def test_do_many(self):
+        calls = []
+
+        def function(keys):
+            calls.append(sorted(keys))
+            return dict((key, key * 2) for key in keys if key != 3)
+
+        single_flight = SingleFlight(memoize=True)
+        self.assertEqual(single_flight.do_many([1, 2, 2, 3], function),
+                         {1: 2, 2: 4, 3: None})
+        self.assertEqual(single_flight.do_many([2, 4], function),
+                         {2: 4, 4: 8})
+        self.assertEqual(calls, [[1, 2, 3], [4]])
+
+    def test_do_many_does_not_memoize_none(self):
+        calls = []
+
+        def function(keys):
+            calls.append(sorted(keys))
+            return {1: None}
+
+        single_flight = SingleFlight(memoize=True)
+        self.assertEqual(single_flight.do_many([1, 2], function),
+                         {1: None, 2: None})
+        self.assertEqual(single_flight.do_many([1, 2], function),
+                         {1: None, 2: None})
+        self.assertEqual(calls, [[1, 2], [1, 2]])
+
+    def test_do_many_waits_for_running_keys(self):
+        release = threading.Event()
+        calls = []
+
+        def slow(keys):
+            calls.append(sorted(keys))
+            release.wait(5)
+            return dict((key, key) for key in keys)
+
+        single_flight = SingleFlight()
+        thread = threading.Thread(target=single_flight.do_many,
+                                  args=([1, 2], slow))
+        thread.start()
+        while not calls:
+            time.sleep(0.001)
+        threading.Timer(0.01, release.set).start()
+        self.assertEqual(single_flight.do_many([2, 3], slow),
+                         {2: 2, 3: 3})
+        thread.join()
+        self.assertEqual(calls, [[1, 2], [3]])
+        self.assertEqual(single_flight.coalesced, 1)
@@ -0,0 +1,131 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import requests
+
+from tattle import webhooks
+from tattle.index import BranchIndex
+from tattle.webhooks import WebhookServer
+
+PAYLOADS_DIR = os.path.join(os.path.dirname(__file__), 'resources',
+                            'webhooks')
+ORG = 'cloudify-cosmo'
+REPO = 'cloudify-manager'
+BRANCH = 'CFY-1-webhooks'
+SHA = '9049f1265b7d61be4a8904a9a27120d2064dab3b'
+STAMP = ['2015-01-01T00:00:00Z', '2015-01-01T00:00:00Z']
+
+
+def load_payload(name):
+    with open(os.path.join(PAYLOADS_DIR, name + '.json')) as payload_file:
+        return json.load(payload_file)
+
+
+class WebhooksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.index = BranchIndex(os.path.join(self.tmp_dir, 'index.db'))
+        self.addCleanup(self.index.close)
+        self.index.update_repo(ORG, REPO, STAMP, [('master', '1')])
+
+    def branches(self):
+        return [(row['name'], row['sha'], row['committer_email'])
+                for row in self.index.find_branches(ORG, repo_name=REPO)]
+
+    def spool(self, *events):
+        spool_dir = os.path.join(self.tmp_dir, 'spool')
+        os.mkdir(spool_dir)
+        for number, (event, payload_name) in enumerate(events):
+            path = os.path.join(spool_dir, '{0:03}.json'.format(number))
+            with open(path, 'w') as spool_file:
+                json.dump({'event': event,
+                           'payload': load_payload(payload_name)},
+                          spool_file)
+        return spool_dir
+
+    def test_replay(self):
+        self.assertTrue(webhooks.ingest_event(
+                self.index, 'create', load_payload('create-branch')))
+        self.assertEqual(self.branches(),
+                         [(BRANCH, None, None), ('master', '1', None)])
+
+        self.assertTrue(webhooks.ingest_event(
+                self.index, 'push', load_payload('push-branch')))
+        self.assertEqual(self.branches(),
+                         [(BRANCH, SHA, 'avia@gigaspaces.com'),
+                          ('master', '1', None)])
+
+        # a create event that arrives late doesn't forget the branch's head
+        webhooks.ingest_event(self.index, 'create',
+                              load_payload('create-branch'))
+        self.assertEqual(self.branches()[0],
+                         (BRANCH, SHA, 'avia@gigaspaces.com'))
+
+        self.assertFalse(webhooks.ingest_event(
+                self.index, 'push', load_payload('push-tag')))
+        self.assertTrue(webhooks.ingest_event(
+                self.index, 'delete', load_payload('delete-branch')))
+        self.assertEqual(self.branches(), [('master', '1', None)])
+
+    def test_other_events_are_ignored(self):
+        self.assertFalse(webhooks.ingest_event(
+                self.index, 'issues', load_payload('push-branch')))
+        self.assertEqual(self.branches(), [('master', '1', None)])
+
+    def test_ingest_spool(self):
+        spool_dir = self.spool(('create', 'create-branch'),
+                               ('push', 'push-branch'),
+                               ('push', 'push-tag'))
+        with open(os.path.join(spool_dir, '999.json'), 'w') as bad_file:
+            bad_file.write('{"event": "push"')
+
+        self.assertEqual(webhooks.ingest_spool(self.index, spool_dir), 2)
+        self.assertEqual(self.branches(),
+                         [(BRANCH, SHA, 'avia@gigaspaces.com'),
+                          ('master', '1', None)])
+        # applied events are removed, and failed ones are set aside
+        self.assertEqual(os.listdir(spool_dir), ['999.json.failed'])
+
+    def test_server(self):
+        secret = 'secret'
+        server = WebhookServer(self.index, ('127.0.0.1', 0), secret=secret)
+        self.addCleanup(server.server_close)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        url = 'http://127.0.0.1:{0}/'.format(server.server_address[1])
+
+        body = json.dumps(load_payload('push-branch'))
+        signature = 'sha1=' + hmac.new(secret, body, hashlib.sha1).hexdigest()
+        response = requests.post(url, data=body,
+                                 headers={'X-GitHub-Event': 'push'})
+        self.assertEqual(response.status_code, 401)
+        response = requests.post(url, data=body,
+                                 headers={'X-GitHub-Event': 'push',
+                                          'X-Hub-Signature': signature})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.branches()[0],
+                         (BRANCH, SHA, 'avia@gigaspaces.com'))
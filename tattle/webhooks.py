@@ -0,0 +1,181 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import SocketServer
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+
+from tattle import metrics
+from tattle.model import Branch
+from tattle.model import InternTable
+from tattle.model import Repo
+
+CREATE_EVENT = 'create'
+DELETE_EVENT = 'delete'
+PUSH_EVENT = 'push'
+PING_EVENT = 'ping'
+
+BRANCH_REF_TYPE = 'branch'
+BRANCH_REF_PREFIX = 'refs/heads/'
+
+EVENT_HEADER = 'X-GitHub-Event'
+SIGNATURE_HEADER = 'X-Hub-Signature'
+SIGNATURE_PREFIX = 'sha1='
+
+# a spooled event is a json file of the form
+# {"event": <X-GitHub-Event>, "payload": <the webhook's payload>}
+SPOOL_EVENT = 'event'
+SPOOL_PAYLOAD = 'payload'
+SPOOL_SUFFIX = '.json'
+FAILED_SUFFIX = '.failed'
+
+DEFAULT_WEBHOOK_HOST = '127.0.0.1'
+
+logger = logging.getLogger('model.webhooks')
+
+
+def ingest_event(index, event, payload, intern_table=None):
+    """Apply a GitHub webhook event to the branch index.
+
+    `create` and `delete` events of branches add and remove them, and
+    `push` events move their heads, along with the email of the head
+    commit's author. Events of tags and other events are ignored.
+
+    :param event: the event's type, as given by its X-GitHub-Event header
+    :param payload: the event's json payload
+    :return: whether the index was changed
+    :rtype: bool
+    """
+    if event in (CREATE_EVENT, DELETE_EVENT):
+        if payload.get('ref_type') != BRANCH_REF_TYPE:
+            return ignore(event)
+        branch_name = payload['ref']
+        sha = None
+        committer_email = None
+        deleted = event == DELETE_EVENT
+    elif event == PUSH_EVENT:
+        if not payload['ref'].startswith(BRANCH_REF_PREFIX):
+            return ignore(event)
+        branch_name = payload['ref'][len(BRANCH_REF_PREFIX):]
+        sha = payload.get('after')
+        head_commit = payload.get('head_commit') or {}
+        committer_email = head_commit.get('author', {}).get('email')
+        deleted = payload.get('deleted', False)
+    else:
+        return ignore(event)
+
+    repo = Repo.from_json(payload['repository'], intern_table=intern_table)
+    branch = Branch.from_json({'name': branch_name, 'commit': {'sha': sha}},
+                              repo=repo)
+    org_name = repo.organization.name
+    if deleted:
+        index.remove_branch(org_name, repo.name, branch.name)
+    else:
+        index.update_branch(org_name, repo.name, branch.name, branch.sha,
+                            committer_email=committer_email)
+    index.commit()
+    metrics.increment('webhooks.{0}'.format(event))
+    return True
+
+
+def ignore(event):
+    metrics.increment('webhooks.ignored')
+    return False
+
+
+def ingest_spool(index, spool_dir):
+    """Apply the events spooled in `spool_dir` to the branch index.
+
+    Events are applied in the order of their file names, and their files
+    are removed once they are applied. Files that could not be applied
+    are renamed with a .failed suffix, and are not retried.
+
+    :return: the number of events that were applied
+    :rtype: int
+    """
+    intern_table = InternTable()
+    file_names = sorted(name for name in os.listdir(spool_dir)
+                        if name.endswith(SPOOL_SUFFIX))
+    applied = 0
+    for file_name in file_names:
+        path = os.path.join(spool_dir, file_name)
+        try:
+            with open(path) as spool_file:
+                spooled = json.load(spool_file)
+            if ingest_event(index, spooled[SPOOL_EVENT],
+                            spooled[SPOOL_PAYLOAD],
+                            intern_table=intern_table):
+                applied += 1
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.warning('failed to ingest {0}: {1}'.format(path, e))
+            os.rename(path, path + FAILED_SUFFIX)
+        else:
+            os.remove(path)
+    return applied
+
+
+def verify_signature(secret, body, signature):
+    """Return whether `signature` is the X-Hub-Signature of `body`.
+    """
+    if not signature or not signature.startswith(SIGNATURE_PREFIX):
+        return False
+    expected = hmac.new(secret, body, hashlib.sha1).hexdigest()
+    return hmac.compare_digest(expected, signature[len(SIGNATURE_PREFIX):])
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """ Applies the webhook events POSTed to it to the server's index.
+    """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        secret = self.server.secret
+        if secret is not None and not verify_signature(
+                secret, body, self.headers.get(SIGNATURE_HEADER)):
+            self.send_response(401)
+            self.end_headers()
+            return
+
+        event = self.headers.get(EVENT_HEADER)
+        try:
+            payload = json.loads(body)
+            if event != PING_EVENT:
+                ingest_event(self.server.index, event, payload,
+                             intern_table=self.server.intern_table)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.warning('failed to ingest a {0} event: {1}'
+                           .format(event, e))
+            self.send_response(400)
+        else:
+            self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class WebhookServer(SocketServer.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, index, address, secret=None):
+        HTTPServer.__init__(self, address, WebhookHandler)
+        self.index = index
+        self.secret = secret
+        self.intern_table = InternTable()